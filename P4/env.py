@@ -0,0 +1,59 @@
+# This module implements environments, which map variables to values
+# during evaluation.
+#
+# An environment is a chain of frames. Each frame binds a few variables
+# and links to its parent, which binds the variables in enclosing scopes.
+# Frames are never modified after they are created: adding bindings
+# creates a new frame whose parent is the existing environment. This
+# means that environments can be shared freely (e.g., by closures)
+# without copying, and that adding a binding costs O(1).
+#
+# Variables are keyed by their declarations, not their names, so
+# bindings for different variables with the same name don't collide.
+#
+# P6 has its own environments (see P6/env.py), which find values by
+# lexical address instead. This language has no pass that computes
+# addresses, so its frames stay keyed by declaration.
+
+class Env:
+  def __init__(self, bindings : dict = None, parent = None):
+    # The bindings in this frame.
+    self.bindings = bindings if bindings is not None else {}
+
+    # The enclosing environment or None.
+    self.parent = parent
+
+  def bind(self, var, value):
+    # Returns a new environment that extends this one with the
+    # binding var=value.
+    return Env({var:value}, self)
+
+  def extend(self, vars, values):
+    # Returns a new environment that extends this one with the
+    # bindings vi=vi for each pair of variables and values.
+    return Env(dict(zip(vars, values)), self)
+
+  def __getitem__(self, var):
+    # Returns the value bound to var in the nearest frame.
+    env = self
+    while env is not None:
+      if var in env.bindings:
+        return env.bindings[var]
+      env = env.parent
+    raise KeyError(var)
+
+  def __contains__(self, var):
+    env = self
+    while env is not None:
+      if var in env.bindings:
+        return True
+      env = env.parent
+    return False
+
+  def __str__(self):
+    bs = []
+    env = self
+    while env is not None:
+      bs += [f"{str(x)}={str(v)}" for x, v in env.bindings.items()]
+      env = env.parent
+    return f"[{','.join(bs)}]"
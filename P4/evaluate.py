@@ -1,9 +1,6 @@
 from lang import *
 from lookup import *
-
-import copy
-
-clone = copy.deepcopy
+from env import Env
 
 # This module implements implements big-step semantics.
 #
@@ -13,6 +10,9 @@ clone = copy.deepcopy
 # [x1=v1, ...]. In other words, S is the call stack. Note that v
 # is a value, represented by a Python object.
 #
+# The store is an environment (see env.py). Adding bindings creates
+# a new environment, so stores are never copied.
+#
 # There is one main function: evaluate, which computes the 
 # value of an expression. A value is a Python object.
 
@@ -22,7 +22,7 @@ class Closure:
   # during application.
   def __init__(self, abs, env):
     self.abs = abs
-    self.env = clone(env)
+    self.env = env
 
 def eval_bool(e, store):
   # Evaluate a boolean literal:
@@ -72,10 +72,10 @@ def eval_abs(e, store):
   # --------------------- E-Abs
   # S |- \x.e ! <\x.e, S>
   #
-  # Note that the store is cloned; it is not a reference to the current
-  # store (that would cause real problems). We could also compute the
-  # minimal store by finding all free variables in e and then building
-  # a single mapping of those values.
+  # Note that the store is shared, not cloned. Stores are never
+  # modified, so later bindings cannot affect the closure. We could
+  # also compute the minimal store by finding all free variables in
+  # e and then building a single mapping of those values.
   return Closure(e, store)
 
 def eval_app(e, store):
@@ -98,7 +98,7 @@ def eval_app(e, store):
 
   v = evaluate(e.rhs, store)
 
-  return evaluate(c.abs.expr, c.env + {c.abs.var: v})
+  return evaluate(c.abs.expr, c.env.bind(c.abs.var, v))
 
 def eval_lambda(e, store):
   # The evaluation of a lambda abstraction produces a closure.
@@ -119,13 +119,11 @@ def eval_call(e, store):
     args += [evaluate(a, store)]
 
   # Build the new environment.
-  env = clone(c.env)
-  for i in range(len(args)):
-    env[c.abs.vars[i]] = args[i]
+  env = c.env.extend(c.abs.vars, args)
 
   return evaluate(c.abs.expr, env)
 
-def evaluate(e, store = {}):
+def evaluate(e, store = Env()):
   # Evaluate an expression. The store is a stack of mappings from
   # variables to values.
 
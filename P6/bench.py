@@ -0,0 +1,668 @@
+from lang import *
+from env import Env
+import copy
+import importlib
+import pygen
+import share as share_module
+import edit as edit_module
+import fold as fold_module
+import simplify as simplify_module
+import inline as inline_module
+import cse as cse_module
+import cek as cek_module
+import collect as collect_module
+import escape as escape_module
+import memo as memo_module
+import vm
+import os
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+clone = copy.deepcopy
+
+# Benchmarks for the implementation. Each section builds its own
+# program(s) and prints a small report. Run with:
+#
+#   python bench.py
+
+# The modules that implement each pass. We need the modules (not just
+# the functions re-exported by lang) so that we can swap out their
+# dispatch functions.
+evaluate_module = importlib.import_module("evaluate")
+check_module = importlib.import_module("check")
+lookup_module = importlib.import_module("lookup")
+subst_module = importlib.import_module("subst")
+reduce_module = importlib.import_module("reduce")
+
+def chain(table, defaults = ()):
+  # Build a function that dispatches through the given table using a
+  # chain of 'if type(e) is X' tests, in table order. This is how every
+  # pass dispatched before the tables were introduced. The defaults
+  # supply trailing arguments omitted by the caller.
+  lines = ["def dispatch(e, *args):"]
+  lines += ["  args += defaults[len(args):]"]
+  env = {"defaults": defaults}
+  for i, t in enumerate(table):
+    env[f"T{i}"] = t
+    env[f"H{i}"] = table[t]
+    lines += [f"  if type(e) is T{i}:", f"    return H{i}(e, *args)"]
+  lines += ["  assert False"]
+  exec("\n".join(lines), env)
+  return env["dispatch"]
+
+def direct(table, defaults = ()):
+  # Build a function that dispatches through the given table using a
+  # single lookup, as the passes do now.
+  def dispatch(e, *args):
+    args += defaults[len(args):]
+    return table[type(e)](e, *args)
+  return dispatch
+
+def mixed():
+  # Returns a program that contains every kind of expression.
+  variant = VariantType([("x", int), ("y", bool)])
+  body = AddExpr(
+    IfExpr(
+      AndExpr(OrExpr(LtExpr("x", 10), GtExpr("x", 3)), NotExpr(EqExpr("x", 4))),
+      MulExpr("x", 2),
+      SubExpr("x", 1)),
+    AddExpr(
+      DivExpr(RemExpr("x", 3), 1),
+      AddExpr(
+        NegExpr(DerefExpr("r")),
+        IfExpr(AndExpr(NeExpr("x", 0), GeExpr("x", 1)), 1, 0))))
+  fn = LambdaExpr([("x", int), ("r", RefType(int))], body)
+  return TupleExpr([
+    CallExpr(fn, [5, NewExpr(3)]),
+    CallExpr(clone(fn), [IfExpr(LeExpr(2, 3), 7, 8), NewExpr(4)]),
+    ProjExpr(TupleExpr([1, True, 2]), 2),
+    MemberExpr(RecordExpr([("a", 1), ("b", False)]), "b"),
+    CaseExpr(VariantExpr(("x", 3), variant), [
+      ("x", "a", True),
+      ("y", "b", False),
+    ]),
+    AssignExpr(NewExpr(1), 2),
+  ])
+
+def time_pass(name, module, attr, table, run, n, defaults = ()):
+  # Time n runs of a pass using chained and then direct dispatch.
+  original = getattr(module, attr)
+  results = []
+  for make in (chain, direct):
+    dispatch = make(table, defaults)
+    setattr(module, attr, dispatch)
+    results += [timeit.timeit(run, number=n)]
+  setattr(module, attr, original)
+  before, after = results
+  print(f"{name:<10} {before * 1e3 / n:8.3f} ms {after * 1e3 / n:8.3f} ms {before / after:6.2f}x")
+
+def bench_dispatch():
+  print("---- dispatch ----")
+
+  # Per-node cost: dispatch each kind of expression to a handler that
+  # does nothing, so that we measure only the cost of selecting it.
+  samples = {
+    BoolExpr: BoolExpr(True),
+    AndExpr: AndExpr(True, True),
+    OrExpr: OrExpr(True, True),
+    NotExpr: NotExpr(True),
+    IfExpr: IfExpr(True, 1, 2),
+    IntExpr: IntExpr(0),
+    AddExpr: AddExpr(1, 2),
+    SubExpr: SubExpr(1, 2),
+    MulExpr: MulExpr(1, 2),
+    DivExpr: DivExpr(1, 2),
+    RemExpr: RemExpr(1, 2),
+    NegExpr: NegExpr(1),
+    EqExpr: EqExpr(1, 2),
+    NeExpr: NeExpr(1, 2),
+    LtExpr: LtExpr(1, 2),
+    GtExpr: GtExpr(1, 2),
+    LeExpr: LeExpr(1, 2),
+    GeExpr: GeExpr(1, 2),
+    IdExpr: IdExpr("x"),
+    LambdaExpr: LambdaExpr([("x", int)], "x"),
+    CallExpr: CallExpr("f", []),
+    NewExpr: NewExpr(1),
+    DerefExpr: DerefExpr("r"),
+    AssignExpr: AssignExpr("r", 1),
+    TupleExpr: TupleExpr([]),
+    ProjExpr: ProjExpr(TupleExpr([1]), 0),
+    RecordExpr: RecordExpr([]),
+    MemberExpr: MemberExpr(RecordExpr([("a", 1)]), "a"),
+    VariantExpr: VariantExpr(("a", 1), VariantType([("a", int)])),
+    CaseExpr: CaseExpr(1, []),
+  }
+  noop = {t: (lambda e: e) for t in evaluate_module.evaluators}
+  before = chain(noop)
+  after = direct(noop)
+  n = 100000
+  print(f"{'node':<12} {'before':>9} {'after':>9}")
+  for t, e in samples.items():
+    b = timeit.timeit(lambda: before(e), number=n)
+    a = timeit.timeit(lambda: after(e), number=n)
+    print(f"{t.__name__:<12} {b * 1e9 / n:6.0f} ns {a * 1e9 / n:6.0f} ns")
+
+  # Whole-pass cost over a program that mixes all kinds of nodes.
+  print(f"{'pass':<10} {'before':>11} {'after':>11} {'speedup':>7}")
+  p = resolve(mixed())
+  check(p)
+  n = 200
+  time_pass("resolve", lookup_module, "resolve",
+            lookup_module.resolvers, lambda: resolve(p), n, (lookup_module.Scopes(),))
+
+  # Types are cached in the tree, so check a fresh copy each time.
+  fresh = [resolve(mixed()) for i in range(2 * n)]
+  time_pass("check", check_module, "do_check",
+            check_module.checkers, lambda: check(fresh.pop()), n)
+  time_pass("evaluate", evaluate_module, "evaluate",
+            evaluate_module.evaluators, lambda: evaluate(p, Env(), []), n)
+  time_pass("subst", subst_module, "subst",
+            subst_module.substituters, lambda: subst(p, {}), n)
+
+def bench_closures():
+  print("---- closures ----")
+
+  # Create a closure that captures one variable under stacks of
+  # increasing depth. Each binding on the stack refers to a small
+  # tuple. The baseline copies the whole stack, as closures did
+  # before capture sets were computed.
+  print(f"{'depth':>6} {'before':>10} {'after':>10} {'bytes':>8}")
+  n = 200
+  for depth in (1, 10, 100, 1000):
+    vars = [VarDecl(f"v{i}", int) for i in range(depth)] + [VarDecl("x", int)]
+    values = [evaluate_module.Tuple([i, i]) for i in range(depth)] + [0]
+    stack = dict(zip(vars, values))
+    env = Env(values)
+    e = LambdaExpr([("y", int)], AddExpr("x", "y"))
+    stk = lookup_module.Scopes()
+    stk.push(lookup_module.Scope(vars))
+    resolve(e, stk)
+    b = timeit.timeit(lambda: clone(stack), number=n)
+    a = timeit.timeit(lambda: evaluate(e, env, []), number=n)
+
+    tracemalloc.start()
+    cs = [evaluate(e, env, []) for i in range(n)]
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{depth:>6} {b * 1e6 / n:7.1f} us {a * 1e6 / n:7.1f} us {size // n:>8}")
+
+def arithmetic(depth):
+  # Returns a balanced tree of arithmetic operations over x.
+  if depth == 0:
+    return IdExpr("x")
+  ops = [AddExpr, MulExpr, SubExpr]
+  return ops[depth % 3](arithmetic(depth - 1), arithmetic(depth - 1))
+
+def arithmetic_program(depth):
+  # (\(x).<arithmetic>)(1)
+  return CallExpr(LambdaExpr([("x", int)], arithmetic(depth)), [1])
+
+def calls_program(n):
+  # (\(f).f(f(...f(0)...)))(\(x).x + 1)
+  body = IntExpr(0)
+  for i in range(n):
+    body = CallExpr("f", [body])
+  inc = LambdaExpr([("x", int)], AddExpr("x", 1))
+  fn = LambdaExpr([("f", FnType([int], int))], body)
+  return CallExpr(fn, [inc])
+
+def bench_compile():
+  print("---- compile ----")
+  print(f"{'workload':<12} {'evaluate':>11} {'compiled':>17} {'python':>17}")
+  workloads = [
+    ("arithmetic", arithmetic_program(10)),
+    ("calls", calls_program(150)),
+  ]
+  n = 50
+  for name, p in workloads:
+    p = resolve(p)
+    check(p)
+    run = compile_expr(p)
+    prog = pygen.translate(p)
+    assert evaluate(p, Env(), []) == run(Env(), []) == prog.run()
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=n)
+    a = timeit.timeit(lambda: run(Env(), []), number=n)
+    c = timeit.timeit(lambda: prog.run(), number=n)
+    print(f"{name:<12} {b * 1e3 / n:8.3f} ms "
+          f"{a * 1e3 / n:8.3f} ms {b / a:5.1f}x "
+          f"{c * 1e3 / n:8.3f} ms {b / c:5.1f}x")
+
+def recursive_program(n):
+  # Computes n by counting down through a recursive function. The
+  # language has no recursive bindings, so the function calls itself
+  # through a reference:
+  #
+  #   (\(r). {r = \(n). if n == 0 then 0 else 1 + (*r)(n - 1), (*r)(N)}.1)
+  #     (new \(n).0)
+  #
+  r = VarDecl("r", RefType(FnType([int], int)))
+  m = VarDecl("n", int)
+  k = VarDecl("n", int)
+  body = IfExpr(EqExpr(IdExpr(m), 0), 0,
+    AddExpr(1, CallExpr(DerefExpr(IdExpr(r)), [SubExpr(IdExpr(m), 1)])))
+  fn = LambdaExpr([m], body)
+  main = ProjExpr(TupleExpr([
+    AssignExpr(IdExpr(r), fn),
+    CallExpr(DerefExpr(IdExpr(r)), [n])
+  ]), 1)
+  return CallExpr(LambdaExpr([r], main), [NewExpr(LambdaExpr([k], 0))])
+
+def bench_vm():
+  print("---- vm ----")
+  print(f"{'workload':<16} {'evaluate':>11} {'vm':>17}")
+  workloads = [
+    ("recursion 50", recursive_program(50)),
+    ("arithmetic 12", arithmetic_program(12)),
+  ]
+  n = 20
+  machine = vm.Machine()
+  for name, p in workloads:
+    resolve(p)
+    check(p)
+    code = vm.assemble(p)
+    assert evaluate(p, Env(), []) == machine.run(code)
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=n)
+    a = timeit.timeit(lambda: machine.run(code), number=n)
+    print(f"{name:<16} {b * 1e3 / n:8.3f} ms {a * 1e3 / n:8.3f} ms {b / a:5.1f}x")
+
+  # The machine does not use Python's stack for calls, so it can run
+  # recursions that evaluate cannot.
+  p = resolve(recursive_program(10000))
+  check(p)
+  code = vm.assemble(p)
+  t = timeit.timeit(lambda: machine.run(code), number=1)
+  try:
+    evaluate(p, Env(), [])
+    status = "ok"
+  except RecursionError:
+    status = "RecursionError"
+  print(f"{'recursion 10000':<16} {status:>11} {t * 1e3:8.3f} ms")
+
+def nested_and(depth):
+  # true and (true and (... and not false))
+  e = NotExpr(BoolExpr(False))
+  for i in range(depth):
+    e = AndExpr(BoolExpr(True), e)
+  return e
+
+def bench_reduce():
+  print("---- reduce ----")
+  # Stepping from the root costs time proportional to the depth of the
+  # redex on every step. Reducing with a focus does not.
+  print(f"{'workload':<16} {'root':>11} {'focus':>17}")
+  def root(e):
+    while reduce_module.is_reducible(e):
+      e = reduce_module.step(e)
+    return e
+  for depth in [100, 200, 400]:
+    e = nested_and(depth)
+    assert str(root(e)) == str(reduce_module.reduce(e, False))
+    b = timeit.timeit(lambda: root(e), number=5)
+    a = timeit.timeit(lambda: reduce_module.reduce(e, False), number=5)
+    print(f"{'and ' + str(depth):<16} {b * 1e3 / 5:8.3f} ms {a * 1e3 / 5:8.3f} ms {b / a:5.1f}x")
+
+def record_program(n):
+  # (\(r:{f0:Int, ..., fn:Int}). r.f0 + ... + r.fn)({f0=0, ..., fn=n})
+  #
+  # The sum is built as a balanced tree.
+  t = RecordType([(f"f{i}", int) for i in range(n)])
+  r = VarDecl("r", t)
+  def sum(lo, hi):
+    if hi - lo == 1:
+      return MemberExpr(IdExpr(r), f"f{lo}")
+    mid = (lo + hi) // 2
+    return AddExpr(sum(lo, mid), sum(mid, hi))
+  return CallExpr(LambdaExpr([r], sum(0, n)),
+    [RecordExpr([(f"f{i}", i) for i in range(n)])])
+
+def bench_types():
+  print("---- types ----")
+  # Types are interned, so checking a program takes time proportional
+  # to its size, even when its types are large.
+  print(f"{'workload':<16} {'check':>11} {'per field':>13}")
+  for n in [250, 500, 1000, 2000]:
+    p = resolve(record_program(n))
+    # Types are cached in the tree, so check a fresh copy each time.
+    fresh = [copy.deepcopy(p) for i in range(5)]
+    t = timeit.timeit(lambda: check(fresh.pop()), number=5) / 5
+    print(f"{'record ' + str(n):<16} {t * 1e3:8.3f} ms {t * 1e6 / n:8.3f} us")
+
+def bench_share():
+  print("---- share ----")
+  # A program made of many copies of the same closed expression. After
+  # sharing, memory and checking time track the number of distinct
+  # subterms.
+  print(f"{'sharing':<10} {'memory':>12} {'check':>11}")
+  def program():
+    p = arithmetic_program(8)
+    return resolve(TupleExpr([clone(p) for i in range(100)]))
+  for shared in [False, True]:
+    tracemalloc.start()
+    p = program()
+    s = share_module.Sharing()
+    if shared:
+      p = share_module.share(p, s)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t = timeit.timeit(lambda: check(p), number=1)
+    print(f"{str(shared):<10} {size // 1024:>9} KB {t * 1e3:8.3f} ms")
+
+def bench_edit():
+  print("---- edit ----")
+  # Checking again after an edit only checks the edited expression's
+  # ancestors.
+  print(f"{'workload':<16} {'full':>11} {'incremental':>17}")
+  for depth in [8, 10, 12]:
+    p = resolve(arithmetic_program(depth))
+    fresh = [clone(p) for i in range(5)]
+    b = timeit.timeit(lambda: check(fresh.pop()), number=5) / 5
+
+    edit_module.link(p)
+    check(p)
+    leaf = p.fn.expr
+    while type(leaf) is not IdExpr:
+      leaf = leaf.lhs
+    def change():
+      nonlocal leaf
+      leaf = edit_module.replace(leaf, IdExpr(leaf.ref))
+      check(p)
+    a = timeit.timeit(change, number=100) / 100
+    print(f"{'arithmetic ' + str(depth):<16} {b * 1e3:8.3f} ms {a * 1e3:8.3f} ms {b / a:5.1f}x")
+
+def nested_lambdas(depth):
+  # \(x0).\(x1)...\(xn).xn + x0
+  e = AddExpr(f"x{depth - 1}", "x0")
+  for i in range(depth - 1, -1, -1):
+    e = LambdaExpr([(f"x{i}", int)], e)
+  return e
+
+def bench_resolve():
+  print("---- resolve ----")
+  # Entering a scope and looking up a name take constant time, so the
+  # time per binder does not grow with nesting depth.
+  print(f"{'depth':>6} {'resolve':>11} {'per binder':>13}")
+  for depth in [20, 40, 80, 120]:
+    p = nested_lambdas(depth)
+    t = timeit.timeit(lambda: resolve(p), number=20) / 20
+    print(f"{depth:>6} {t * 1e3:8.3f} ms {t * 1e6 / depth:8.3f} us")
+
+def literal_program(depth):
+  # (\(x).<arithmetic>)(1), where every leaf but the last is a literal.
+  def tree(depth, last):
+    if depth == 0:
+      return IdExpr("x") if last else IntExpr(depth + 2)
+    ops = [AddExpr, MulExpr, SubExpr]
+    return ops[depth % 3](tree(depth - 1, False), tree(depth - 1, last))
+  return CallExpr(LambdaExpr([("x", int)], tree(depth, True)), [1])
+
+def bench_fold():
+  print("---- fold ----")
+  # Folding evaluates literal subtrees once, ahead of time.
+  print(f"{'workload':<16} {'eliminated':>10} {'before':>11} {'after':>11} {'speedup':>7}")
+  n = 20
+  for depth in [6, 8, 10]:
+    p = resolve(literal_program(depth))
+    check(p)
+    q = fold_module.Folding()
+    folded = fold_module.fold(clone(p), q)
+    assert evaluate(p, Env(), []) == evaluate(folded, Env(), [])
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=n) / n
+    a = timeit.timeit(lambda: evaluate(folded, Env(), []), number=n) / n
+    print(f"{'literals ' + str(depth):<16} {q.eliminated:>10} {b * 1e3:8.3f} ms {a * 1e3:8.3f} ms {b / a:6.1f}x")
+
+def data_program(depth):
+  # (\(x).<sum>)(1), where each leaf of the sum takes apart a tuple,
+  # a record or a variant as soon as it is built.
+  t = VariantType([("a", int), ("b", int)])
+  def leaf(i):
+    if i % 3 == 0:
+      return ProjExpr(TupleExpr([IdExpr("x"), IntExpr(i)]), 1)
+    if i % 3 == 1:
+      return MemberExpr(RecordExpr([("p", IdExpr("x")), ("q", IntExpr(i))]), "p")
+    return CaseExpr(VariantExpr(("a", IntExpr(i)), t),
+      [("a", "y", AddExpr("y", "x")), ("b", "y", "y")])
+  def tree(depth, i):
+    if depth == 0:
+      return leaf(i)
+    return AddExpr(tree(depth - 1, 2 * i), tree(depth - 1, 2 * i + 1))
+  return CallExpr(LambdaExpr([("x", int)], tree(depth, 0)), [1])
+
+def bench_simplify():
+  print("---- simplify ----")
+  # Known constructors are not built at runtime.
+  print(f"{'workload':<16} {'eliminated':>10} {'before':>11} {'after':>11} {'speedup':>7}")
+  n = 20
+  for depth in [6, 8, 10]:
+    p = resolve(data_program(depth))
+    check(p)
+    q = simplify_module.Simplifying()
+    simple = simplify_module.simplify(clone(p), q)
+    assert evaluate(p, Env(), []) == evaluate(simple, Env(), [])
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=n) / n
+    a = timeit.timeit(lambda: evaluate(simple, Env(), []), number=n) / n
+    print(f"{'data ' + str(depth):<16} {q.eliminated:>10} {b * 1e3:8.3f} ms {a * 1e3:8.3f} ms {b / a:6.1f}x")
+
+def bench_inline():
+  print("---- inline ----")
+  # Inlining removes the closures and frames of small functions.
+  print(f"{'workload':<16} {'inlined':>10} {'before':>11} {'after':>11} {'speedup':>7}")
+  n = 20
+  for calls in [10, 25, 50]:
+    p = resolve(calls_program(calls))
+    check(p)
+    q = inline_module.Inlining()
+    inlined = inline_module.inline(clone(p), q)
+    assert evaluate(p, Env(), []) == evaluate(inlined, Env(), [])
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=n) / n
+    a = timeit.timeit(lambda: evaluate(inlined, Env(), []), number=n) / n
+    print(f"{'calls ' + str(calls):<16} {q.inlined:>10} {b * 1e3:8.3f} ms {a * 1e3:8.3f} ms {b / a:6.1f}x")
+
+def formula_program(n):
+  # (\(a, b, c).<sum of n terms (a * b + c) * (a * b - c)>)(2, 3, 4)
+  def term():
+    return MulExpr(AddExpr(MulExpr("a", "b"), "c"), SubExpr(MulExpr("a", "b"), "c"))
+  body = term()
+  for i in range(n - 1):
+    body = AddExpr(body, term())
+  return CallExpr(LambdaExpr([("a", int), ("b", int), ("c", int)], body), [2, 3, 4])
+
+def bench_cse():
+  print("---- cse ----")
+  # Repeated pure subexpressions are computed once.
+  print(f"{'workload':<16} {'eliminated':>10} {'before':>11} {'after':>11} {'speedup':>7}")
+  n = 20
+  for terms in [4, 16, 64]:
+    p = resolve(formula_program(terms))
+    check(p)
+    q = cse_module.Eliminating()
+    eliminated = cse_module.cse(clone(p), q)
+    assert evaluate(p, Env(), []) == evaluate(eliminated, Env(), [])
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=n) / n
+    a = timeit.timeit(lambda: evaluate(eliminated, Env(), []), number=n) / n
+    print(f"{'formula ' + str(terms):<16} {q.eliminated:>10} {b * 1e3:8.3f} ms {a * 1e3:8.3f} ms {b / a:6.1f}x")
+
+def fib_program(n):
+  # Computes the nth Fibonacci number with a recursive function, which
+  # calls itself through a reference (see recursive_program).
+  r = VarDecl("r", RefType(FnType([int], int)))
+  m = VarDecl("n", int)
+  k = VarDecl("n", int)
+  body = IfExpr(LtExpr(IdExpr(m), 2), IdExpr(m),
+    AddExpr(CallExpr(DerefExpr(IdExpr(r)), [SubExpr(IdExpr(m), 1)]),
+            CallExpr(DerefExpr(IdExpr(r)), [SubExpr(IdExpr(m), 2)])))
+  main = ProjExpr(TupleExpr([
+    AssignExpr(IdExpr(r), LambdaExpr([m], body)),
+    CallExpr(DerefExpr(IdExpr(r)), [n])
+  ]), 1)
+  return CallExpr(LambdaExpr([r], main), [NewExpr(LambdaExpr([k], 0))])
+
+def bench_memo():
+  print("---- memo ----")
+  # Memoizing the calls of fib makes the number of calls evaluated
+  # linear in n, rather than exponential.
+  print(f"{'workload':<16} {'hits':>10} {'before':>11} {'after':>11} {'speedup':>7}")
+  for n in [10, 15, 20]:
+    p = resolve(fib_program(n))
+    check(p)
+    m = memo_module.Memo()
+    q = memo_module.memoize(clone(p), m)
+    assert evaluate(p, Env(), []) == evaluate(q, Env(), [])
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=1)
+    a = timeit.timeit(lambda: evaluate(q, Env(), []), number=1)
+    print(f"{'fib ' + str(n):<16} {m.hits:>10} {b * 1e3:8.3f} ms {a * 1e3:8.3f} ms {b / a:6.1f}x")
+
+def case_program(labels, n):
+  # A tuple of n case expressions over a variant with the given number
+  # of labels, each selecting the last case.
+  t = VariantType([(f"l{i}", int) for i in range(labels)])
+  def case():
+    v = VariantExpr((f"l{labels - 1}", 1), t)
+    return CaseExpr(v, [(f"l{i}", "x", AddExpr("x", i)) for i in range(labels)])
+  return TupleExpr([case() for i in range(n)])
+
+def bench_case():
+  print("---- case ----")
+  # Cases are selected by indexing a table with the variant's tag,
+  # rather than comparing the label with each case in turn.
+  print(f"{'workload':<16} {'search':>11} {'table':>11} {'speedup':>7}")
+  def search(e, v1):
+    label = v1.type.fields[v1.tag].id
+    for c in e.cases:
+      if c.id == label:
+        return c
+  n = 20
+  for labels in [2, 8, 32]:
+    p = resolve(case_program(labels, 200))
+    check(p)
+    original = evaluate_module.select
+    evaluate_module.select = search
+    b = timeit.timeit(lambda: evaluate(p, Env(), []), number=n) / n
+    evaluate_module.select = original
+    a = timeit.timeit(lambda: evaluate(p, Env(), []), number=n) / n
+    print(f"{'labels ' + str(labels):<16} {b * 1e3:8.3f} ms {a * 1e3:8.3f} ms {b / a:6.1f}x")
+
+def allocating_program(n):
+  # A loop of n iterations, each of which allocates a cell that is
+  # garbage by the next (see the collect section of test.py).
+  r = VarDecl("r", RefType(FnType([int], int)))
+  m = VarDecl("n", int)
+  c = VarDecl("c", RefType(int))
+  loop = LambdaExpr([m], IfExpr(EqExpr(IdExpr(m), 0), 0,
+    CallExpr(LambdaExpr([c], CallExpr(DerefExpr(IdExpr(r)), [SubExpr(IdExpr(m), 1)])),
+      [NewExpr(IdExpr(m))])))
+  main = ProjExpr(TupleExpr([
+    AssignExpr(IdExpr(r), loop),
+    CallExpr(DerefExpr(IdExpr(r)), [n])
+  ]), 1)
+  return CallExpr(LambdaExpr([r], main), [NewExpr(LambdaExpr([("k", int)], 0))])
+
+def bench_collect():
+  print("---- collect ----")
+  # Without collection the heap grows with every iteration; with it,
+  # the heap is bounded by the threshold.
+  print(f"{'workload':<16} {'heap':>8} {'before':>11} {'heap':>8} {'after':>11} {'pauses':>11} {'longest':>11}")
+  for n in [10000, 100000]:
+    p = resolve(allocating_program(n))
+    check(p)
+    heap = []
+    b = timeit.timeit(lambda: cek_module.execute(p, None, heap), number=1)
+    g = collect_module.Collector(1000)
+    a = timeit.timeit(lambda: cek_module.execute(p, None, [], g), number=1)
+    print(f"{'loop ' + str(n):<16} {len(heap):>8} {b * 1e3:8.3f} ms "
+          f"{g.peak:>8} {a * 1e3:8.3f} ms {g.pause * 1e3:8.3f} ms {g.longest * 1e3:8.3f} ms")
+
+def bench_escape():
+  print("---- escape ----")
+  # The cell allocated on each iteration of the loop does not escape,
+  # so it is kept in the frame of the iteration rather than the heap.
+  print(f"{'workload':<16} {'heap':>8} {'before':>11} {'heap':>8} {'after':>11} {'cells':>8}")
+  for n in [10000, 100000]:
+    p = resolve(allocating_program(n))
+    check(p)
+    s = escape_module.Escaping()
+    q = escape_module.escape(clone(p), s)
+    assert s.local == 1
+    heap = []
+    b = timeit.timeit(lambda: cek_module.execute(p, None, heap), number=1)
+    cells = evaluate_module.Cell.allocations
+    local = []
+    a = timeit.timeit(lambda: cek_module.execute(q, None, local), number=1)
+    cells = evaluate_module.Cell.allocations - cells
+    print(f"{'loop ' + str(n):<16} {len(heap):>8} {b * 1e3:8.3f} ms "
+          f"{len(local):>8} {a * 1e3:8.3f} ms {cells:>8}")
+
+def bench_memory():
+  print("---- memory ----")
+  # The size of expressions and values, measured by building a program
+  # of a million nodes and a heap of a million records.
+  print(f"{'workload':<16} {'count':>10} {'bytes':>12} {'per item':>9}")
+  n = 1000000
+
+  tracemalloc.start()
+  e = IdExpr("x")
+  for i in range(n // 2):
+    e = AddExpr(e, IntExpr(i))
+  size, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  print(f"{'nodes':<16} {n:>10} {size:>12} {size / n:9.1f}")
+  del e
+
+  t = RecordType([("x", int), ("y", int)])
+  tracemalloc.start()
+  heap = [evaluate_module.Record(t, (i, i)) for i in range(n)]
+  size, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  print(f"{'records':<16} {n:>10} {size:>12} {size / n:9.1f}")
+
+def time_checked():
+  # Returns the time to resolve, check and evaluate a few programs.
+  # See bench_checked.
+  ps = [recursive_program(50), arithmetic_program(10), fib_program(12)]
+  def run():
+    for p in ps:
+      resolve(p)
+      check(p)
+      evaluate(p, Env(), [])
+  return timeit.timeit(run, number=5) / 5
+
+def bench_checked():
+  print("---- checked ----")
+  # The arguments of resolve, check, evaluate and compile are checked
+  # by the checked decorator (see decorate.py). Its setting is read at
+  # import, so each mode is timed in a new process.
+  print(f"{'mode':<16} {'time':>11} {'wrapper':>8}")
+  code = "import bench; print(bench.time_checked())"
+  times = {}
+  for mode in ["1", "10", "0"]:
+    env = dict(os.environ, P6_CHECKED=mode)
+    out = subprocess.run([sys.executable, "-c", code], env=env,
+      capture_output=True, text=True, check=True).stdout
+    times[mode] = float(out)
+  for mode, t in times.items():
+    share = (t - times["0"]) / t
+    print(f"{'P6_CHECKED=' + mode:<16} {t * 1e3:8.3f} ms {share:7.1%}")
+
+if __name__ == "__main__":
+  bench_dispatch()
+  bench_closures()
+  bench_compile()
+  bench_vm()
+  bench_reduce()
+  bench_types()
+  bench_share()
+  bench_edit()
+  bench_resolve()
+  bench_fold()
+  bench_simplify()
+  bench_inline()
+  bench_cse()
+  bench_memo()
+  bench_checked()
+  bench_memory()
+  bench_case()
+  bench_collect()
+  bench_escape()
@@ -0,0 +1,129 @@
+from lang import *
+
+# This module computes the free variables of expressions. It runs after
+# name resolution (it compares declarations, not names).
+#
+# The free variables of a lambda abstraction are the variables captured
+# by its closures:
+#
+#   \(x1, ..., xn).e1 captures FV(e1) - {x1, ..., xn}
+#
+# Resolution computes the capture set of each abstraction along with the
+# addresses of variables (see lookup.py), so this analysis is only used
+# by transformations that need the free variables of other expressions.
+#
+# The free variables of an expression are returned as a dict whose keys
+# are declarations (the values are unused). This gives us a set that
+# preserves the order in which variables are first referenced.
+
+def free_leaf(e):
+  # FV(b) = FV(n) = {}
+  return {}
+
+def free_unary(e):
+  # FV(@e1) = FV(e1)
+  return free(e.expr)
+
+def free_binary(e):
+  # FV(e1 @ e2) = FV(e1) + FV(e2)
+  return free_all([e.lhs, e.rhs])
+
+def free_if(e):
+  # FV(if e1 then e2 else e3) = FV(e1) + FV(e2) + FV(e3)
+  return free_all([e.cond, e.true, e.false])
+
+def free_id(e):
+  # FV(x) = {x}
+  return {e.ref: None}
+
+def free_lambda(e):
+  # FV(\(x1, ..., xn).e1) = FV(e1) - {x1, ..., xn}
+  fv = free(e.expr)
+  for v in e.vars:
+    fv.pop(v, None)
+  return fv
+
+def free_call(e):
+  # FV(e0(e1, ..., en)) = FV(e0) + FV(e1) + ... + FV(en)
+  return free_all([e.fn] + e.args)
+
+def free_tuple(e):
+  return free_all(e.elems)
+
+def free_proj(e):
+  return free(e.obj)
+
+def free_record(e):
+  return free_all([f.value for f in e.fields])
+
+def free_member(e):
+  return free(e.obj)
+
+def free_variant(e):
+  return free(e.field.value)
+
+def free_case(e):
+  # FV(case e0 of <li=xi> => ei) = FV(e0) + (FV(ei) - {xi}) + ...
+  fv = free(e.expr)
+  for c in e.cases:
+    fc = free(c.expr)
+    fc.pop(c.var, None)
+    fv.update(fc)
+  return fv
+
+def free_all(es):
+  # Returns the union of the free variables of each expression in es.
+  fv = {}
+  for x in es:
+    fv.update(free(x))
+  return fv
+
+# Maps each kind of expression to the function that computes its free
+# variables. See the corresponding table in evaluate.py.
+freevars = {
+  # Boolean expressions
+  BoolExpr: free_leaf,
+  AndExpr: free_binary,
+  OrExpr: free_binary,
+  NotExpr: free_unary,
+  IfExpr: free_if,
+
+  # Arithmetic expressions
+  IntExpr: free_leaf,
+  AddExpr: free_binary,
+  SubExpr: free_binary,
+  MulExpr: free_binary,
+  DivExpr: free_binary,
+  RemExpr: free_binary,
+  NegExpr: free_unary,
+
+  # Relational expressions
+  EqExpr: free_binary,
+  NeExpr: free_binary,
+  LtExpr: free_binary,
+  GtExpr: free_binary,
+  LeExpr: free_binary,
+  GeExpr: free_binary,
+
+  # Lambda expressions
+  IdExpr: free_id,
+  LambdaExpr: free_lambda,
+  CallExpr: free_call,
+
+  # Reference expressions
+  NewExpr: free_unary,
+  DerefExpr: free_unary,
+  AssignExpr: free_binary,
+
+  # Data expressions
+  TupleExpr: free_tuple,
+  ProjExpr: free_proj,
+  RecordExpr: free_record,
+  MemberExpr: free_member,
+  VariantExpr: free_variant,
+  CaseExpr: free_case,
+}
+
+def free(e):
+  # Returns the free variables of e.
+  return freevars[type(e)](e)
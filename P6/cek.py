@@ -0,0 +1,338 @@
+from lang import *
+from env import Env
+import evaluate as evaluation
+from evaluate import Closure, Location, Cell, Tuple, Record, Variant, select
+
+# This module implements an abstract machine for evaluating expressions.
+# It computes the same values as evaluate, but it does not use Python's
+# stack. Instead, the work remaining to be done is kept in an explicit
+# stack of continuations, so the depth of the expressions it can evaluate
+# is limited only by memory.
+#
+# That holds for the machine itself, but not for the passes that prepare
+# its input. An expression with variables must be resolved, and one with
+# records or variants checked, and both passes are recursive; so only
+# expressions that need neither (like 1 + (1 + ...)) can be nested deeper
+# than Python's recursion limit. The machine rejects a variable that has
+# not been resolved, rather than running with an unknown address.
+#
+# The machine is in the style of the CEK machine: its state consists of
+# the expression being evaluated (the control), the environment in which
+# it is evaluated, and the continuation. Here, the continuation is split
+# into two stacks:
+#
+#   - The work stack holds the tasks remaining to be done. A task either
+#     evaluates an expression in an environment or consumes the values
+#     of previously evaluated operands.
+#   - The value stack holds the values of evaluated operands.
+#
+# Each task is a triple (fn, a, b). The machine repeatedly pops a task
+# and calls fn(a, b, m), where m is the machine. To evaluate an
+# expression e in environment S, the task is (step, e, S), where step
+# is the function that evaluates that kind of expression. A step pushes
+# the value of e or the tasks that will compute it.
+#
+# Because a call's task is finished before the task that evaluates the
+# called function's body is pushed, tail calls run in constant space.
+
+class Machine:
+  # The state of the machine. If a collector is given, it manages the
+  # heap (see collect.py).
+  def __init__(self, heap : list, collector = None):
+    self.work = []
+    self.values = []
+    self.heap = heap
+    self.collector = collector
+
+  def eval(self, e : Expr, stack : Env):
+    # Push a task that evaluates e in stack.
+    self.work.append((steps[type(e)], e, stack))
+
+  def then(self, fn, a = None, b = None):
+    # Push a task that continues with fn(a, b, m).
+    self.work.append((fn, a, b))
+
+  def roots(self):
+    # Returns the values that the remaining work may use: the values on
+    # the value stack, and the environments (and any other values) of
+    # the tasks on the work stack.
+    rs = list(self.values)
+    for fn, a, b in self.work:
+      rs += [a, b]
+    return rs
+
+# Continuations
+#
+# These consume the values of operands from the value stack and push
+# the value of their expression.
+
+def k_unary(fn, _, m):
+  vs = m.values
+  vs[-1] = fn(vs[-1])
+
+def k_binary(fn, _, m):
+  vs = m.values
+  v2 = vs.pop()
+  vs[-1] = fn(vs[-1], v2)
+
+def k_if(e, stack, m):
+  # Continue with the branch selected by the condition.
+  if m.values.pop():
+    m.eval(e.true, stack)
+  else:
+    m.eval(e.false, stack)
+
+def k_call(n, _, m):
+  # Call the closure below the top n values (the arguments).
+  vs = m.values
+  args = vs[len(vs) - n:]
+  del vs[len(vs) - n:]
+  c = vs.pop()
+  if type(c) is not Closure:
+    raise Exception("cannot apply a non-closure to an argument")
+  m.eval(c.abs.expr, Env(args, c.env))
+
+def k_new(local, _, m):
+  if local:
+    m.values[-1] = Cell(m.values[-1])
+    return
+  heap = m.heap
+  evaluation.writes += 1
+  if m.collector is not None:
+    m.values[-1] = m.collector.allocate(heap, m.values[-1], m.roots)
+    return
+  heap.append(m.values[-1])
+  m.values[-1] = Location(len(heap) - 1)
+
+def k_deref(_, __, m):
+  l1 = m.values[-1]
+  if type(l1) is not Location:
+    if type(l1) is Cell:
+      m.values[-1] = l1.value
+      return
+    raise Exception("invalid reference")
+  m.values[-1] = m.heap[l1.index]
+
+def k_assign(_, __, m):
+  # The right operand was evaluated first, so the location is on top.
+  vs = m.values
+  l1 = vs.pop()
+  if type(l1) is not Location:
+    if type(l1) is Cell:
+      l1.value = vs[-1]
+      vs[-1] = None
+      return
+    raise Exception("invalid reference")
+  m.heap[l1.index] = vs[-1]
+  evaluation.writes += 1
+  vs[-1] = None
+
+def k_tuple(n, _, m):
+  vs = m.values
+  t = Tuple(vs[len(vs) - n:])
+  del vs[len(vs) - n:]
+  vs.append(t)
+
+def k_proj(n, _, m):
+  m.values[-1] = m.values[-1].values[n]
+
+def k_record(t, _, m):
+  vs = m.values
+  n = len(t.fields)
+  r = Record(t, tuple(vs[len(vs) - n:]))
+  del vs[len(vs) - n:]
+  vs.append(r)
+
+def k_member(offset, _, m):
+  m.values[-1] = m.values[-1].values[offset]
+
+def k_variant(e, _, m):
+  m.values[-1] = Variant(e.variant, e.tag, m.values[-1])
+
+def k_case(e, stack, m):
+  # Continue with the case matching the variant.
+  v1 = m.values.pop()
+  m.eval(select(e, v1).expr, Env([v1.value], stack))
+
+# Steps
+#
+# These evaluate an expression by pushing its value, or by pushing a
+# continuation and then the tasks that evaluate its operands. Tasks are
+# popped in the reverse order in which they are pushed, so operands are
+# pushed last to first.
+
+def step_value(e, stack, m):
+  m.values.append(e.value)
+
+def step_unary(e, stack, m, fn):
+  m.then(k_unary, fn)
+  m.eval(e.expr, stack)
+
+def step_binary(e, stack, m, fn):
+  # Operands are evaluated left to right.
+  m.then(k_binary, fn)
+  m.eval(e.rhs, stack)
+  m.eval(e.lhs, stack)
+
+def step_and(e, stack, m):
+  # NOTE: This is not short-circuiting.
+  step_binary(e, stack, m, lambda v1, v2: v1 and v2)
+
+def step_or(e, stack, m):
+  # NOTE: This is not short-circuiting.
+  step_binary(e, stack, m, lambda v1, v2: v1 or v2)
+
+def step_not(e, stack, m):
+  step_unary(e, stack, m, lambda v1: not v1)
+
+def step_if(e, stack, m):
+  m.then(k_if, e, stack)
+  m.eval(e.cond, stack)
+
+def step_add(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 + v2)
+
+def step_sub(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 - v2)
+
+def step_mul(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 * v2)
+
+def step_div(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 / v2)
+
+def step_rem(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 % v2)
+
+def step_neg(e, stack, m):
+  step_unary(e, stack, m, lambda v1: -v1)
+
+def step_eq(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 == v2)
+
+def step_ne(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 != v2)
+
+def step_lt(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 < v2)
+
+def step_gt(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 > v2)
+
+def step_le(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 <= v2)
+
+def step_ge(e, stack, m):
+  step_binary(e, stack, m, lambda v1, v2: v1 >= v2)
+
+def step_id(e, stack, m):
+  if e.depth is None:
+    raise Exception(f"unresolved name '{e.id}'")
+  m.values.append(stack.lookup(e.depth, e.slot))
+
+def step_lambda(e, stack, m):
+  m.values.append(Closure(e, Env([stack.lookup(d, s) for d, s in e.addresses])))
+
+def step_call(e, stack, m):
+  m.then(k_call, len(e.args))
+  for a in reversed(e.args):
+    m.eval(a, stack)
+  m.eval(e.fn, stack)
+
+def step_new(e, stack, m):
+  m.then(k_new, e.local)
+  m.eval(e.expr, stack)
+
+def step_deref(e, stack, m):
+  m.then(k_deref)
+  m.eval(e.expr, stack)
+
+def step_assign(e, stack, m):
+  # Operands are evaluated right to left.
+  m.then(k_assign)
+  m.eval(e.lhs, stack)
+  m.eval(e.rhs, stack)
+
+def step_tuple(e, stack, m):
+  m.then(k_tuple, len(e.elems))
+  for x in reversed(e.elems):
+    m.eval(x, stack)
+
+def step_proj(e, stack, m):
+  m.then(k_proj, e.index)
+  m.eval(e.obj, stack)
+
+def step_record(e, stack, m):
+  m.then(k_record, e.type)
+  for f in reversed(e.fields):
+    m.eval(f.value, stack)
+
+def step_member(e, stack, m):
+  m.then(k_member, e.offset)
+  m.eval(e.obj, stack)
+
+def step_variant(e, stack, m):
+  m.then(k_variant, e)
+  m.eval(e.field.value, stack)
+
+def step_case(e, stack, m):
+  m.then(k_case, e, stack)
+  m.eval(e.expr, stack)
+
+# Maps each kind of expression to the function that evaluates it. See
+# the corresponding table in evaluate.py.
+steps = {
+  # Boolean expressions
+  BoolExpr: step_value,
+  AndExpr: step_and,
+  OrExpr: step_or,
+  NotExpr: step_not,
+  IfExpr: step_if,
+
+  # Arithmetic expressions
+  IntExpr: step_value,
+  AddExpr: step_add,
+  SubExpr: step_sub,
+  MulExpr: step_mul,
+  DivExpr: step_div,
+  RemExpr: step_rem,
+  NegExpr: step_neg,
+
+  # Relational expressions
+  EqExpr: step_eq,
+  NeExpr: step_ne,
+  LtExpr: step_lt,
+  GtExpr: step_gt,
+  LeExpr: step_le,
+  GeExpr: step_ge,
+
+  # Functional expressions
+  IdExpr: step_id,
+  LambdaExpr: step_lambda,
+  CallExpr: step_call,
+
+  # Reference expressions
+  NewExpr: step_new,
+  DerefExpr: step_deref,
+  AssignExpr: step_assign,
+
+  # Data expressions
+  TupleExpr: step_tuple,
+  ProjExpr: step_proj,
+  RecordExpr: step_record,
+  MemberExpr: step_member,
+  VariantExpr: step_variant,
+  CaseExpr: step_case,
+}
+
+def execute(e : Expr, stack : Env = None, heap : list = None, collector = None):
+  # Evaluate e using the machine. The stack and heap are as for
+  # evaluate. If a collector is given, unreachable locations of the
+  # heap are collected as it runs. Returns the value of e.
+  m = Machine(heap if heap is not None else [], collector)
+  m.eval(e, stack if stack is not None else Env())
+  work = m.work
+  while work:
+    fn, a, b = work.pop()
+    fn(a, b, m)
+  return m.values.pop()
@@ -1,5 +1,6 @@
 from lang import *
 from decorate import *
+from edit import dirty
 
 # Implements the typing relation G |- e : T, which is to say that 
 # every expression e has some type T. If not, the expression 
@@ -14,38 +15,20 @@ from decorate import *
 @checked
 def is_same_type(t1 : Type, t2 : Type):
   # Returns true if t1 and t2 are the same type (if both are types).
-
-  # Quick reject. t1 and t2 are not objects
-  # of the same type.
-  if type(t1) is not type(t2):
-    return False
-
-  if type(t1) is BoolType:
-    return True
-  
-  if type(t1) is IntType:
-    return True
-
-  if type(t1) is FnType:
-    for a, b in zip(t1.parms, t2.parms):
-      if not is_same_type(a, b):
-        return False
-    return is_same_type(t1.ret, t2.ret)
-
-  if type(t1) is RefType:
-    return is_same_type(t1.ref, t2.ref)
-
-  assert False
+  #
+  # Types are interned (see lang.py), so equal types are the same
+  # object.
+  return t1 is t2
 
 @checked
 def is_bool(t : Type):
   # Returns true if t is Bool.
-  return t == boolType;
+  return t is boolType
 
 @checked
 def is_int(t : Type):
   # Returns true if t is Int.
-  return t == intType;
+  return t is intType
 
 @checked
 def is_function(t : Type):
@@ -105,7 +88,7 @@ def check_logical_unary(e : Expr, op : str):
   #  G |- e1 : Bool
   # -----------------
   # G |- op e1 : Bool
-  if is_bool(e.expr):
+  if has_bool(e.expr):
     return boolType
 
   raise Exception(f"invalid operands to '{op}'")
@@ -116,7 +99,7 @@ def check_logical_binary(e : Expr, op : str):
   # -------------------------------
   #    G |- e1 op e2 : Bool
   
-  if is_bool(e.lhs) and is_bool(e.rhs):
+  if has_bool(e.lhs) and has_bool(e.rhs):
     return boolType
   
   raise Exception(f"invalid operands to '{op}'")
@@ -129,17 +112,44 @@ def check_and(e : Expr):
 def check_or(e : Expr):
   return check_logical_binary(e, "or")
 
+@checked
+def check_not(e : Expr):
+  return check_logical_unary(e, "not")
+
+@checked
+def check_if(e : Expr):
+  # G |- e1 : Bool   G |- e2 : T   G |- e3 : T
+  # ------------------------------------------ T-If
+  #      G |- if e1 then e2 else e3 : T
+  if not has_bool(e.cond):
+    raise Exception("condition is not boolean")
+
+  if not has_same_type(e.true, e.false):
+    raise Exception("branch type mismatch")
+
+  return check(e.true)
+
 @checked
 def check_arithmetic_binary(e : Expr, op : str):
   # G |- e1 : Int   G |- e2 : Int
   # ----------------------------- T-Add
   #      G |- e1 op e2 : Int
   
-  if is_int(e.lhs) and is_int(e.rhs):
+  if has_int(e.lhs) and has_int(e.rhs):
     return intType
   
   raise Exception(f"invalid operands to '{op}'")
 
+@checked
+def check_arithmetic_unary(e : Expr, op : str):
+  #    G |- e1 : Int
+  # ----------------- T-Neg
+  # G |- op e1 : Int
+  if has_int(e.expr):
+    return intType
+
+  raise Exception(f"invalid operands to '{op}'")
+
 @checked
 def check_add(e : Expr):
   return check_arithmetic_binary(e, "+")
@@ -160,6 +170,10 @@ def check_div(e : Expr):
 def check_rem(e : Expr):
   return check_arithmetic_binary(e, "%")
 
+@checked
+def check_neg(e : Expr):
+  return check_arithmetic_unary(e, "-")
+
 @checked
 def check_relational(e : Expr, op : str):
   # G |- e1 : T1   G |- e2 : T2
@@ -212,7 +226,7 @@ def check_lambda(e : Expr):
   #  G, xi:Ti :- e0 : T0
   # ---------------------
   # G |- \(xi:Ti).e0 : (Ti) -> T0
-  parms = [check(p) for p in e.vars]
+  parms = [p.type for p in e.vars]
   ret =  check(e.expr)
   return FnType(parms, ret)
 
@@ -297,11 +311,11 @@ def check_member(e : Expr):
     raise Exception("operand is not a tuple")
   
   # Map the id to its corresponding field decl.
-  # TODO: We could build the lookup in the record type.
-  fs = {f.id:f for f in t1.fields}
+  fs = t1.select
   if e.id not in fs:
     raise Exception("no such member")
   e.ref = fs[e.id]
+  e.offset = t1.offsets[e.id]
 
   # Return the type of the computed field.
   return e.ref.type
@@ -313,12 +327,13 @@ def check_variant(e : Expr):
   # Check that a) there is a corresponding label
   # in the type and that b) the type of the value
   # is the same as that field.
-  fs = {f.id:f for f in e.variant.fields}
+  fs = e.variant.select
   if e.field.id not in fs:
     raise Exception("no matching label in variant")
   f = fs[e.field.id]
   if not is_same_type(t1, f.type):
     raise Exception("type mismatch in variant")
+  e.tag = e.variant.tags[e.field.id]
 
   return e.variant
 
@@ -328,8 +343,15 @@ def check_case(e : Expr):
   if not is_variant(t1):
     raise Exception("operand is not a variant")
 
-  # Build a field lookup table for typing cases.
-  fs = {f.id:f for f in t1.fields}
+  # Find the field for each case.
+  fs = t1.select
+
+  # Build the table selecting the case for each tag. The first case
+  # with a label selects it.
+  e.table = [None] * len(t1.fields)
+  for c in reversed(e.cases):
+    if c.id in fs:
+      e.table[t1.tags[c.id]] = c
 
   t2 = None
   for c in e.cases:
@@ -337,6 +359,12 @@ def check_case(e : Expr):
     if c.id not in fs:
       raise Exception("no matching case label in variant")
     f = fs[c.id]
+
+    # If the type of the variable has changed since the case was last
+    # checked, so have the types of its uses.
+    if c.var.type is not None and c.var.type is not f.type:
+      for u in c.var.uses:
+        dirty(u, e)
     c.var.type = f.type
 
     # Recursively type the expressions
@@ -349,112 +377,57 @@ def check_case(e : Expr):
 
   return t2
 
-@checked
-def do_check(e : Expr):
-  # Compute the type of e.
-
+# Maps each kind of expression to the function that computes its type.
+#
+# See the corresponding table in evaluate.py.
+checkers = {
   # Boolean expressions
-  if type(e) is BoolExpr:
-    return check_bool(e)
-
-  if type(e) is AndExpr:
-    return check_logical_binary(e, "and")
-
-  if type(e) is OrExpr:
-    return check_logical_binary(e, "or")
-
-  if type(e) is NotExpr:
-    return check_logical_unary(e, "not")
-
-  if type(e) is IfExpr:
-    return check_if(e)
+  BoolExpr: check_bool,
+  AndExpr: check_and,
+  OrExpr: check_or,
+  NotExpr: check_not,
+  IfExpr: check_if,
 
   # Arithmetic expressions
-
-  if type(e) is IntExpr:
-    return check_int(e)
-
-  if type(e) is AddExpr:
-    return check_add(e)
-
-  if type(e) is SubExpr:
-    return check_sub(e)
-
-  if type(e) is MulExpr:
-    return check_mul(e)
-
-  if type(e) is DivExpr:
-    return check_div(e)
-
-  if type(e) is RemExpr:
-    return check_rem(e)
-
-  if type(e) is NegExpr:
-    return check_neg(e)
+  IntExpr: check_int,
+  AddExpr: check_add,
+  SubExpr: check_sub,
+  MulExpr: check_mul,
+  DivExpr: check_div,
+  RemExpr: check_rem,
+  NegExpr: check_neg,
 
   # Relational expressions
-
-  if type(e) is EqExpr:
-    return check_eq(e)
-
-  if type(e) is NeExpr:
-    return check_ne(e)
-
-  if type(e) is LtExpr:
-    return check_lt(e)
-
-  if type(e) is GtExpr:
-    return check_gt(e)
-
-  if type(e) is LeExpr:
-    return check_le(e)
-
-  if type(e) is GeExpr:
-    return check_ge(e)
-
-  if type(e) is IdExpr:
-    return check_id(e)
+  EqExpr: check_eq,
+  NeExpr: check_ne,
+  LtExpr: check_lt,
+  GtExpr: check_gt,
+  LeExpr: check_le,
+  GeExpr: check_ge,
 
   # Functional expressions
-
-  if type(e) is LambdaExpr:
-    return check_lambda(e)
-
-  if type(e) is CallExpr:
-    return check_call(e)
+  IdExpr: check_id,
+  LambdaExpr: check_lambda,
+  CallExpr: check_call,
 
   # Reference expressions
-
-  if type(e) is NewExpr:
-    return check_new(e)
-
-  if type(e) is DerefExpr:
-    return check_deref(e)
-
-  if type(e) is AssignExpr:
-    return check_assign(e)
+  NewExpr: check_new,
+  DerefExpr: check_deref,
+  AssignExpr: check_assign,
 
   # Data expressions
+  TupleExpr: check_tuple,
+  ProjExpr: check_proj,
+  RecordExpr: check_record,
+  MemberExpr: check_member,
+  VariantExpr: check_variant,
+  CaseExpr: check_case,
+}
 
-  if type(e) is TupleExpr:
-    return check_tuple(e)
-
-  if type(e) is ProjExpr:
-    return check_proj(e)
-
-  if type(e) is RecordExpr:
-    return check_record(e)
-
-  if type(e) is MemberExpr:
-    return check_member(e)
-
-  if type(e) is VariantExpr:
-    return check_variant(e)
-
-  if type(e) is CaseExpr:
-    return check_case(e)
-
-  assert False
+@checked
+def do_check(e : Expr):
+  # Compute the type of e.
+  return checkers[type(e)](e)
 
 @checked
 def check(e : Expr):
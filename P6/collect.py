@@ -0,0 +1,128 @@
+from env import Env
+from evaluate import Closure, Location, Cell, Tuple, Record, Variant
+import time
+
+# This module implements garbage collection for the heap of the
+# abstract machine (see cek.py).
+#
+# Without collection, the heap holds every value ever allocated. The
+# collector frees the locations that can no longer be reached, so that
+# they can be reused. It is a mark-sweep collector:
+#
+#   - Mark: starting from the roots, follow every value that can be
+#     reached: the values in environments (including the environments
+#     of closures), the elements of tuples, records and variants, and
+#     the values stored at reachable locations and in local cells (see
+#     escape.py).
+#   - Sweep: every location that was not marked is cleared and added to
+#     a free list. Allocation takes locations from the free list before
+#     growing the heap. Free locations at the end of the heap are
+#     removed, so the heap shrinks when its tail is garbage.
+#
+# The roots are the values the machine still needs: the value stack,
+# and the environments (and values) held by the tasks on its work
+# stack. Collection requires that all of these be known, which is why
+# it is supported by the machine but not by evaluate: the recursive
+# evaluator keeps intermediate values in Python's stack, where they
+# cannot be found. For the same reason, the heaps of evaluate, compiled
+# closures (see compile.py), the stack machine (see vm.py) and
+# translated programs (see pygen.py) are never collected.
+#
+# A collection is triggered by allocation, once the given number of
+# allocations (the threshold) has been made since the last one.
+
+class Collector:
+  def __init__(self, threshold : int = 1024):
+    self.threshold = threshold
+
+    # The free locations of the heap.
+    self.free = []
+
+    # The number of allocations since the last collection.
+    self.allocated = 0
+
+    # Statistics.
+    self.collections = 0
+    self.allocations = 0
+    self.freed = 0
+    self.live = 0
+    self.size = 0
+    self.peak = 0
+    self.pause = 0.0
+    self.longest = 0.0
+
+  def allocate(self, heap : list, v, roots):
+    # Store v in a free location of the heap, collecting first if the
+    # threshold has been reached. roots is a function that returns the
+    # roots; v must be among them. Returns the location.
+    if self.allocated >= self.threshold:
+      self.collect(heap, roots())
+    self.allocated += 1
+    self.allocations += 1
+    if self.free:
+      i = self.free.pop()
+      heap[i] = v
+    else:
+      i = len(heap)
+      heap.append(v)
+    self.peak = max(self.peak, len(heap))
+    return Location(i)
+
+  def collect(self, heap : list, roots):
+    # Free the locations of the heap not reachable from roots.
+    start = time.perf_counter()
+    marked = mark(heap, roots)
+
+    # Sweep, trimming free locations from the end of the heap.
+    n = len(heap)
+    while n and n - 1 not in marked:
+      n -= 1
+    freed = len(heap) - len(marked) - len(self.free)
+    del heap[n:]
+    self.free = [i for i in range(n) if i not in marked]
+    for i in self.free:
+      heap[i] = None
+
+    self.allocated = 0
+    self.collections += 1
+    self.freed += freed
+    self.live = len(marked)
+    self.size = len(heap)
+    t = time.perf_counter() - start
+    self.pause += t
+    self.longest = max(self.longest, t)
+
+  def __str__(self):
+    return (f"collections={self.collections} allocations={self.allocations} "
+            f"freed={self.freed} live={self.live} size={self.size} "
+            f"peak={self.peak} pause={self.pause * 1e3:.3f}ms "
+            f"longest={self.longest * 1e3:.3f}ms")
+
+def mark(heap : list, roots):
+  # Returns the set of locations reachable from roots.
+  marked = set()
+  seen = set()
+  work = list(roots)
+  while work:
+    v = work.pop()
+    t = type(v)
+    if t is Location:
+      if v.index not in marked:
+        marked.add(v.index)
+        work.append(heap[v.index])
+    elif t is Env or t is Closure:
+      # Environments and closures are shared, so they are only followed
+      # once.
+      if v not in seen:
+        seen.add(v)
+        if t is Env:
+          work += v.values
+          if v.parent is not None:
+            work.append(v.parent)
+        else:
+          work.append(v.env)
+    elif t is Tuple or t is Record:
+      work += v.values
+    elif t is Variant or t is Cell:
+      work.append(v.value)
+  return marked
@@ -0,0 +1,368 @@
+from lang import *
+from decorate import *
+from env import Env
+import evaluate as evaluation
+from evaluate import Closure, Location, Cell, Tuple, Record, Variant, select
+
+# This module compiles expressions into trees of Python closures.
+#
+# Compiling an expression e produces a Python function, run(S, s), that
+# computes the same value as evaluate(e, S, s). Each node of the tree is
+# compiled into its own function, which calls the functions compiled
+# for its operands. Dispatch on the kind of node and access to the
+# attributes of the node happen once, during compilation, instead of
+# every time the expression is evaluated.
+#
+# Compilation requires a resolved and type-checked expression. The
+# semantics (and the comments describing them) are the same as in
+# evaluate.py; see that module for the evaluation rules.
+#
+# Closures are shared with evaluate.py. The compiled body of a lambda
+# abstraction is saved in its 'code' attribute, so that closures created
+# by evaluate can be called from compiled code and vice versa.
+
+@checked
+def compile_bool(e : Expr):
+  value = e.value
+  def run(stack, heap):
+    return value
+  return run
+
+@checked
+def compile_and(e : Expr):
+  # NOTE: This is not short-circuiting.
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    v1 = lhs(stack, heap)
+    v2 = rhs(stack, heap)
+    return v1 and v2
+  return run
+
+@checked
+def compile_or(e : Expr):
+  # NOTE: This is not short-circuiting.
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    v1 = lhs(stack, heap)
+    v2 = rhs(stack, heap)
+    return v1 or v2
+  return run
+
+@checked
+def compile_not(e : Expr):
+  e1 = compile_expr(e.expr)
+  def run(stack, heap):
+    return not e1(stack, heap)
+  return run
+
+@checked
+def compile_if(e : Expr):
+  cond = compile_expr(e.cond)
+  true = compile_expr(e.true)
+  false = compile_expr(e.false)
+  def run(stack, heap):
+    if cond(stack, heap):
+      return true(stack, heap)
+    else:
+      return false(stack, heap)
+  return run
+
+@checked
+def compile_int(e : Expr):
+  value = e.value
+  def run(stack, heap):
+    return value
+  return run
+
+# Each operator gets its own function (rather than one that takes the
+# operation as a parameter) so that an operation costs a single call.
+
+@checked
+def compile_add(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) + rhs(stack, heap)
+  return run
+
+@checked
+def compile_sub(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) - rhs(stack, heap)
+  return run
+
+@checked
+def compile_mul(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) * rhs(stack, heap)
+  return run
+
+@checked
+def compile_div(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) / rhs(stack, heap)
+  return run
+
+@checked
+def compile_rem(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) % rhs(stack, heap)
+  return run
+
+@checked
+def compile_neg(e : Expr):
+  e1 = compile_expr(e.expr)
+  def run(stack, heap):
+    return -e1(stack, heap)
+  return run
+
+@checked
+def compile_eq(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) == rhs(stack, heap)
+  return run
+
+@checked
+def compile_ne(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) != rhs(stack, heap)
+  return run
+
+@checked
+def compile_lt(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) < rhs(stack, heap)
+  return run
+
+@checked
+def compile_gt(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) > rhs(stack, heap)
+  return run
+
+@checked
+def compile_le(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) <= rhs(stack, heap)
+  return run
+
+@checked
+def compile_ge(e : Expr):
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    return lhs(stack, heap) >= rhs(stack, heap)
+  return run
+
+@checked
+def compile_id(e : Expr):
+  # The most common addresses (the current frame and its parent)
+  # are specialized.
+  depth = e.depth
+  slot = e.slot
+  if depth == 0:
+    def run(stack, heap):
+      return stack.values[slot]
+  elif depth == 1:
+    def run(stack, heap):
+      return stack.parent.values[slot]
+  else:
+    def run(stack, heap):
+      return stack.lookup(depth, slot)
+  return run
+
+@checked
+def compile_lambda(e : Expr):
+  e.code = compile_expr(e.expr)
+  addresses = e.addresses
+  def run(stack, heap):
+    return Closure(e, Env([stack.lookup(d, s) for d, s in addresses]))
+  return run
+
+def code(abs : Expr):
+  # Returns the compiled body of a lambda abstraction, compiling it
+  # if needed (e.g., the closure was created by evaluate).
+  if abs.code is None:
+    abs.code = compile_expr(abs.expr)
+  return abs.code
+
+@checked
+def compile_call(e : Expr):
+  fn = compile_expr(e.fn)
+  args = [compile_expr(a) for a in e.args]
+  def run(stack, heap):
+    c = fn(stack, heap)
+    if type(c) is not Closure:
+      raise Exception("cannot apply a non-closure to an argument")
+    vs = [a(stack, heap) for a in args]
+    return code(c.abs)(Env(vs, c.env), heap)
+  return run
+
+@checked
+def compile_new(e : Expr):
+  e1 = compile_expr(e.expr)
+  if e.local:
+    def run(stack, heap):
+      return Cell(e1(stack, heap))
+    return run
+  def run(stack, heap):
+    v1 = e1(stack, heap)
+    l1 = Location(len(heap))
+    heap.append(v1)
+    evaluation.writes += 1
+    return l1
+  return run
+
+@checked
+def compile_deref(e : Expr):
+  e1 = compile_expr(e.expr)
+  def run(stack, heap):
+    l1 = e1(stack, heap)
+    if type(l1) is not Location:
+      if type(l1) is Cell:
+        return l1.value
+      raise Exception("invalid reference")
+    return heap[l1.index]
+  return run
+
+@checked
+def compile_assign(e : Expr):
+  # Operands are evaluated right to left.
+  lhs = compile_expr(e.lhs)
+  rhs = compile_expr(e.rhs)
+  def run(stack, heap):
+    v2 = rhs(stack, heap)
+    l1 = lhs(stack, heap)
+    if type(l1) is not Location:
+      if type(l1) is Cell:
+        l1.value = v2
+        return
+      raise Exception("invalid reference")
+    heap[l1.index] = v2
+    evaluation.writes += 1
+  return run
+
+@checked
+def compile_tuple(e : Expr):
+  elems = [compile_expr(x) for x in e.elems]
+  def run(stack, heap):
+    return Tuple([x(stack, heap) for x in elems])
+  return run
+
+@checked
+def compile_proj(e : Expr):
+  obj = compile_expr(e.obj)
+  index = e.index
+  def run(stack, heap):
+    return obj(stack, heap).values[index]
+  return run
+
+@checked
+def compile_record(e : Expr):
+  t = e.type
+  fields = [compile_expr(f.value) for f in e.fields]
+  def run(stack, heap):
+    return Record(t, tuple([x(stack, heap) for x in fields]))
+  return run
+
+@checked
+def compile_member(e : Expr):
+  obj = compile_expr(e.obj)
+  offset = e.offset
+  def run(stack, heap):
+    return obj(stack, heap).values[offset]
+  return run
+
+@checked
+def compile_variant(e : Expr):
+  t = e.variant
+  tag = e.tag
+  e1 = compile_expr(e.field.value)
+  def run(stack, heap):
+    return Variant(t, tag, e1(stack, heap))
+  return run
+
+@checked
+def compile_case(e : Expr):
+  # Compile the table of cases, indexed by tag (see check_case).
+  e1 = compile_expr(e.expr)
+  cases = [compile_expr(c.expr) if c else None for c in e.table]
+  def run(stack, heap):
+    v1 = e1(stack, heap)
+    body = cases[v1.tag]
+    if body is None:
+      # No case matches, which fails as in evaluate.
+      select(e, v1)
+    return body(Env([v1.value], stack), heap)
+  return run
+
+# Maps each kind of expression to the function that compiles it. See
+# the corresponding table in evaluate.py.
+compilers = {
+  # Boolean expressions
+  BoolExpr: compile_bool,
+  AndExpr: compile_and,
+  OrExpr: compile_or,
+  NotExpr: compile_not,
+  IfExpr: compile_if,
+
+  # Arithmetic expressions
+  IntExpr: compile_int,
+  AddExpr: compile_add,
+  SubExpr: compile_sub,
+  MulExpr: compile_mul,
+  DivExpr: compile_div,
+  RemExpr: compile_rem,
+  NegExpr: compile_neg,
+
+  # Relational expressions
+  EqExpr: compile_eq,
+  NeExpr: compile_ne,
+  LtExpr: compile_lt,
+  GtExpr: compile_gt,
+  LeExpr: compile_le,
+  GeExpr: compile_ge,
+
+  # Functional expressions
+  IdExpr: compile_id,
+  LambdaExpr: compile_lambda,
+  CallExpr: compile_call,
+
+  # Reference expressions
+  NewExpr: compile_new,
+  DerefExpr: compile_deref,
+  AssignExpr: compile_assign,
+
+  # Data expressions
+  TupleExpr: compile_tuple,
+  ProjExpr: compile_proj,
+  RecordExpr: compile_record,
+  MemberExpr: compile_member,
+  VariantExpr: compile_variant,
+  CaseExpr: compile_case,
+}
+
+def compile_expr(e : Expr):
+  # Compile an expression into a function run(stack, heap) that
+  # evaluates it. The expression must be resolved and checked.
+  return compilers[type(e)](e)
@@ -0,0 +1,172 @@
+from lang import *
+from edit import places, get, put, clear
+from effects import Purity, PURE
+
+# This module implements common subexpression elimination. Repeated
+# occurrences of the same expression within a scope are computed once,
+# by binding the value to a new variable at the start of the scope:
+#
+#   \(a, b).(a * b + 1) * (a * b + 1) ~> \(a, b).(\(t1).t1 * t1)(a * b + 1)
+#
+# The scopes are the program itself and the body of each lambda
+# abstraction. Occurrences within a nested abstraction belong to its
+# scope, not the enclosing one, since the body of the abstraction may
+# be evaluated any number of times.
+#
+# An expression is only eliminated if it is PURE (see effects.py): it
+# has no effects, cannot fail, and does not read the heap. This means
+# that evaluating it once, at the start of the scope, produces the same
+# value as each occurrence, even if the occurrences were in branches
+# that are not taken. It must also not refer to the variables of case
+# expressions within the scope, which are not bound at its start.
+#
+# Occurrences are found by value numbering: each expression is given a
+# number such that expressions with the same number have the same kind,
+# the same attributes and operands with the same numbers. Variables are
+# numbered by their declaration. Larger expressions are eliminated
+# first; the occurrences of an expression within an eliminated one are
+# then no longer counted.
+#
+# The program is resolved and checked again afterwards. Like resolve,
+# this must be applied to a whole program.
+
+class Eliminating:
+  # The state of the pass. This holds the size of the smallest
+  # expression worth eliminating, and counts the bindings introduced
+  # and the occurrences they replace.
+  def __init__(self, size : int = 3):
+    self.size = size
+    self.bindings = 0
+    self.eliminated = 0
+
+# Value numbering
+
+# The attributes of each kind of expression, other than its operands,
+# that are part of its number.
+attributes = {
+  BoolExpr: lambda e: e.value,
+  IntExpr: lambda e: e.value,
+  IdExpr: lambda e: e.ref,
+  LambdaExpr: lambda e: e,
+  ProjExpr: lambda e: e.index,
+  RecordExpr: lambda e: tuple(f.id for f in e.fields),
+  MemberExpr: lambda e: e.id,
+  VariantExpr: lambda e: (e.field.id, e.variant),
+  CaseExpr: lambda e: tuple((c.id, c.var) for c in e.cases),
+}
+
+class Numbering:
+  # The value numbers of the expressions in a scope, and the
+  # occurrences of each expression that could be eliminated.
+  def __init__(self, p : Purity):
+    self.purity = p
+    self.keys = {}
+    self.sizes = {}
+    self.occurrences = {}
+
+    # The variables declared by case expressions in the scope.
+    self.local = set()
+
+  def number(self, e):
+    # Number e and its operands. Returns the number of e, its size,
+    # and whether it refers to local variables. Nested abstractions are
+    # not entered.
+    if type(e) is CaseExpr:
+      self.local.update(c.var for c in e.cases)
+    ns = []
+    size = 1
+    local = type(e) is IdExpr and e.ref in self.local
+    if type(e) is not LambdaExpr:
+      for p in places[type(e)](e):
+        n1, s1, l1 = self.number(get(p))
+        ns += [n1]
+        size += s1
+        local = local or l1
+
+    get_attrs = attributes.get(type(e))
+    key = (type(e), get_attrs(e) if get_attrs else None, tuple(ns))
+    if key not in self.keys:
+      self.keys[key] = len(self.keys)
+    n = self.keys[key]
+    self.sizes[n] = size
+
+    if not local and size >= 2 and self.purity.level(e) == PURE:
+      self.occurrences.setdefault(n, []).append(e)
+    return n, size, local
+
+def inside(e, consumed):
+  # Add the expressions within e to consumed.
+  for p in places[type(e)](e):
+    x = get(p)
+    consumed.add(x)
+    if type(x) is not LambdaExpr:
+      inside(x, consumed)
+
+def replace(e, temps):
+  # Replace the chosen occurrences within e with their variables.
+  # Nested abstractions are not entered.
+  for p in places[type(e)](e):
+    x = get(p)
+    if x in temps:
+      put(p, IdExpr(temps[x]))
+    elif type(x) is not LambdaExpr:
+      replace(x, temps)
+
+def eliminate(body, s, p):
+  # Eliminate common subexpressions in body, which is the body of an
+  # abstraction or the program. Returns the new body. A body that is
+  # itself an abstraction (as in \(a).\(b).e) has nothing to eliminate
+  # in this scope, so the pass continues with its body.
+  if type(body) is LambdaExpr:
+    body.expr = eliminate(body.expr, s, p)
+    return body
+  nested(body, s, p)
+
+  t = Numbering(p)
+  t.number(body)
+
+  # Choose the expressions to eliminate, largest first.
+  consumed = set()
+  temps = {}
+  vars = []
+  args = []
+  for n in sorted(t.occurrences, key=lambda n: -t.sizes[n]):
+    if t.sizes[n] < s.size:
+      break
+    es = [e for e in t.occurrences[n] if e not in consumed]
+    if len(es) < 2:
+      continue
+    s.bindings += 1
+    s.eliminated += len(es)
+    v = VarDecl(f"t{s.bindings}", es[0].type)
+    for e in es:
+      temps[e] = v
+      inside(e, consumed)
+    vars += [v]
+    args += [es[0]]
+
+  if not vars:
+    return body
+  replace(body, temps)
+  return CallExpr(LambdaExpr(vars, body), args)
+
+def nested(e, s, p):
+  # Eliminate common subexpressions in the abstractions within e.
+  for x in [get(pl) for pl in places[type(e)](e)]:
+    if type(x) is LambdaExpr:
+      x.expr = eliminate(x.expr, s, p)
+    else:
+      nested(x, s, p)
+
+def cse(e : Expr, s : Eliminating = None):
+  # Eliminate common subexpressions in a checked program. Returns the
+  # new program, which is resolved and checked.
+  if s is None:
+    s = Eliminating()
+  n = s.bindings
+  e = eliminate(e, s, Purity(e))
+  if s.bindings != n:
+    clear(e)
+    resolve(e)
+    check(e)
+  return e
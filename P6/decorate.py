@@ -1,23 +1,61 @@
 import inspect
+import os
 import typing
 
+# The checked decorator checks the types of a function's arguments
+# against its type hints on each call. This costs a loop over the
+# arguments on every call of every decorated function, which includes
+# the recursive calls of resolve, check and evaluate.
+#
+# How often arguments are checked is set by the P6_CHECKED environment
+# variable, or by assigning to `checking` before the decorated modules
+# are imported. The setting is read when each function is decorated,
+# so changing it afterwards has no effect on functions already
+# decorated:
+#
+#   - 1 (the default) checks every call.
+#   - 0 checks no calls. The function is returned undecorated, so it
+#     costs nothing at all.
+#   - N checks every Nth call of each function.
+#
+# bench.py reports the time spent in the wrapper by evaluating the same
+# programs in each mode.
+checking = int(os.environ.get("P6_CHECKED", "1"))
+
 def checked(fn):
   # Make sure there are type hints.
   types = typing.get_type_hints(fn)
   if len(types) == 0:
     raise Exception(f"{fn.__name__} has no type hints")
 
+  if checking == 0:
+    return fn
+
   # Grab the list of parameter names.
   parms = inspect.getfullargspec(fn).args
-  
-  # Define the wrapper function.
-  def wrap(*args):
+
+  def check(args):
     # Check that each argument is an instance of its corresponding
     # hinted type.
     for p, a in zip(parms, args):
       t = types[p]
       if (not isinstance(a, t)):
         raise Exception(f"'{type(a).__name__}' is not an instance of '{t.__name__}'")
-    return fn(*args)
+
+  # Define the wrapper function.
+  if checking == 1:
+    def wrap(*args):
+      check(args)
+      return fn(*args)
+  else:
+    n = checking
+    count = 0
+    def wrap(*args):
+      nonlocal count
+      count += 1
+      if count == n:
+        count = 0
+        check(args)
+      return fn(*args)
 
   return wrap
@@ -0,0 +1,198 @@
+from lang import *
+
+# This module supports editing expressions after they have been checked.
+#
+# check caches the type of each expression in the tree. After an edit,
+# the types of some expressions are out of date:
+#
+#   - the edited expression and its ancestors, whose types may depend
+#     on the types of their operands, and
+#   - the uses of any variable whose type has changed, and their
+#     ancestors.
+#
+# To find these, link adds parent links to a tree and records the uses
+# of each declared variable. Editing through replace and retype marks
+# the expressions whose types are out of date as dirty, by clearing
+# their cached types. Checking the tree again then recomputes only the
+# types of dirty expressions, so the cost of checking after an edit is
+# proportional to the size of the edit (and its depth), not the size of
+# the program.
+#
+# The type of a case variable is computed from the type of its case
+# expression's operand. When check finds that it has changed, it marks
+# the uses of the variable as dirty (see check_case).
+#
+# Editing requires a tree, not a DAG: shared expressions (see share.py)
+# have more than one parent. Edits must refer to variables by their
+# declarations. Addresses are not updated, so the tree must be resolved
+# again before it is evaluated.
+
+# Places
+#
+# A place is a location that holds an operand of an expression: a pair
+# (obj, key), where key is the name of an attribute of obj, or an index
+# if obj is a list.
+
+def get(p):
+  obj, key = p
+  return obj[key] if type(key) is int else getattr(obj, key)
+
+def put(p, x):
+  obj, key = p
+  if type(key) is int:
+    obj[key] = x
+  else:
+    setattr(obj, key, x)
+
+def places_leaf(e):
+  return []
+
+def places_unary(e):
+  return [(e, "expr")]
+
+def places_binary(e):
+  return [(e, "lhs"), (e, "rhs")]
+
+def places_if(e):
+  return [(e, "cond"), (e, "true"), (e, "false")]
+
+def places_call(e):
+  return [(e, "fn")] + [(e.args, i) for i in range(len(e.args))]
+
+def places_tuple(e):
+  return [(e.elems, i) for i in range(len(e.elems))]
+
+def places_obj(e):
+  return [(e, "obj")]
+
+def places_record(e):
+  return [(f, "value") for f in e.fields]
+
+def places_variant(e):
+  return [(e.field, "value")]
+
+def places_case(e):
+  return [(e, "expr")] + [(c, "expr") for c in e.cases]
+
+# Maps each kind of expression to the function that returns the places
+# of its operands. See the corresponding table in evaluate.py.
+places = {
+  # Boolean expressions
+  BoolExpr: places_leaf,
+  AndExpr: places_binary,
+  OrExpr: places_binary,
+  NotExpr: places_unary,
+  IfExpr: places_if,
+
+  # Arithmetic expressions
+  IntExpr: places_leaf,
+  AddExpr: places_binary,
+  SubExpr: places_binary,
+  MulExpr: places_binary,
+  DivExpr: places_binary,
+  RemExpr: places_binary,
+  NegExpr: places_unary,
+
+  # Relational expressions
+  EqExpr: places_binary,
+  NeExpr: places_binary,
+  LtExpr: places_binary,
+  GtExpr: places_binary,
+  LeExpr: places_binary,
+  GeExpr: places_binary,
+
+  # Functional expressions
+  IdExpr: places_leaf,
+  LambdaExpr: places_unary,
+  CallExpr: places_call,
+
+  # Reference expressions
+  NewExpr: places_unary,
+  DerefExpr: places_unary,
+  AssignExpr: places_binary,
+
+  # Data expressions
+  TupleExpr: places_tuple,
+  ProjExpr: places_obj,
+  RecordExpr: places_record,
+  MemberExpr: places_obj,
+  VariantExpr: places_variant,
+  CaseExpr: places_case,
+}
+
+def operands(e):
+  # Returns the operands of e.
+  return [get(p) for p in places[type(e)](e)]
+
+def size(e):
+  # Returns the number of nodes in e.
+  return 1 + sum(size(x) for x in operands(e))
+
+def clear(e : Expr):
+  # Clear the cached types of e and its operands, so that checking e
+  # computes all of them again. Passes that rewrite a tree without
+  # tracking the expressions they changed do this before checking it.
+  e.type = None
+  for x in operands(e):
+    clear(x)
+
+# Linking
+
+def declares(e):
+  # Returns the variables declared by e.
+  if type(e) is LambdaExpr:
+    return e.vars
+  if type(e) is CaseExpr:
+    return [c.var for c in e.cases]
+  return []
+
+def link(e : Expr, parent : Expr = None):
+  # Set the parent links of e and its operands, and record the uses of
+  # the variables they declare.
+  e.parent = parent
+  for v in declares(e):
+    v.binder = e
+  if type(e) is IdExpr:
+    e.ref.uses.add(e)
+  for x in operands(e):
+    link(x, e)
+
+def unlink(e : Expr):
+  # Remove the uses recorded for e and its operands. This is done when
+  # e is removed from the tree.
+  e.parent = None
+  if type(e) is IdExpr:
+    e.ref.uses.discard(e)
+  for x in operands(e):
+    unlink(x)
+
+# Editing
+
+def dirty(e : Expr, stop : Expr = None):
+  # Mark e and its ancestors (up to, but not including, stop) as
+  # needing to be checked again.
+  while e is not stop:
+    e.type = None
+    e = e.parent
+
+def replace(e : Expr, x : Expr):
+  # Replace e with x in the tree. Returns x.
+  p = e.parent
+  if p is not None:
+    for pl in places[type(p)](p):
+      if get(pl) is e:
+        put(pl, x)
+        break
+    dirty(p)
+  unlink(e)
+  link(x, p)
+  return x
+
+def retype(v : VarDecl, t):
+  # Change the type of a declared variable. This changes the type of
+  # its uses, and of the abstraction that declares it.
+  v.type = typify(t)
+  for u in v.uses:
+    dirty(u)
+  if v.binder is not None:
+    dirty(v.binder)
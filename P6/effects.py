@@ -0,0 +1,153 @@
+from lang import *
+from edit import operands
+
+# This module implements purity analysis, which determines the effects
+# that evaluating an expression may have. Each expression is given one
+# of three levels:
+#
+#   - PURE expressions have no effects, cannot fail, and do not read
+#     the heap. Evaluating one always produces the same value, so it
+#     can be evaluated at a different time, fewer times, or not at all.
+#   - READS expressions may also read the heap (by dereferencing). They
+#     can be removed, but not evaluated at a different time, since the
+#     heap may have changed.
+#   - EFFECTS expressions may change the heap, or fail.
+#
+# An expression is pure (in the sense of the function pure, below) if
+# it can be removed: its level is at most READS.
+#
+# The following have effects:
+#
+#   - Allocation and assignment (new e1 and e1 = e2), which change the
+#     heap.
+#   - Division and remainder, which fail when dividing by zero, unless
+#     the divisor is a literal other than zero.
+#   - Case expressions without a case for every label of the variant,
+#     which fail when no case matches.
+#   - Calls of unknown functions.
+#
+# Creating a closure is pure, since its body is not evaluated. Calling
+# a known function (a lambda abstraction that is called immediately, or
+# that is bound to a variable by such a call) has the effects of its
+# arguments and its body. Calls through references are never known, so
+# recursive functions (which are only written that way) have effects.
+
+PURE = 0
+READS = 1
+EFFECTS = 2
+
+class Purity:
+  # The state of the analysis. This maps variables to the functions
+  # bound to them, and caches the level of each expression seen.
+  def __init__(self, e : Expr = None):
+    self.known = {}
+    if e is not None:
+      functions(e, self.known)
+    self.levels = {}
+
+  def level(self, e):
+    # Returns the level of e.
+    if e not in self.levels:
+      self.levels[e] = purities[type(e)](e, self)
+    return self.levels[e]
+
+def functions(e, known):
+  # Record the lambda abstractions bound to variables by calls.
+  if type(e) is CallExpr and type(e.fn) is LambdaExpr:
+    for v, a in zip(e.fn.vars, e.args):
+      if type(a) is LambdaExpr:
+        known[v] = a
+  for x in operands(e):
+    functions(x, known)
+
+def level_pure(e, p):
+  return PURE
+
+def level_effects(e, p):
+  return EFFECTS
+
+def level_operands(e, p):
+  # The level of the operands.
+  return max([p.level(x) for x in operands(e)], default=PURE)
+
+def level_division(e, p):
+  if type(e.rhs) is IntExpr and e.rhs.value != 0:
+    return level_operands(e, p)
+  return EFFECTS
+
+def level_lambda(e, p):
+  # The body is not evaluated.
+  return PURE
+
+def level_call(e, p):
+  fn = e.fn
+  if type(fn) is IdExpr and fn.ref in p.known:
+    fn = p.known[fn.ref]
+  if type(fn) is not LambdaExpr:
+    return EFFECTS
+  return max(level_operands(e, p), p.level(fn.expr))
+
+def level_deref(e, p):
+  return max(READS, level_operands(e, p))
+
+def level_case(e, p):
+  # This requires the type of the operand.
+  labels = {c.id for c in e.cases}
+  if any(f.id not in labels for f in e.expr.type.fields):
+    return EFFECTS
+  return level_operands(e, p)
+
+# Maps each kind of expression to the function that computes its level.
+# See the corresponding table in evaluate.py.
+purities = {
+  # Boolean expressions
+  BoolExpr: level_pure,
+  AndExpr: level_operands,
+  OrExpr: level_operands,
+  NotExpr: level_operands,
+  IfExpr: level_operands,
+
+  # Arithmetic expressions
+  IntExpr: level_pure,
+  AddExpr: level_operands,
+  SubExpr: level_operands,
+  MulExpr: level_operands,
+  DivExpr: level_division,
+  RemExpr: level_division,
+  NegExpr: level_operands,
+
+  # Relational expressions
+  EqExpr: level_operands,
+  NeExpr: level_operands,
+  LtExpr: level_operands,
+  GtExpr: level_operands,
+  LeExpr: level_operands,
+  GeExpr: level_operands,
+
+  # Functional expressions
+  IdExpr: level_pure,
+  LambdaExpr: level_lambda,
+  CallExpr: level_call,
+
+  # Reference expressions
+  NewExpr: level_effects,
+  DerefExpr: level_deref,
+  AssignExpr: level_effects,
+
+  # Data expressions
+  TupleExpr: level_operands,
+  ProjExpr: level_operands,
+  RecordExpr: level_operands,
+  MemberExpr: level_operands,
+  VariantExpr: level_operands,
+  CaseExpr: level_case,
+}
+
+def pure(e : Expr, p : Purity = None):
+  # Returns true if e can be removed: it has no effects, though it may
+  # read the heap.
+  return (p or Purity()).level(e) <= READS
+
+def invariant(e : Expr, p : Purity = None):
+  # Returns true if e is PURE: it can be evaluated at any time.
+  return (p or Purity()).level(e) == PURE
@@ -0,0 +1,42 @@
+# This module implements environments, which hold the values of variables
+# during evaluation.
+#
+# An environment is a chain of frames. Each frame holds the values of a
+# few variables (the parameters of a call, the variable of a case, or the
+# captured variables of a closure) and links to its parent. Frames are
+# never modified after they are created: adding bindings creates a new
+# frame whose parent is the existing environment. This means that
+# environments can be shared freely without copying, and that adding a
+# binding costs O(1).
+#
+# Variables are found by their lexical address (see lookup.py): the
+# number of frames to skip (depth) and the index within that frame
+# (slot). This is where these environments differ from those of P4,
+# whose frames map declarations to values: P4 evaluates unresolved
+# programs, so it still looks variables up by declaration.
+
+class Env:
+  __slots__ = ("values", "parent")
+
+  def __init__(self, values : list = None, parent = None):
+    # The values in this frame.
+    self.values = values if values is not None else []
+
+    # The enclosing environment or None.
+    self.parent = parent
+
+  def lookup(self, depth, slot):
+    # Returns the value at the given address.
+    env = self
+    while depth:
+      env = env.parent
+      depth -= 1
+    return env.values[slot]
+
+  def __str__(self):
+    fs = []
+    env = self
+    while env is not None:
+      fs += [",".join(str(v) for v in env.values)]
+      env = env.parent
+    return f"[{'|'.join(fs)}]"
@@ -0,0 +1,88 @@
+from lang import *
+from edit import operands
+
+# This module implements escape analysis, which finds the allocations
+# whose locations never escape the body of the lambda abstraction that
+# binds them. These are local mutable cells:
+#
+#   (\(c). {c = *c + 1, *c}.1)(new 0)
+#
+# Here the location of the new cell is only dereferenced and assigned
+# to, so no other part of the program can refer to it. The evaluators
+# keep such a cell in the frame of the call that binds it (as a Cell;
+# see evaluate.py), rather than in the heap. This means that the heap
+# does not grow, and the collector (see collect.py) has nothing to do,
+# when the cell becomes garbage.
+#
+# An allocation is local if it is an argument of a call of a lambda
+# abstraction (i.e., a let), and every use of the corresponding
+# parameter within the body is either:
+#
+#   - the operand of a dereference (*c), or
+#   - the left operand of an assignment (c = e1), where e1 does not
+#     itself escape c.
+#
+# Any other use lets the location escape: it could be stored in the
+# heap, placed in a tuple, record or variant, passed to a function, or
+# returned. A use within a nested lambda abstraction also escapes,
+# since the closure may outlive the call. These are found through the
+# abstraction's captured variables, so the program must be resolved.
+#
+# The analysis marks local allocations by setting NewExpr.local. The
+# evaluators check the kind of reference at runtime, so a cell behaves
+# exactly as a location would. The mark belongs to the node, so a node
+# that occurs more than once in the tree is never marked: each occurrence
+# is a separate allocation site, and only some of them may be local.
+# share.py does not share allocations, but a tree built by hand might.
+
+class Escaping:
+  # The state of the analysis. This counts the allocations found, and
+  # those that are local.
+  def __init__(self):
+    self.sites = 0
+    self.local = 0
+
+def is_use(e, v):
+  return type(e) is IdExpr and e.ref is v
+
+def confined(e, v):
+  # Returns true if v does not escape e.
+  if is_use(e, v):
+    return False
+  if type(e) is LambdaExpr:
+    return v not in e.captures
+  if type(e) is DerefExpr and is_use(e.expr, v):
+    return True
+  if type(e) is AssignExpr and is_use(e.lhs, v):
+    return confined(e.rhs, v)
+  return all(confined(x, v) for x in operands(e))
+
+def occurrences(e, counts):
+  # Count the occurrences of each allocation in e.
+  if type(e) is NewExpr:
+    counts[e] = counts.get(e, 0) + 1
+  for x in operands(e):
+    occurrences(x, counts)
+
+def analyze(e, s, counts):
+  if type(e) is NewExpr:
+    s.sites += 1
+    e.local = False
+  for x in operands(e):
+    analyze(x, s, counts)
+  if type(e) is CallExpr and type(e.fn) is LambdaExpr:
+    for v, a in zip(e.fn.vars, e.args):
+      if type(a) is NewExpr and counts[a] == 1 and confined(e.fn.expr, v):
+        a.local = True
+        s.local += 1
+
+def escape(e : Expr, s : Escaping = None):
+  # Mark the local allocations in a resolved and checked program.
+  # Returns the program. The number of allocations found and marked
+  # are counted in s.
+  if s is None:
+    s = Escaping()
+  counts = {}
+  occurrences(e, counts)
+  analyze(e, s, counts)
+  return e
@@ -1,9 +1,6 @@
 from lang import *
 from decorate import *
-
-import copy
-
-clone = copy.deepcopy
+from env import Env
 
 # This module implements implements big-step semantics.
 #
@@ -12,9 +9,19 @@ clone = copy.deepcopy
 # the dynamic store (heap). Note that => is my approximation of the 
 # usual down arrow relation used in the TAPL book.
 #
-# The stack S is a list of bindings from names to values. The heap
-# is a list of addresses with stored values. For simplicity, the
-# heap simply collects all allocations and never deletes them.
+# The stack S is an environment (see env.py), which holds the values
+# of variables in frames. Variables are found by the addresses computed
+# during resolution. Adding bindings creates a new frame, so there is
+# no need to copy the stack at calls or in closures. The heap
+# is a list of addresses with stored values.
+#
+# This evaluator never frees a location, so its heap grows with every
+# allocation. Collecting it would need the roots of the evaluation, but
+# intermediate values are kept in Python's stack, where they cannot be
+# found. Long-running programs that allocate should instead be run by
+# the abstract machine (see cek.py) with a collector (see collect.py).
+# Allocations that escape analysis finds to be local (see escape.py)
+# are kept out of the heap by either.
 #
 # There is one main function: evaluate, which computes the 
 # value of an expression. A value is a Python object.
@@ -22,10 +29,13 @@ clone = copy.deepcopy
 class Closure:
   # Represents the value of a lambda abstraction. This combines
   # the abstraction and an environment, which provides values
-  # during application.
+  # during application. The environment binds only the variables
+  # captured by the abstraction.
+  __slots__ = ("abs", "env")
+
   def __init__(self, abs, env):
     self.abs = abs
-    self.env = clone(env)
+    self.env = env
 
   def __str__(self):
     # TODO: Write out closed environment?
@@ -33,14 +43,37 @@ class Closure:
 
 class Location:
   # A location in the heap. This is simply its index in the heap.
+  __slots__ = ("index",)
+
   def __init__(self, ix):
     self.index = ix
 
   def __str__(self):
     return f"@{self.index}"
 
+class Cell:
+  # A local mutable cell: a location that does not escape the call that
+  # binds it (see escape.py). It is held in the call's frame, rather
+  # than the heap. Dereferencing and assigning to it are as for a
+  # location. Changing a cell does not change the heap, so it does not
+  # count as a write.
+  __slots__ = ("value",)
+
+  # The number of cells allocated, and so of allocations removed from
+  # the heap.
+  allocations = 0
+
+  def __init__(self, v):
+    Cell.allocations += 1
+    self.value = v
+
+  def __str__(self):
+    return f"@[{self.value}]"
+
 class Tuple:
   # A tuple value. A tuple is simply a list of values.
+  __slots__ = ("values",)
+
   def __init__(self, vs : list):
     self.values = vs
 
@@ -48,50 +81,51 @@ class Tuple:
     vs = ",".join([str(v) for v in self.values])
     return f"{{{vs}}}"
 
-class Field:
-  # A field maps an identifier to its value.
-  def __init__(self, n, v):
-    self.id = n
-    self.value = v
-
-  def __str__(self):
-    return f"{self.id}={self.value}"
-
 class Record:
-  # A record value. This is a list of fields.
-  def __init__(self, fs : list):
-    # This list of fields
-    self.fields = fs
-
-    # A mapping of FieldDecl objects to values. This supports
-    # reasonably efficient value lookup for evaluation.
-    #
-    # If we reduced member references to indexes, we could
-    # simply extract the value from the field list, like
-    # we do with tuples.
-    self.select = {f.id:f.value for f in fs}
+  # A record value. This is the record type and a tuple holding the
+  # value of each field, in the order of the type's fields.
+  #
+  # Member expressions are reduced to offsets during checking (see
+  # check_member), so a value is simply extracted from the tuple, like
+  # we do with tuples. The labels are only needed to print the record,
+  # so they are found through the type, which is shared by all records
+  # of the type.
+  __slots__ = ("type", "values")
+
+  def __init__(self, t : RecordType, vs : tuple):
+    self.type = t
+    self.values = vs
 
   def __str__(self):
-    fs = ",".join([str(e) for e in self.fields])
+    fs = ",".join(f"{f.id}={v}" for f, v in zip(self.type.fields, self.values))
     return f"{{{fs}}}"
 
 class Variant:
-  # A variant value. This is a label and its value.
+  # A variant value. This is the variant type, the tag of its label
+  # (the label's position in the type), and its value.
   #
-  # TODO: We could have reduced the the label to an integer value
-  # corresponding to the labels position in its type. I believe
-  # that the width and depth subtyping rules would continue to
-  # apply in those cases (i.e., indexes of restricted variants
-  # would be valid in larger variants).
-  def __init__(self, l, v):
-    self.tag = l
+  # Case expressions select their case by indexing a table with the tag
+  # (see check_case). The label is only needed to print the variant, so
+  # it is found through the type.
+  __slots__ = ("type", "tag", "value")
+
+  def __init__(self, t : VariantType, n : int, v):
+    self.type = t
+    self.tag = n
     self.value = v
 
   def __str__(self):
-    return f"<{self.tag}={self.value}>"
+    return f"<{self.type.fields[self.tag].id}={self.value}>"
+
+# The number of changes made to the heap (by allocation or assignment)
+# so far, by any of the evaluators (see also compile.py, cek.py and
+# vm.py). Memoized calls use this to detect calls that change the heap,
+# and values that may depend on a heap that has since changed. See
+# memo.py.
+writes = 0
 
 @checked
-def eval_binary(e : Expr, stack : dict, heap : list, fn : object):
+def eval_binary(e : Expr, stack : Env, heap : list, fn : object):
   # S |- e1|s => v1|s'   S |- e2|s' => v2|s''
   # ----------------------------------------- E-Binary-@
   #       S |- e1 @ e2|s => v1 @ v2|s''
@@ -102,17 +136,17 @@ def eval_binary(e : Expr, stack : dict, heap : list, fn : object):
   return fn(v1, v2)
 
 @checked
-def eval_unary(e : Expr, stack : dict, heap : list, fn : object):
+def eval_unary(e : Expr, stack : Env, heap : list, fn : object):
   #  S |- e1|s => v1|s'
   # -------------------- E-Unary-@
   # S |- @e1|s => @ v1|s
   #
   # Operands are inherently evaluated left to right.
-  v1 = evaluate(e.lhs, stack, heap)
+  v1 = evaluate(e.expr, stack, heap)
   return fn(v1)
 
 @checked
-def eval_bool(e : Expr, stack : dict, heap : list):
+def eval_bool(e : Expr, stack : Env, heap : list):
   # --------------------- E-True
   # S |- true|s => True|s
   #
@@ -121,20 +155,21 @@ def eval_bool(e : Expr, stack : dict, heap : list):
   return e.value
 
 @checked
-def eval_and(e : Expr, stack : dict, heap : list):
+def eval_and(e : Expr, stack : Env, heap : list):
   # NOTE: This is not short-circuiting.
   return eval_binary(e, stack, heap, lambda v1, v2: v1 and v2)
 
 @checked
-def eval_or(e : Expr, stack : dict, heap : list):
+def eval_or(e : Expr, stack : Env, heap : list):
   # NOTE: This is not short-circuiting.
   return eval_binary(e, stack, heap, lambda v1, v2: v1 or v2)
 
 @checked
-def eval_not(e : Expr, stack : dict, heap : list):
+def eval_not(e : Expr, stack : Env, heap : list):
   return eval_unary(e, stack, heap, lambda v1: not v1)
 
-def eval_cond(e, stack, heap : list):
+@checked
+def eval_if(e : Expr, stack : Env, heap : list):
   # S |- e1|s => true|s'   S |- e2|s' => v2|s''
   #-------------------------------------------- E-If-True
   #         S |- e1 ? e2 : e3|s => v2|s''
@@ -142,84 +177,86 @@ def eval_cond(e, stack, heap : list):
   # S |- e1|s => false|s'   S |- e3|s' => v3|s''
   #--------------------------------------------- E-If-True
   #         S |- e1 ? e2 : e3|s => v3|s3''
-  if evaluate(e.cond):
-    return evaluate(e.true);
+  if evaluate(e.cond, stack, heap):
+    return evaluate(e.true, stack, heap)
   else:
-    return evaluate(e.false);
+    return evaluate(e.false, stack, heap)
 
 @checked
-def eval_int(e : Expr, stack : dict, heap : list):
+def eval_int(e : Expr, stack : Env, heap : list):
   # -------------------- E-Int
   # S |- n|s => int(n)|s
   return e.value
 
 @checked
-def eval_add(e : Expr, stack : dict, heap : list):
+def eval_add(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 + v2)
 
 @checked
-def eval_sub(e : Expr, stack : dict, heap : list):
+def eval_sub(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 - v2)
 
 @checked
-def eval_mul(e : Expr, stack : dict, heap : list):
+def eval_mul(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 * v2)
 
 @checked
-def eval_div(e : Expr, stack : dict, heap : list):
+def eval_div(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 / v2)
 
 @checked
-def eval_rem(e : Expr, stack : dict, heap : list):
+def eval_rem(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 % v2)
 
 @checked
-def eval_neg(e : Expr, stack : dict, heap : list):
-  return eval_binary(e, stack, heap, lambda v1: -v1)
+def eval_neg(e : Expr, stack : Env, heap : list):
+  return eval_unary(e, stack, heap, lambda v1: -v1)
 
 @checked
-def eval_eq(e : Expr, stack : dict, heap : list):
+def eval_eq(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 == v2)
 
 @checked
-def eval_ne(e : Expr, stack : dict, heap : list):
+def eval_ne(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 != v2)
 
 @checked
-def eval_lt(e : Expr, stack : dict, heap : list):
+def eval_lt(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 < v2)
 
 @checked
-def eval_gt(e : Expr, stack : dict, heap : list):
+def eval_gt(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 > v2)
 
 @checked
-def eval_le(e : Expr, stack : dict, heap : list):
+def eval_le(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 <= v2)
 
 @checked
-def eval_ge(e : Expr, stack : dict, heap : list):
+def eval_ge(e : Expr, stack : Env, heap : list):
   return eval_binary(e, stack, heap, lambda v1, v2: v1 >= v2)
 
 @checked
-def eval_id(e : Expr, stack : dict, heap : list):
+def eval_id(e : Expr, stack : Env, heap : list):
   #    x1=v1 in S
   # ---------------- E-Id
   # S |- x|s => v1|s
-  return stack[e.ref]
+  #
+  # The value is found by the address of x.
+  return stack.lookup(e.depth, e.slot)
 
 @checked
-def eval_lambda(e : Expr, stack : dict, heap : list):
+def eval_lambda(e : Expr, stack : Env, heap : list):
   # ------------------------------ E-Lambda
-  # S |- \(xi).e|s => <\(x1i).e,S>
+  # S |- \(xi).e|s => <\(x1i).e,S'>
   #
-  # This produces a closure, which is a snapshot of all objects
-  # in the stack. This is *wildly* inefficient. We should only
-  # compute the capture of the variables in e whose binding depth
-  # is less than e (i.e., parameters declared outside of e).
-  return Closure(e, stack)
+  # This produces a closure, which is a snapshot of the captured
+  # variables of e (those in FV(e)). S' is the restriction of S
+  # to those variables. Values are never modified in place (the
+  # heap holds mutable state), so the snapshot need not copy them.
+  return Closure(e, Env([stack.lookup(d, s) for d, s in e.addresses]))
 
-def eval_call(e : Expr, stack : dict, heap : list):
+def eval_call(e : Expr, stack : Env, heap : list):
   # Evaluate a call expression.
   #
   # S |- e0|s => \(xi).e1|s'   S |- ei|s'i => vi|s'i   S, si=vi |- e1|s'i => v1|s''i
@@ -228,6 +265,32 @@ def eval_call(e : Expr, stack : dict, heap : list):
   #
   # The arguments are evaluated and then their bindings added to the
   # stack prior to execution.
+  if e.cache is not None:
+    return eval_memo(e, stack, heap)
+  body, env = enter(e, stack, heap)
+  return eval_body(body, env, heap)
+
+def eval_memo(e : Expr, stack : Env, heap : list):
+  # Evaluate a call whose value may be saved in its cache (see
+  # memo.py). The value is saved only if the call did not change the
+  # heap.
+  c, args = operate(e, stack, heap)
+  env = Env(args, c.env)
+  if not c.abs.memo:
+    return eval_body(c.abs.expr, env, heap)
+  key = (c, *args)
+  found, v = e.cache.lookup(key, writes)
+  if found:
+    return v
+  n = writes
+  v = eval_body(c.abs.expr, env, heap)
+  if writes == n:
+    e.cache.store(key, v)
+  return v
+
+def operate(e : Expr, stack : Env, heap : list):
+  # Evaluate the function and arguments of a call. Returns the called
+  # closure and the values of the arguments.
   c = evaluate(e.fn, stack, heap)
   
   if type(c) is not Closure:
@@ -237,31 +300,61 @@ def eval_call(e : Expr, stack : dict, heap : list):
   args = []
   for a in e.args:
     args += [evaluate(a, stack, heap)]
+  return c, args
 
-  # Build the new environment containing the argument mapping.
-  #
-  # FIXME: This seems wrong. We should be appending the closure to
-  # the current stack and then evaluating. That also seems a little
-  # bit wrong... If the closure has variables with the same name as
-  # values on the stack, we end up overwriting them.
-  env = clone(c.env)
-  for i in range(len(args)):
-    env[c.abs.vars[i]] = args[i]
+def enter(e : Expr, stack : Env, heap : list):
+  # Evaluate the function and arguments of a call. Returns the body
+  # of the called abstraction and the environment in which to
+  # evaluate it.
+  c, args = operate(e, stack, heap)
+
+  # Create a frame for the arguments whose parent is the closure's
+  # environment.
+  env = Env(args, c.env)
 
-  return evaluate(c.abs.expr, env, heap)
+  return c.abs.expr, env
+
+def eval_body(e : Expr, stack : Env, heap : list):
+  # Evaluate the body of a lambda abstraction.
+  #
+  # Calls in tail position (see resolve) are evaluated in a loop,
+  # rather than recursively: the value of the tail call is the value
+  # of the body, so we can simply continue with the body of the
+  # called function. The loop follows conditionals and cases, whose
+  # branches may be in tail position. Everything else is evaluated
+  # normally. This allows recursive functions whose recursive calls
+  # are tail calls to run in constant (Python) stack space.
+  while True:
+    t = type(e)
+    if t is CallExpr and e.tail and e.cache is None:
+      e, stack = enter(e, stack, heap)
+    elif t is IfExpr:
+      e = e.true if evaluate(e.cond, stack, heap) else e.false
+    elif t is CaseExpr:
+      v1 = evaluate(e.expr, stack, heap)
+      stack = Env([v1.value], stack)
+      e = select(e, v1).expr
+    else:
+      return evaluate(e, stack, heap)
 
 @checked
-def eval_new(e : Expr, stack : dict, heap : list):
+def eval_new(e : Expr, stack : Env, heap : list):
   # S |- e1|s => v1|s'   l1 = fresh
   # ------------------------------- E-New
   # S |- new e1|s => l1|[l1->v1]s
+  #
+  # A local allocation creates a cell instead.
+  global writes
   v1 = evaluate(e.expr, stack, heap)
+  if e.local:
+    return Cell(v1)
   l1 = Location(len(heap))
   heap += [v1]
+  writes += 1
   return l1
 
 @checked
-def eval_deref(e : Expr, stack : dict, heap : list):
+def eval_deref(e : Expr, stack : Env, heap : list):
   # S |- e1|s => l1|s'    l1=v1 in s'
   # --------------------------------- E-Deref
   #       S |- *e1|s => v1|s'
@@ -269,172 +362,127 @@ def eval_deref(e : Expr, stack : dict, heap : list):
   # Note that we'll get an out-of-bounds error if the index is invalid.
   l1 = evaluate(e.expr, stack, heap)
   if type(l1) is not Location:
+    if type(l1) is Cell:
+      return l1.value
     raise Exception("invalid reference")
   return heap[l1.index]
 
 @checked
-def eval_assign(e : Expr, stack : dict, heap : list):
+def eval_assign(e : Expr, stack : Env, heap : list):
   # S |- e2|s => v2|s   S |- e1|s' => l1|s''
   # ---------------------------------------- E-Deref
   #    S |- e1 = e2|s => l1|[l1->v2]s''
   #
   # Operands are evaluated right to left. The effect is to update
   # location of e1 to the value of e2.
+  global writes
   v2 = evaluate(e.rhs, stack, heap)
   l1 = evaluate(e.lhs, stack, heap)
   if type(l1) is not Location:
+    if type(l1) is Cell:
+      l1.value = v2
+      return
     raise Exception("invalid reference")
   heap[l1.index] = v2
+  writes += 1
 
 @checked
-def eval_tuple(e : Expr, stack : dict, heap : list):
+def eval_tuple(e : Expr, stack : Env, heap : list):
   # FIXME: Document semantics.
   vs = []
   for x in e.elems:
     vs += [evaluate(x, stack, heap)]
   return Tuple(vs)
 
-def eval_proj(e : Expr, stack : dict, heap : list):
+def eval_proj(e : Expr, stack : Env, heap : list):
   # FIXME: Document semantics.
   v1 = evaluate(e.obj, stack, heap)
   return v1.values[e.index]
 
-def eval_record(e : Expr, stack : dict, heap : list):
+def eval_record(e : Expr, stack : Env, heap : list):
   # FIXME: Document semantics.
-  fs = []
+  vs = []
   for f in e.fields:
-    fs += [Field(f.id, evaluate(f.value, stack, heap))]
-  return Record(fs)
+    vs += [evaluate(f.value, stack, heap)]
+  return Record(e.type, tuple(vs))
 
-def eval_member(e : Expr, stack : dict, heap : list):
+def eval_member(e : Expr, stack : Env, heap : list):
   # FIXME: Document semantics.
   v1 = evaluate(e.obj, stack, heap)
-  return v1.select[e.id]
+  return v1.values[e.offset]
 
-def eval_variant(e : Expr, stack : dict, heap : list):
-  v1 = evaluate(e.field.value)
-  return Variant(e.field.id, v1)
+def eval_variant(e : Expr, stack : Env, heap : list):
+  v1 = evaluate(e.field.value, stack, heap)
+  return Variant(e.variant, e.tag, v1)
 
-def eval_case(e : Expr, stack : dict, heap : list):
+def select(e : Expr, v1 : Variant):
+  # Returns the case of e whose label matches the variant v1. This is
+  # found in the table computed by check, indexed by the tag.
+  case = e.table[v1.tag]
+  assert case != None
+  return case
+
+def eval_case(e : Expr, stack : Env, heap : list):
   v1 = evaluate(e.expr, stack, heap)
 
-  # Search for the corresponding label.
-  #
-  # This could be more efficient if we produced a mapping from
-  # labels to cases.
-  case = None
-  for c in e.cases:
-    if c.id == v1.tag:
-      case = c
-      break
-  assert case != None
+  # Find the case for the tag.
+  c = select(e, v1)
 
   # Execute the case as if calling a function.
-  env = clone(stack)
-  env[c.var] = v1.value
+  env = Env([v1.value], stack)
   return evaluate(c.expr, env, heap)
 
 
-def evaluate(e : Expr, stack : dict = {}, heap = []):
-  # Evaluate an expression. The stack is the calls stack.
 
+# Maps each kind of expression to the function that evaluates it.
+#
+# Dispatch is a single hash lookup on the type of the node, so every
+# kind of expression costs the same to dispatch. The entries are listed
+# in the same order as the grammar in lang.py.
+evaluators = {
   # Boolean expressions
-
-  if type(e) is BoolExpr:
-    return eval_bool(e, stack, heap)
-
-  if type(e) is AndExpr:
-    return eval_and(e, stack, heap)
-
-  if type(e) is OrExpr:
-    return eval_or(e, stack, heap)
-
-  if type(e) is NotExpr:
-    return eval_not(e, stack, heap)
-
-  if type(e) is IfExpr:
-    return eval_if(e, stack, heap)
+  BoolExpr: eval_bool,
+  AndExpr: eval_and,
+  OrExpr: eval_or,
+  NotExpr: eval_not,
+  IfExpr: eval_if,
 
   # Arithmetic expressions
-
-  if type(e) is IntExpr:
-    return eval_int(e, stack, heap)
-
-  if type(e) is AddExpr:
-    return eval_add(e, stack, heap)
-
-  if type(e) is SubExpr:
-    return eval_sub(e, stack, heap)
-
-  if type(e) is MulExpr:
-    return eval_mul(e, stack, heap)
-
-  if type(e) is DivExpr:
-    return eval_div(e, stack, heap)
-
-  if type(e) is RemExpr:
-    return eval_rem(e, stack, heap)
-
-  if type(e) is NegExpr:
-    return eval_neg(e, stack, heap)
+  IntExpr: eval_int,
+  AddExpr: eval_add,
+  SubExpr: eval_sub,
+  MulExpr: eval_mul,
+  DivExpr: eval_div,
+  RemExpr: eval_rem,
+  NegExpr: eval_neg,
 
   # Relational expressions
-
-  if type(e) is EqExpr:
-    return eval_eq(e, stack, heap)
-
-  if type(e) is NeExpr:
-    return eval_ne(e, stack, heap)
-
-  if type(e) is LtExpr:
-    return eval_lt(e, stack, heap)
-
-  if type(e) is GtExpr:
-    return eval_gt(e, stack, heap)
-
-  if type(e) is LeExpr:
-    return eval_le(e, stack, heap)
-
-  if type(e) is GeExpr:
-    return eval_ge(e, stack, heap)
+  EqExpr: eval_eq,
+  NeExpr: eval_ne,
+  LtExpr: eval_lt,
+  GtExpr: eval_gt,
+  LeExpr: eval_le,
+  GeExpr: eval_ge,
 
   # Functional expressions
-
-  if type(e) is LambdaExpr:
-    return eval_lambda(e, stack, heap)
-
-  if type(e) is CallExpr:
-    return eval_call(e, stack, heap)
+  IdExpr: eval_id,
+  LambdaExpr: eval_lambda,
+  CallExpr: eval_call,
 
   # Reference expressions
-
-  if type(e) is NewExpr:
-    return eval_new(e, stack, heap)
-
-  if type(e) is DerefExpr:
-    return eval_deref(e, stack, heap)
-
-  if type(e) is AssignExpr:
-    return eval_assign(e, stack, heap)
+  NewExpr: eval_new,
+  DerefExpr: eval_deref,
+  AssignExpr: eval_assign,
 
   # Data expressions
-
-  if type(e) is TupleExpr:
-    return eval_tuple(e, stack, heap)
-
-  if type(e) is ProjExpr:
-    return eval_proj(e, stack, heap)
-
-  if type(e) is RecordExpr:
-    return eval_record(e, stack, heap)
-
-  if type(e) is MemberExpr:
-    return eval_member(e, stack, heap)
-
-  if type(e) is VariantExpr:
-    return eval_variant(e, stack, heap)
-
-  if type(e) is CaseExpr:
-    return eval_case(e, stack, heap)
-
-  assert False
+  TupleExpr: eval_tuple,
+  ProjExpr: eval_proj,
+  RecordExpr: eval_record,
+  MemberExpr: eval_member,
+  VariantExpr: eval_variant,
+  CaseExpr: eval_case,
+}
+
+def evaluate(e : Expr, stack : Env = Env(), heap = []):
+  # Evaluate an expression. The stack is the calls stack.
+  return evaluators[type(e)](e, stack, heap)
@@ -0,0 +1,238 @@
+from lang import *
+from edit import places, get, put, size
+
+# This module implements constant folding, which evaluates operators
+# whose operands are literals ahead of time, and simplifies expressions
+# whose values are known:
+#
+#   3 + 5                    ~> 8
+#   not true                 ~> false
+#   e1 + 0                   ~> e1
+#   true and e1              ~> e1
+#   if true then e1 else e2  ~> e1
+#   case <l1=e0> as T of ... ~> case <l1=e0> as T of <l1=x1> => e1
+#
+# The pass runs after check, and keeps the tree checked: every literal
+# it creates has the type of the expression it replaces. It also keeps
+# the tree resolved, since none of these simplifications move an
+# expression into a different scope.
+#
+# Literals have no effects, so dropping one does not change the effects
+# of the program or the order in which they happen. Operands that are
+# not literals are never dropped. Division and remainder by a literal
+# zero are not folded, so that they fail at runtime as before.
+
+class Folding:
+  # The state of the pass. This counts the nodes eliminated from the
+  # tree.
+  def __init__(self):
+    self.eliminated = 0
+
+  def literal(self, e, v, n):
+    # Returns a literal with value v, replacing e, whose operands had
+    # n nodes.
+    x = BoolExpr(v) if type(v) is bool else IntExpr(v)
+    x.type = e.type
+    self.eliminated += n
+    return x
+
+  def drop(self, *es):
+    # Eliminate the expressions es.
+    self.eliminated += sum(size(x) for x in es)
+
+  def keep(self, x, *es):
+    # Returns x, eliminating the expressions es.
+    self.drop(*es)
+    return x
+
+def is_literal(e):
+  return type(e) in (BoolExpr, IntExpr)
+
+def is_value(e, v):
+  # Returns true if e is a literal with value v. Booleans are not
+  # integers here.
+  return is_literal(e) and type(e.value) is type(v) and e.value == v
+
+def fold_operands(e, f):
+  # Fold the operands of e.
+  for p in places[type(e)](e):
+    put(p, fold_expr(get(p), f))
+  return e
+
+def fold_unary(e, f, fn):
+  fold_operands(e, f)
+  if is_literal(e.expr):
+    return f.literal(e, fn(e.expr.value), 1)
+  return e
+
+def fold_binary(e, f, fn):
+  fold_operands(e, f)
+  return combine(e, f, fn)
+
+def combine(e, f, fn):
+  # Compute the value of a binary expression whose operands have been
+  # folded, if they are literals.
+  if is_literal(e.lhs) and is_literal(e.rhs):
+    return f.literal(e, fn(e.lhs.value, e.rhs.value), 2)
+  return e
+
+def fold_and(e, f):
+  # true and e1 ~> e1
+  # e1 and true ~> e1
+  e = fold_binary(e, f, lambda v1, v2: v1 and v2)
+  if type(e) is AndExpr:
+    if is_value(e.lhs, True):
+      return f.keep(e.rhs, e.lhs)
+    if is_value(e.rhs, True):
+      return f.keep(e.lhs, e.rhs)
+  return e
+
+def fold_or(e, f):
+  # false or e1 ~> e1
+  # e1 or false ~> e1
+  e = fold_binary(e, f, lambda v1, v2: v1 or v2)
+  if type(e) is OrExpr:
+    if is_value(e.lhs, False):
+      return f.keep(e.rhs, e.lhs)
+    if is_value(e.rhs, False):
+      return f.keep(e.lhs, e.rhs)
+  return e
+
+def fold_not(e, f):
+  # not not e1 ~> e1
+  e = fold_unary(e, f, lambda v1: not v1)
+  if type(e) is NotExpr and type(e.expr) is NotExpr:
+    f.eliminated += 2
+    return e.expr.expr
+  return e
+
+def fold_if(e, f):
+  # if true then e1 else e2 ~> e1
+  # if false then e1 else e2 ~> e2
+  fold_operands(e, f)
+  if is_literal(e.cond):
+    if e.cond.value:
+      return f.keep(e.true, e.cond, e.false)
+    else:
+      return f.keep(e.false, e.cond, e.true)
+  return e
+
+def fold_add(e, f):
+  # e1 + 0 ~> e1
+  # 0 + e1 ~> e1
+  e = fold_binary(e, f, lambda v1, v2: v1 + v2)
+  if type(e) is AddExpr:
+    if is_value(e.rhs, 0):
+      return f.keep(e.lhs, e.rhs)
+    if is_value(e.lhs, 0):
+      return f.keep(e.rhs, e.lhs)
+  return e
+
+def fold_sub(e, f):
+  # e1 - 0 ~> e1
+  e = fold_binary(e, f, lambda v1, v2: v1 - v2)
+  if type(e) is SubExpr and is_value(e.rhs, 0):
+    return f.keep(e.lhs, e.rhs)
+  return e
+
+def fold_mul(e, f):
+  # e1 * 1 ~> e1
+  # 1 * e1 ~> e1
+  e = fold_binary(e, f, lambda v1, v2: v1 * v2)
+  if type(e) is MulExpr:
+    if is_value(e.rhs, 1):
+      return f.keep(e.lhs, e.rhs)
+    if is_value(e.lhs, 1):
+      return f.keep(e.rhs, e.lhs)
+  return e
+
+def fold_div(e, f):
+  # Division by zero is left for the runtime.
+  fold_operands(e, f)
+  if is_value(e.rhs, 0):
+    return e
+  return combine(e, f, lambda v1, v2: v1 / v2)
+
+def fold_rem(e, f):
+  # Remainder by zero is left for the runtime.
+  fold_operands(e, f)
+  if is_value(e.rhs, 0):
+    return e
+  return combine(e, f, lambda v1, v2: v1 % v2)
+
+def fold_neg(e, f):
+  # --e1 ~> e1
+  e = fold_unary(e, f, lambda v1: -v1)
+  if type(e) is NegExpr and type(e.expr) is NegExpr:
+    f.eliminated += 2
+    return e.expr.expr
+  return e
+
+def fold_eq(e, f):
+  return fold_binary(e, f, lambda v1, v2: v1 == v2)
+
+def fold_ne(e, f):
+  return fold_binary(e, f, lambda v1, v2: v1 != v2)
+
+def fold_lt(e, f):
+  return fold_binary(e, f, lambda v1, v2: v1 < v2)
+
+def fold_gt(e, f):
+  return fold_binary(e, f, lambda v1, v2: v1 > v2)
+
+def fold_le(e, f):
+  return fold_binary(e, f, lambda v1, v2: v1 <= v2)
+
+def fold_ge(e, f):
+  return fold_binary(e, f, lambda v1, v2: v1 >= v2)
+
+def fold_case(e, f):
+  # When the operand is a variant expression, only the case matching
+  # its label can be selected, so the others are dropped.
+  fold_operands(e, f)
+  if type(e.expr) is VariantExpr:
+    cs = [c for c in e.cases if c.id == e.expr.field.id]
+    f.drop(*[c.expr for c in e.cases if c not in cs])
+    e.cases = cs
+    e.table = [c if c in cs else None for c in e.table]
+  return e
+
+# Maps the kinds of expression that can be folded to the functions that
+# fold them. Other expressions only have their operands folded.
+folders = {
+  # Boolean expressions
+  AndExpr: fold_and,
+  OrExpr: fold_or,
+  NotExpr: fold_not,
+  IfExpr: fold_if,
+
+  # Arithmetic expressions
+  AddExpr: fold_add,
+  SubExpr: fold_sub,
+  MulExpr: fold_mul,
+  DivExpr: fold_div,
+  RemExpr: fold_rem,
+  NegExpr: fold_neg,
+
+  # Relational expressions
+  EqExpr: fold_eq,
+  NeExpr: fold_ne,
+  LtExpr: fold_lt,
+  GtExpr: fold_gt,
+  LeExpr: fold_le,
+  GeExpr: fold_ge,
+
+  # Data expressions
+  CaseExpr: fold_case,
+}
+
+def fold_expr(e, f):
+  return folders.get(type(e), fold_operands)(e, f)
+
+def fold(e : Expr, f : Folding = None):
+  # Fold the constants in a checked expression. Returns the folded
+  # expression. The operands of e are modified in place. The number of
+  # nodes eliminated is counted in f.
+  if f is None:
+    f = Folding()
+  return fold_expr(e, f)
@@ -0,0 +1,154 @@
+from lang import *
+from edit import places, get, put, size, clear
+from effects import pure, invariant
+from capture import free
+from subst import subst
+
+import copy
+
+# This module implements inlining of lambda abstractions. A call of a
+# lambda abstraction,
+#
+#   (\(x1, ..., xn).e0)(e1, ..., en)
+#
+# can be replaced by the body e0 with each variable xi replaced by the
+# argument ei. This avoids creating the closure and the frame for its
+# arguments. Each argument is evaluated exactly once, before the body,
+# so an argument is substituted only when that does not change the
+# behavior of the program:
+#
+#   - Literals and variables are substituted for every use.
+#   - Lambda abstractions are substituted if they are used once, or
+#     their size is within the budget. Otherwise, inlining could
+#     duplicate a large amount of code.
+#   - Pure arguments (see effects.py) that are never used are dropped.
+#   - Invariant arguments (those that do not even read the heap) that
+#     are used once are substituted, unless that use is within a nested
+#     abstraction, where it could be evaluated many times.
+#
+# The remaining arguments stay bound by a call of an abstraction that
+# declares the remaining variables (in effect, a let). Their order is
+# unchanged, and the arguments that were removed have no effects.
+#
+# Substituting an abstraction for a variable often creates new calls of
+# abstractions in the body, which are inlined in turn. For example:
+#
+#   (\(f).f(1) + f(2))(\(x).x + 1) ~> (1 + 1) + (2 + 1)
+#
+# Inlining creates new expressions and moves expressions into different
+# scopes, so the program is resolved and checked again afterwards. Like
+# resolve, this must be applied to a whole program.
+
+class Inlining:
+  # The state of the pass. This holds the budget, the size of the
+  # largest abstraction that is copied to several uses, and counts the
+  # calls that were inlined, fully or partially (when some arguments
+  # remain bound). changed records whether the last run rewrote the
+  # program.
+  def __init__(self, budget : int = 10):
+    self.budget = budget
+    self.inlined = 0
+    self.partial = 0
+    self.changed = False
+
+class Copies(dict):
+  # A substitution that gives each use of a variable its own copy of
+  # the expression, since the address of a variable depends on where it
+  # is used. The first use gets the expression itself.
+  def __init__(self):
+    dict.__init__(self)
+    self.used = set()
+
+  def __getitem__(self, v):
+    e = dict.__getitem__(self, v)
+    if v not in self.used:
+      self.used.add(v)
+      return e
+    return duplicate(e)
+
+def duplicate(e):
+  # Returns a copy of e. The copy declares its own variables, but
+  # refers to the same free variables as e.
+  memo = {id(v):v for v in free(e)}
+  memo[id(e.parent)] = e.parent
+  return copy.deepcopy(e, memo)
+
+def uses(e, counts, nested, inner = False):
+  # Count the references to each variable in e. Variables referenced
+  # within a nested abstraction are added to nested.
+  if type(e) is IdExpr:
+    counts[e.ref] = counts.get(e.ref, 0) + 1
+    if inner:
+      nested.add(e.ref)
+  inner = inner or type(e) is LambdaExpr
+  for p in places[type(e)](e):
+    uses(get(p), counts, nested, inner)
+
+def inline_operands(e, s):
+  # Inline the calls in the operands of e.
+  for p in places[type(e)](e):
+    put(p, inline_expr(get(p), s))
+  return e
+
+def inline_call(e, s):
+  inline_operands(e, s)
+  if type(e.fn) is not LambdaExpr:
+    return e
+
+  abs = e.fn
+  counts = {}
+  nested = set()
+  uses(abs.expr, counts, nested)
+  sub = Copies()
+  vars = []
+  args = []
+  for v, a in zip(abs.vars, e.args):
+    n = counts.get(v, 0)
+    if n == 0 and pure(a):
+      continue
+    if type(a) in (BoolExpr, IntExpr, IdExpr):
+      sub[v] = a
+    elif type(a) is LambdaExpr and (n == 1 or size(a) <= s.budget):
+      sub[v] = a
+    elif n == 1 and v not in nested and invariant(a):
+      sub[v] = a
+    else:
+      vars += [v]
+      args += [a]
+
+  if len(vars) == len(abs.vars):
+    return e
+
+  # Inline the calls created by substitution.
+  body = inline_expr(subst(abs.expr, sub), s)
+  s.changed = True
+  if vars:
+    s.partial += 1
+    return CallExpr(LambdaExpr(vars, body), args)
+  s.inlined += 1
+  return body
+
+# Maps the kinds of expression that can be inlined to the functions
+# that inline them. Other expressions only have the calls within their
+# operands inlined.
+inliners = {
+  # Functional expressions
+  CallExpr: inline_call,
+}
+
+def inline_expr(e, s):
+  return inliners.get(type(e), inline_operands)(e, s)
+
+def inline(e : Expr, s : Inlining = None):
+  # Inline calls of lambda abstractions in a checked program. Returns
+  # the new program, which is resolved and checked. The number of calls
+  # inlined is counted in s.
+  if s is None:
+    s = Inlining()
+  s.changed = False
+  e = inline_expr(e, s)
+  if s.changed:
+    clear(e)
+    resolve(e)
+    check(e)
+  return e
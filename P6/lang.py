@@ -5,15 +5,24 @@ class VarDecl:
   # 
   # Note that this is NOT an expression. It is the declaration 
   # of a name.
+  __slots__ = ("id", "type", "binder", "uses")
+
   def __init__(self, id, t):
     self.id = id
     self.type = typify(t)
 
+    # The expression that declares the variable, and the identifiers
+    # that refer to it. These are computed by link (see edit.py).
+    self.binder = None
+    self.uses = set()
+
   def __str__(self):
     return f"{self.id}:{str(self.type)}"
 
 class FieldDecl:
   # Like a VarDecl, but for fields and variants.
+  __slots__ = ("id", "type")
+
   def __init__(self, id, t):
     self.id = id
     self.type = typify(t)
@@ -24,6 +33,8 @@ class FieldDecl:
 class FieldInit:
   # Represents the explicit initialization of (certain) variables
   # with a value.
+  __slots__ = ("id", "value")
+
   def __init__(self, id, e):
     self.id = id
     self.value = expr(e)
@@ -31,14 +42,51 @@ class FieldInit:
   def __str__(self):
     return f"{self.id}={str(self.value)}"
 
-class Type:
+class Interned(type):
+  # The metaclass of types, which interns them: constructing a type
+  # that is equal to an existing type returns the existing object. This
+  # means that types can be compared by identity.
+  #
+  # Types are interned by a key computed from their constructor's
+  # arguments. Each type class defines a static method, key, that
+  # computes it. Because the components of a type are themselves
+  # interned, keys are compared (and hashed) by the identity of their
+  # components, so interning a type takes time proportional to its
+  # number of components.
+  #
+  # Interned types are shared, so they must never be modified.
+  def __call__(cls, *args):
+    k = (cls, cls.key(*args))
+    t = interned.get(k)
+    if t is None:
+      t = type.__call__(cls, *args)
+      interned[k] = t
+    return t
+
+# Maps keys to interned types.
+interned = {}
+
+class Type(metaclass=Interned):
   # Represents a type in the language.
   #
   # T ::= Bool
   #       Int
   #       (T1, T2, ..., Tn) -> T0
   #       Ref T1
-  pass
+  #       {T1, ..., Tn}
+  #       {l1:T1, ..., ln:Tn}
+  #       <l1:T1, ..., ln:Tn>
+
+  @staticmethod
+  def key():
+    return ()
+
+  # Types are unique, so copying one returns the same object.
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
 
 class BoolType(Type):
   # Represents the type 'Bool'
@@ -56,6 +104,10 @@ class FnType(Type):
     self.parms = list(map(typify, parms))
     self.ret = typify(ret)
 
+  @staticmethod
+  def key(parms, ret):
+    return (tuple(map(typify, parms)), typify(ret))
+
   def __str__(self):
     parms = ",".join([str(p) for p in self.parms])
     return f"({parms})->{str(self.ret)}"
@@ -65,6 +117,10 @@ class RefType(Type):
   def __init__(self, t):
     self.ref = typify(t)
 
+  @staticmethod
+  def key(t):
+    return typify(t)
+
   def __str__(self):
     return f"Ref {str(self.ref)}"
 
@@ -73,15 +129,34 @@ class TupleType(Type):
   def __init__(self, ts):
     self.elems = list(map(typify, ts))
 
+  @staticmethod
+  def key(ts):
+    return tuple(map(typify, ts))
+
   def __str__(self):
     es = ",".join([str(t) for t in self.elems])
     return f"{{{es}}}"
 
+def fields_key(fs):
+  # Returns the key of a record or variant type with fields fs.
+  return tuple((f.id, f.type) for f in map(field, fs))
+
 class RecordType(Type):
   # Represents types of the form '{li:T1, ..., xn:Tn}'
   def __init__(self, fs):
     self.fields = list(map(field, fs))
 
+    # Maps labels to fields.
+    self.select = {f.id:f for f in self.fields}
+
+    # Maps labels to the offsets of their values in records of this
+    # type. See check_member.
+    self.offsets = {f.id:i for i, f in enumerate(self.fields)}
+
+  @staticmethod
+  def key(fs):
+    return fields_key(fs)
+
   def __str__(self):
     fs = ",".join(str(f) for f in self.fields)
     return f"{{{fs}}}"
@@ -91,6 +166,19 @@ class VariantType(Type):
   def __init__(self, fs):
     self.fields = list(map(field, fs))
 
+    # Maps labels to fields.
+    self.select = {f.id:f for f in self.fields}
+
+    # Maps labels to their tags: the positions of their fields. Variant
+    # values hold the tag rather than the label. A variant type whose
+    # fields are a prefix of another's gives its labels the same tags,
+    # so width subtyping would keep tags valid in the larger type.
+    self.tags = {f.id:i for i, f in enumerate(self.fields)}
+
+  @staticmethod
+  def key(fs):
+    return fields_key(fs)
+
   def __str__(self):
     fs = ",".join(str(f) for f in self.fields)
     return f"<{fs}>"
@@ -147,14 +235,29 @@ class Expr:
   #         e1.x
   #         <x1=e> as T
   #         case e1 of <xi=li> => ei
-  
+  #
+  # Expressions (and declarations) declare their attributes in
+  # __slots__, so that each node is a fixed-size object without a
+  # dictionary. Every attribute of a node, including those computed by
+  # later passes, must be declared by its class, and initialized in its
+  # constructor.
+  __slots__ = ("type", "number", "parent")
+
   def __init__(self):
     self.type = None
 
+    # The value number of a shared, closed expression. See share.py.
+    self.number = None
+
+    # The enclosing expression, computed by link (see edit.py).
+    self.parent = None
+
 ## Boolean expressions
 
 class BoolExpr(Expr):
   # Represents the literals 'true' and 'false'.
+  __slots__ = ("value",)
+
   def __init__(self, val):
     Expr.__init__(self)
     self.value = val
@@ -164,6 +267,8 @@ class BoolExpr(Expr):
 
 class AndExpr(Expr):
   # Represents expressions of the form `e1 and e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, e1, e2):
     Expr.__init__(self)
     self.lhs = expr(e1)
@@ -174,6 +279,8 @@ class AndExpr(Expr):
 
 class OrExpr(Expr):
   # Represents expressions of the form `e1 or e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, e1, e2):
     Expr.__init__(self)
     self.lhs = expr(e1)
@@ -184,6 +291,8 @@ class OrExpr(Expr):
 
 class NotExpr(Expr):
   # Represents expressions of the form `not e1`.
+  __slots__ = ("expr",)
+
   def __init__(self, e1):
     Expr.__init__(self)
     self.expr = expr(e1)
@@ -193,6 +302,8 @@ class NotExpr(Expr):
 
 class IfExpr(Expr):
   # Represents expressions of the form `if e1 then e2 else e3`.
+  __slots__ = ("cond", "true", "false")
+
   def __init__(self, e1, e2, e3):
     Expr.__init__(self)
     self.cond = expr(e1)
@@ -206,6 +317,8 @@ class IfExpr(Expr):
 
 class IdExpr(Expr):
   # Represents identifiers that refer to variables.
+  __slots__ = ("id", "ref", "depth", "slot")
+
   def __init__(self, x):
     Expr.__init__(self)
     if type(x) is str:
@@ -217,6 +330,12 @@ class IdExpr(Expr):
       self.id = x.id
       self.ref = x
 
+    # The lexical address of the variable: the number of frames
+    # between the reference and the declaration, and the index of the
+    # variable in that frame. This is computed by resolve.
+    self.depth = None
+    self.slot = None
+
   def __str__(self):
     return self.id
 
@@ -224,6 +343,8 @@ class IdExpr(Expr):
 
 class IntExpr(Expr):
   # Represents numeric literals.
+  __slots__ = ("value",)
+
   def __init__(self, val):
     Expr.__init__(self)
     self.value = val
@@ -233,6 +354,8 @@ class IntExpr(Expr):
 
 class AddExpr(Expr):
   # Represents expressions of the form `e1 + e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -243,6 +366,8 @@ class AddExpr(Expr):
 
 class SubExpr(Expr):
   # Represents expressions of the form `e1 + e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -253,6 +378,8 @@ class SubExpr(Expr):
 
 class MulExpr(Expr):
   # Represents expressions of the form `e1 - e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -263,6 +390,8 @@ class MulExpr(Expr):
 
 class DivExpr(Expr):
   # Represents expressions of the form `e1 / e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -273,6 +402,8 @@ class DivExpr(Expr):
 
 class RemExpr(Expr):
   # Represents expressions of the form `e1 % e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -283,6 +414,8 @@ class RemExpr(Expr):
 
 class NegExpr(Expr):
   # Represents expressions of the form `-e1`.
+  __slots__ = ("expr",)
+
   def __init__(self, e1):
     Expr.__init__(self)
     self.expr = expr(e1)
@@ -294,6 +427,8 @@ class NegExpr(Expr):
 
 class EqExpr(Expr):
   # Represents expressions of the form `e1 == e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -304,6 +439,8 @@ class EqExpr(Expr):
 
 class NeExpr(Expr):
   # Represents expressions of the form `e1 != e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -314,6 +451,8 @@ class NeExpr(Expr):
 
 class LtExpr(Expr):
   # Represents expressions of the form `e1 < e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -324,6 +463,8 @@ class LtExpr(Expr):
 
 class GtExpr(Expr):
   # Represents expressions of the form `e1 > e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -334,6 +475,8 @@ class GtExpr(Expr):
 
 class LeExpr(Expr):
   # Represents expressions of the form `e1 <= e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -344,6 +487,8 @@ class LeExpr(Expr):
 
 class GeExpr(Expr):
   # Represents expressions of the form `e1 >= e2`.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, lhs, rhs):
     Expr.__init__(self)
     self.lhs = expr(lhs)
@@ -358,11 +503,25 @@ class LambdaExpr(Expr):
   # Represents multi-argument lambda abstractions.
   # Note that '\(x, y, z).e' is syntactic sugar for
   # '\x.\y.\z.e'.
+  __slots__ = ("vars", "expr", "captures", "addresses", "code", "memo")
+
   def __init__(self, vars, e1):
     Expr.__init__(self)
     self.vars = list(map(decl, vars))
     self.expr = expr(e1)
 
+    # The list of variables declared outside of the abstraction and
+    # referenced within it, and their addresses relative to the
+    # abstraction. These are computed by resolve.
+    self.captures = None
+    self.addresses = None
+
+    # The compiled body of the abstraction. See compile.py.
+    self.code = None
+
+    # True if calls of the abstraction can be memoized. See memo.py.
+    self.memo = False
+
   def __str__(self):
     parms = ",".join(str(v) for v in self.vars)
     return f"\\({parms}).{self.expr}"
@@ -370,16 +529,27 @@ class LambdaExpr(Expr):
 class CallExpr(Expr):
   # Represents calls of multi-argument lambda 
   # abstractions.
+  __slots__ = ("fn", "args", "tail", "cache")
+
   def __init__(self, fn, args):
     Expr.__init__(self)
     self.fn = expr(fn)
     self.args = list(map(expr, args))
 
+    # True if the call is in tail position: its value is the value of
+    # the enclosing lambda abstraction. This is computed by resolve.
+    self.tail = False
+
+    # The cache that memoizes the call, or None. See memo.py.
+    self.cache = None
+
   def __str__(self):
     args = ",".join(str(a) for a in self.args)
     return f"{self.fn} ({args})"
 
 class PlaceholderExpr(Expr):
+  __slots__ = ()
+
   def __init__(self):
     Expr.__init__(self)
 
@@ -391,15 +561,23 @@ class PlaceholderExpr(Expr):
 
 class NewExpr(Expr):
   # Represents the allocation of new objects.
+  __slots__ = ("expr", "local")
+
   def __init__(self, e):
     Expr.__init__(self)
     self.expr = expr(e)
 
+    # True if the location never escapes the call that binds it, so
+    # the cell can be kept in a frame. See escape.py.
+    self.local = False
+
   def __str__(self):
     return f"new {self.expr}"
 
 class DerefExpr(Expr):
   # Returns the value at a location.
+  __slots__ = ("expr",)
+
   def __init__(self, e):
     Expr.__init__(self)
     self.expr = expr(e)
@@ -409,6 +587,8 @@ class DerefExpr(Expr):
 
 class AssignExpr(Expr):
   # Represents assignment.
+  __slots__ = ("lhs", "rhs")
+
   def __init__(self, e1, e2):
     Expr.__init__(self)
     self.lhs = expr(e1)
@@ -419,6 +599,8 @@ class AssignExpr(Expr):
 
 # Data expressions
 class TupleExpr(Expr):
+  __slots__ = ("elems",)
+
   def __init__(self, es):
     Expr.__init__(self)
     self.elems = list(map(expr, es))
@@ -428,6 +610,8 @@ class TupleExpr(Expr):
     return f"{{{es}}}"
 
 class ProjExpr(Expr):
+  __slots__ = ("obj", "index")
+
   def __init__(self, e1, n):
     Expr.__init__(self)
     self.obj = e1
@@ -437,6 +621,8 @@ class ProjExpr(Expr):
     return f"{str(self.obj)}.{self.index}"
 
 class RecordExpr(Expr):
+  __slots__ = ("fields",)
+
   def __init__(self, fs):
     Expr.__init__(self)
     self.fields = list(map(init, fs))
@@ -446,6 +632,8 @@ class RecordExpr(Expr):
     return f"{{{fs}}}"
 
 class MemberExpr(Expr):
+  __slots__ = ("obj", "id", "ref", "offset")
+
   def __init__(self, e1, id):
     Expr.__init__(self)
     self.obj = e1
@@ -453,18 +641,28 @@ class MemberExpr(Expr):
 
     # Binds to the corresponding field declaration, so we can
     # easily determine the type of the expression.
-    self.Ref = None
+    self.ref = None
+
+    # The offset of the member's value in the record. This is computed
+    # by check.
+    self.offset = None
 
   def __str__(self):
     return f"{str(self.obj)}.{self.id}"
 
 class VariantExpr(Expr):
   # Expressions '<x1=e1> as T1'.
+  __slots__ = ("field", "variant", "tag")
+
   def __init__(self, f, t):
     Expr.__init__(self)
     self.field = init(f)
     self.variant = typify(t)
 
+    # The tag of the label in the variant type. This is computed by
+    # check.
+    self.tag = None
+
   def __str__(self):
     return f"<{str(self.field)}> as {str(self.type)}"
 
@@ -474,9 +672,11 @@ class Case:
   # This is similar to an untyped lambda abstraction \x1.e1. Note
   # that x1 should be typed in this language, but we can't compute
   # the type of the x1 until type checking.
+  __slots__ = ("id", "var", "expr")
+
   def __init__(self, id, n, e):
     self.id = id # The label l1
-    self.var = VarDecl(n, None) # The untyped variable x1
+    self.var = n if type(n) is VarDecl else VarDecl(n, None) # The untyped variable x1
     self.expr = expr(e) # The expression to evaluate
   
   def __str__(self):
@@ -484,20 +684,26 @@ class Case:
 
 class CaseExpr(Expr):
   # Expressions 'case e1 of <li=xi> => ei'.
+  __slots__ = ("expr", "cases", "table")
+
   def __init__(self, e, cs):
     Expr.__init__(self)
     self.expr = expr(e)
     self.cases = list(map(case, cs))
 
+    # Maps each tag of the operand's type to the case selected by it,
+    # or None if there is none. This is computed by check.
+    self.table = None
+
   def __str__(self):
     cs = " | ".join([str(c) for c in self.cases])
     return f"case {str(self.expr)} of {cs}"
 
 def typify(x):
   if x is bool:
-    return BoolType()
+    return boolType
   if x is int:
-    return IntType()
+    return intType
   return x
 
 def expr(x):
@@ -514,7 +720,9 @@ def expr(x):
 def decl(x):
   # Turn a python object into a declaration.
   if type(x) is str:
-    return VarDecl(x)
+    return VarDecl(x, None)
+  if type(x) is tuple:
+    return VarDecl(x[0], x[1])
   return x
 
 def field(x):
@@ -537,3 +745,4 @@ from check import check
 from subst import subst
 from reduce import step, reduce
 from evaluate import evaluate
+from compile import compile_expr
@@ -1,174 +1,276 @@
 from lang import *
 from decorate import *
 
+# This module implements name resolution, which binds each identifier
+# to its declaration.
+#
+# Resolution also computes the lexical address of each identifier: the
+# number of frames between the reference and its declaration (its depth)
+# and the index of the variable within that frame (its slot). At runtime
+# (see env.py), a lambda abstraction's call creates a frame for its
+# parameters, whose parent is a frame holding the values captured by its
+# closure. Each case creates a frame holding its variable.
+#
+# A closure captures only the variables it references but does not
+# declare. These are found during resolution: when a reference crosses a
+# lambda abstraction, its declaration is added to the abstraction's
+# capture set, and the address of the declaration (relative to the
+# abstraction) is saved so that evaluation can build the closure.
+
+class Scope:
+  # A scope corresponds to a frame at runtime. It holds the variables
+  # declared in the frame, and maps each declaration to its slot.
+  def __init__(self, vars : list = None, owner = None):
+    self.vars = vars if vars is not None else []
+    self.slots = {v:i for i, v in enumerate(self.vars)}
+
+    # For the frame of a lambda abstraction's captured variables, the
+    # abstraction. The captured variables are added as they are found,
+    # so the scope declares no names.
+    self.owner = owner
+
+class Scopes:
+  # The stack of scopes enclosing an expression during resolution.
+  #
+  # Rather than searching each scope for a name, this keeps a single
+  # table mapping each name to the stack of its declarations in scope.
+  # Entering a scope pushes its variables onto the table, and leaving
+  # it pops them, so the scope itself acts as the log of what to undo.
+  # This means that entering and leaving a scope takes time
+  # proportional to the number of variables it declares, and that
+  # lookup takes constant time.
+  def __init__(self):
+    # The scopes on the stack.
+    self.scopes = []
+
+    # Maps names to the stack of their declarations.
+    self.names = {}
+
+    # Maps declarations to the position of their scope on the stack.
+    self.levels = {}
+
+    # The positions of lambda abstractions' capture scopes.
+    self.owners = []
+
+  def push(self, scope : Scope):
+    n = len(self.scopes)
+    self.scopes += [scope]
+    if scope.owner is not None:
+      self.owners += [n]
+    for v in scope.vars:
+      self.names.setdefault(v.id, []).append(v)
+      self.levels[v] = n
+
+  def pop(self):
+    scope = self.scopes.pop()
+    if scope.owner is not None:
+      self.owners.pop()
+    for v in reversed(scope.vars):
+      self.names[v.id].pop()
+      del self.levels[v]
+
+@checked
+def lookup(id : str, stk : Scopes):
+  # Perform name lookup. Returns the innermost declaration of `id` or
+  # None if the name is undeclared.
+  decls = stk.names.get(id)
+  return decls[-1] if decls else None
+
 @checked
-def lookup(id : str, stk : list):
-  # Perform name lookup. Search the scope stack for the first
-  # declaration of `id`. Returns the declaration or None if 
-  # the name is undeclared.
-  for scope in reversed(stk):
-    if id in scope:
-      return scope[id]
-  return None
+def address(decl : VarDecl, stk : Scopes, n : int, k : int):
+  # Returns the depth and slot of decl, relative to the first n scopes
+  # of the stack, which contain the first k capture scopes. If decl is
+  # declared outside the innermost lambda abstraction among those
+  # scopes, then decl is captured by that abstraction.
+  if decl not in stk.levels:
+    raise Exception("name lookup error")
+  level = stk.levels[decl]
+  if k == 0 or level > stk.owners[k - 1]:
+    return (n - 1 - level, stk.scopes[level].slots[decl])
+
+  m = stk.owners[k - 1]
+  scope = stk.scopes[m]
+  if decl not in scope.slots:
+    abs = scope.owner
+    abs.addresses += [address(decl, stk, m, k - 1)]
+    abs.captures += [decl]
+    scope.slots[decl] = len(scope.slots)
+  return (n - 1 - m, scope.slots[decl])
 
 @checked
-def resolve_unary(e : Expr, stk : list):
+def resolve_unary(e : Expr, stk : Scopes):
   resolve(e.expr, stk)
   return e
 
 @checked
-def resolve_binary(e : Expr, stk : list):
+def resolve_binary(e : Expr, stk : Scopes):
   resolve(e.lhs, stk)
   resolve(e.rhs, stk)
   return e
 
 @checked
-def resolve(e : Expr, stk : list = []):
-  # Resolve references to declared variables. This requires a scope
-  # stack. A scope is a mappings from names to their declarations.
-  #
-  # Returns the modified (in-place) tree.
-
-  # Boolean expressions
+def resolve_leaf(e : Expr, stk : Scopes):
+  # Literals contain no names.
+  return e
 
-  if type(e) is BoolExpr:
-    return e
+@checked
+def resolve_if(e : Expr, stk : Scopes):
+  resolve(e.cond, stk)
+  resolve(e.true, stk)
+  resolve(e.false, stk)
+  return e
 
-  if type(e) is AndExpr:
-    return resolve_binary(e, stk)
+@checked
+def resolve_id(e : Expr, stk : Scopes):
+  # Perform name lookup. If the expression is already bound to its
+  # declaration (e.g., when it was built from one, or is being resolved
+  # again after a transformation), we keep that binding.
+  decl = e.ref if e.ref else lookup(e.id, stk)
+  if not decl:
+    raise Exception("name lookup error")
+
+  # Bind the expression to its declaration and compute its address.
+  e.ref = decl
+  e.depth, e.slot = address(decl, stk, len(stk.scopes), len(stk.owners))
+  return e
 
-  if type(e) is OrExpr:
-    return resolve_binary(e, stk)
+@checked
+def resolve_lambda(e : Expr, stk : Scopes):
+  # Enter the scopes of the lambda's definition. There is a scope for
+  # the captured variables, which are added as they are found, and one
+  # for the parameters.
+  e.captures = []
+  e.addresses = []
+  stk.push(Scope([], e))
+  stk.push(Scope(e.vars))
+  resolve(e.expr, stk)
+  stk.pop()
+  stk.pop()
+  mark_tail(e.expr)
+  return e
 
-  if type(e) is NotExpr:
-    return resolve_unary(e, stk)
+@checked
+def mark_tail(e : Expr):
+  # Mark the calls in tail position within the body of a lambda
+  # abstraction. The body is in tail position, as are the branches
+  # of a conditional and the cases of a case expression that are.
+  if type(e) is CallExpr:
+    e.tail = True
+  elif type(e) is IfExpr:
+    mark_tail(e.true)
+    mark_tail(e.false)
+  elif type(e) is CaseExpr:
+    for c in e.cases:
+      mark_tail(c.expr)
 
-  if type(e) is IfExpr:
-    resolve(e.cond, stk)
-    resolve(e.true, stk)
-    resolve(e.false, stk)
-    return e
+@checked
+def resolve_call(e : Expr, stk : Scopes):
+  # The call is not in tail position unless the enclosing abstraction
+  # marks it, which happens after its body is resolved. This clears the
+  # mark of a call that was moved out of tail position by a rewrite.
+  e.tail = False
+  resolve(e.fn, stk)
+  for a in e.args:
+    resolve(a, stk)
+  return e
 
-  # Arithmetic expressions
+@checked
+def resolve_tuple(e : Expr, stk : Scopes):
+  for x in e.elems:
+    resolve(x, stk)
+  return e
 
-  if type(e) is IntExpr:
-    return e
+@checked
+def resolve_proj(e : Expr, stk : Scopes):
+  # We can't check the validity of the index because
+  # we don't haver the type of the object, only the
+  # expression that computes the tuple.
+  resolve(e.obj, stk)
+  return e
 
-  if type(e) is AddExpr:
-    return resolve_binary(e, stk)
+@checked
+def resolve_record(e : Expr, stk : Scopes):
+  for f in e.fields:
+    resolve(f.value, stk)
+  return e
 
-  if type(e) is SubExpr:
-    return resolve_binary(e, stk)
+@checked
+def resolve_member(e : Expr, stk : Scopes):
+  # We can't check the validity of the index because
+  # we don't haver the type of the object, only the
+  # expression that computes the tuple.
+  resolve(e.obj, stk)
+  return e
 
-  if type(e) is MulExpr:
-    return resolve_binary(e, stk)
+@checked
+def resolve_variant(e : Expr, stk : Scopes):
+  # We could hypothetically check the label against the
+  # type, but we'll defer until typing so that all of
+  # these operations are done at the same time.
+  resolve(e.field.value, stk)
+  return e
 
-  if type(e) is DivExpr:
-    return resolve_binary(e, stk)
+@checked
+def resolve_case(e : Expr, stk : Scopes):
+  resolve(e.expr, stk)
+  for c in e.cases:
+    stk.push(Scope([c.var]))
+    resolve(c.expr, stk)
+    stk.pop()
+  return e
 
-  if type(e) is RemExpr:
-    return resolve_binary(e, stk)
+# Maps each kind of expression to the function that resolves the
+# names within it. See the corresponding table in evaluate.py.
+resolvers = {
+  # Boolean expressions
+  BoolExpr: resolve_leaf,
+  AndExpr: resolve_binary,
+  OrExpr: resolve_binary,
+  NotExpr: resolve_unary,
+  IfExpr: resolve_if,
 
-  if type(e) is NegExpr:
-    return resolve_unary(e, stk)
+  # Arithmetic expressions
+  IntExpr: resolve_leaf,
+  AddExpr: resolve_binary,
+  SubExpr: resolve_binary,
+  MulExpr: resolve_binary,
+  DivExpr: resolve_binary,
+  RemExpr: resolve_binary,
+  NegExpr: resolve_unary,
 
   # Relational expressions
-
-  if type(e) is EqExpr:
-    return resolve_binary(e, stk)
-
-  if type(e) is NeExpr:
-    return resolve_binary(e, stk)
-
-  if type(e) is LtExpr:
-    return resolve_binary(e, stk)
-
-  if type(e) is GtExpr:
-    return resolve_binary(e, stk)
-
-  if type(e) is LeExpr:
-    return resolve_binary(e, stk)
-
-  if type(e) is GeExpr:
-    return resolve_binary(e, stk)
+  EqExpr: resolve_binary,
+  NeExpr: resolve_binary,
+  LtExpr: resolve_binary,
+  GtExpr: resolve_binary,
+  LeExpr: resolve_binary,
+  GeExpr: resolve_binary,
 
   # Lambda expressions
-
-  if type(e) is IdExpr:
-    # Perform name lookup.
-    decl = lookup(e.id, stk)
-    if not decl:
-      raise Exception("name lookup error")
-
-    # Bind the expression to its declaration.
-    e.ref = decl
-    return e
-
-  if type(e) is LambdaExpr:
-    # Create a new stack for resolving identifiers in
-    # the lambda's definition.
-    newstk = stk + [{var.id:var for var in e.vars}]
-    resolve(e.expr, newstk)
-    return e
-
-  if type(e) is CallExpr:
-    resolve(e.fn, stk)
-    for a in e.args:
-      resolve(e.fn, stk)
-    return e
+  IdExpr: resolve_id,
+  LambdaExpr: resolve_lambda,
+  CallExpr: resolve_call,
 
   # Reference expressions
-
-  if type(e) is NewExpr:
-    return resolve_unary(e, stk)
-
-  if type(e) is DerefExpr:
-    return resolve_unary(e, stk)
-
-  if type(e) is AssignExpr:
-    return resolve_binary(e, stk)
+  NewExpr: resolve_unary,
+  DerefExpr: resolve_unary,
+  AssignExpr: resolve_binary,
 
   # Data expressions
+  TupleExpr: resolve_tuple,
+  ProjExpr: resolve_proj,
+  RecordExpr: resolve_record,
+  MemberExpr: resolve_member,
+  VariantExpr: resolve_variant,
+  CaseExpr: resolve_case,
+}
 
-  if type(e) is TupleExpr:
-    for x in e.elems:
-      resolve(x)
-    return e
-
-  if type(e) is ProjExpr:
-    # We can't check the validity of the index because
-    # we don't haver the type of the object, only the
-    # expression that computes the tuple.
-    resolve(e.obj)
-    return e
-
-  if type(e) is RecordExpr:
-    for f in e.fields:
-      resolve(f.value)
-    return e
-
-  if type(e) is MemberExpr:
-    # We can't check the validity of the index because
-    # we don't haver the type of the object, only the
-    # expression that computes the tuple.
-    resolve(e.obj)
-    return e
-
-  if type(e) is VariantExpr:
-    # We could hypothetically check the label against the
-    # type, but we'll defer until typing so that all of
-    # these operations are done at the same time.
-    resolve(e.field.value)
-    return e
-
-  if type(e) is CaseExpr:
-    resolve(e.expr)
-    for c in e.cases:
-      newstk = stk + [{c.var.id, c.var}]
-      resolve(c.expr, newstk)
-    return e
-
-
-  print(repr(e))
-  assert False
-  
\ No newline at end of file
+@checked
+def resolve(e : Expr, stk : Scopes = None):
+  # Resolve references to declared variables. This requires a scope
+  # stack (see Scopes above), which is empty by default.
+  #
+  # Returns the modified (in-place) tree.
+  if stk is None:
+    stk = Scopes()
+  return resolvers[type(e)](e, stk)
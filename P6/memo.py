@@ -0,0 +1,103 @@
+from lang import *
+from edit import operands
+from collections import OrderedDict
+
+# This module implements memoization of calls, which saves the values
+# of calls so that calling the same closure with the same arguments
+# again returns the saved value instead of evaluating its body:
+#
+#   fib(30) ~> fib(29) + fib(28) ~> (fib(28) + fib(27)) + fib(28) ~> ...
+#
+# Here the second call of fib(28) is found in the cache. This turns the
+# exponential number of calls into a linear one.
+#
+# A call can only be memoized if evaluating it again would produce the
+# same value with the same effects. This is checked in two parts:
+#
+#   - Statically, the body of the called abstraction must not allocate
+#     or assign (see memoizable, below). Other abstractions in its body
+#     are not considered, since their bodies are not evaluated here.
+#   - Dynamically, the call must not have changed the heap, and the heap
+#     must not have changed since the saved value was computed. This is
+#     what allows recursive functions, which call themselves through a
+#     reference, to be memoized: the body reads the reference, and calls
+#     whatever it holds, which may not be known until runtime.
+#
+# The heap is tracked by counting its changes (see writes in
+# evaluate.py). A cache holds values computed with one count; when the
+# count changes, the cache is cleared. Calls that fail are not saved.
+#
+# A cache is attached to each call site that should use it (see
+# memoize); call sites without one are evaluated normally, and calls in
+# tail position with one are no longer evaluated in a loop. Closures
+# are compared by identity, as are tuples, records and variants, so the
+# same closure must be called with the same values (not just equal
+# ones) for the call to be found.
+
+class Memo:
+  # A cache of the values of calls. This is bounded to size entries;
+  # when full, the least recently used entry is evicted.
+  def __init__(self, size : int = 1024):
+    self.size = size
+
+    # Maps (closure, args...) to values, least recently used first.
+    self.entries = OrderedDict()
+
+    # The number of changes to the heap when the entries were computed.
+    self.version = 0
+
+    # Statistics.
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+  def lookup(self, key, version):
+    # Returns true and the value saved for key, or false and None if
+    # there is none. version is the current number of changes to the
+    # heap.
+    if version != self.version:
+      if self.entries:
+        self.entries.clear()
+        self.invalidations += 1
+      self.version = version
+    if key in self.entries:
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return True, self.entries[key]
+    self.misses += 1
+    return False, None
+
+  def store(self, key, value):
+    # Save the value of key, evicting the least recently used entry if
+    # the cache is full.
+    if len(self.entries) >= self.size:
+      self.entries.popitem(last=False)
+      self.evictions += 1
+    self.entries[key] = value
+
+  def __str__(self):
+    return (f"hits={self.hits} misses={self.misses} "
+            f"evictions={self.evictions} invalidations={self.invalidations}")
+
+def memoizable(e : Expr):
+  # Returns true if e does not allocate or assign, other than within
+  # nested abstractions.
+  if type(e) in (NewExpr, AssignExpr):
+    return False
+  if type(e) is LambdaExpr:
+    return True
+  return all(memoizable(x) for x in operands(e))
+
+def memoize(e : Expr, m : Memo, sites = None):
+  # Attach the cache m to the call sites within e, and mark the
+  # abstractions whose calls can be memoized. If sites is given, only
+  # the calls for which sites(call) is true use the cache. Setting
+  # the cache of a call to None turns memoization off for that call.
+  if type(e) is LambdaExpr:
+    e.memo = memoizable(e.expr)
+  if type(e) is CallExpr and (sites is None or sites(e)):
+    e.cache = m
+  for x in operands(e):
+    memoize(x, m, sites)
+  return e
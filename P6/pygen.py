@@ -0,0 +1,317 @@
+from lang import *
+from evaluate import Location, Tuple, Record, Variant
+
+import marshal
+
+# This module translates checked expressions into Python source code,
+# which is then compiled (by Python) into a code object. Running the
+# code object evaluates the expression at the speed of ordinary Python
+# code, without interpreting the tree.
+#
+# The translation maps each construct onto Python as follows:
+#
+#   - Booleans and integers are Python bools and ints.
+#   - Lambda abstractions become nested 'def's, so closures are Python
+#     closures.
+#   - The heap is a Python list, H. A location is an index into H.
+#   - Tuples and records are Python lists. The offset of each record
+#     member is computed by check (see check_member).
+#   - Variants are [tag, value] pairs, where the tag is the position of
+#     the label in the variant type. Each case expression becomes a
+#     nested 'def' that tests the tag of its operand.
+#
+# Lists are used rather than Python tuples because every construction
+# must produce a new value: tuples, records, variants and functions are
+# compared by identity (as in evaluate.py), whereas Python shares equal
+# constant tuples. Booleans, integers and locations are compared by
+# value.
+#
+# Translating an expression produces a Program, which holds the source
+# and the compiled code. A program can be run any number of times, and
+# saved to (and loaded from) a file, so that it need not be translated
+# again.
+#
+# The translated code evaluates operands in the same order as
+# evaluate.py. In particular, 'and' and 'or' are not short-circuiting,
+# so they are translated to '&' and '|', which evaluate both operands.
+
+class Gen:
+  # The state of the translation. This accumulates the lines of the
+  # program and maps declarations to the names of Python variables.
+  def __init__(self):
+    self.lines = []
+    self.indent = 1
+    self.count = 0
+    self.names = {}
+
+  def fresh(self, base):
+    # Returns a new, unique name.
+    self.count += 1
+    return f"{base}_{self.count}"
+
+  def name(self, var):
+    # Returns the Python name of a declared variable.
+    if var not in self.names:
+      self.names[var] = self.fresh(var.id)
+    return self.names[var]
+
+  def line(self, s):
+    # Append a line at the current indentation.
+    self.lines += ["  " * self.indent + s]
+
+def gen_value(e, g):
+  return repr(e.value)
+
+def gen_binary(e, g, op):
+  return f"({gen(e.lhs, g)} {op} {gen(e.rhs, g)})"
+
+def gen_and(e, g):
+  return gen_binary(e, g, "&")
+
+def gen_or(e, g):
+  return gen_binary(e, g, "|")
+
+def gen_not(e, g):
+  return f"(not {gen(e.expr, g)})"
+
+def gen_if(e, g):
+  cond = gen(e.cond, g)
+  true = gen(e.true, g)
+  false = gen(e.false, g)
+  return f"({true} if {cond} else {false})"
+
+def gen_add(e, g):
+  return gen_binary(e, g, "+")
+
+def gen_sub(e, g):
+  return gen_binary(e, g, "-")
+
+def gen_mul(e, g):
+  return gen_binary(e, g, "*")
+
+def gen_div(e, g):
+  return gen_binary(e, g, "/")
+
+def gen_rem(e, g):
+  return gen_binary(e, g, "%")
+
+def gen_neg(e, g):
+  return f"(-{gen(e.expr, g)})"
+
+def gen_equality(e, g, op, ident):
+  # Compare by value or by identity, depending on the type of the
+  # operands.
+  if type(e.lhs.type) in (BoolType, IntType, RefType):
+    return gen_binary(e, g, op)
+  return gen_binary(e, g, ident)
+
+def gen_eq(e, g):
+  return gen_equality(e, g, "==", "is")
+
+def gen_ne(e, g):
+  return gen_equality(e, g, "!=", "is not")
+
+def gen_lt(e, g):
+  return gen_binary(e, g, "<")
+
+def gen_gt(e, g):
+  return gen_binary(e, g, ">")
+
+def gen_le(e, g):
+  return gen_binary(e, g, "<=")
+
+def gen_ge(e, g):
+  return gen_binary(e, g, ">=")
+
+def gen_id(e, g):
+  return g.name(e.ref)
+
+def gen_lambda(e, g):
+  # \(x1, ..., xn).e1 becomes:
+  #
+  #   def fn(x1, ..., xn):
+  #     return e1
+  #
+  # Any definitions needed by e1 are nested within fn.
+  fn = g.fresh("fn")
+  parms = ", ".join(g.name(v) for v in e.vars)
+  g.line(f"def {fn}({parms}):")
+  g.indent += 1
+  body = gen(e.expr, g)
+  g.line(f"return {body}")
+  g.indent -= 1
+  return fn
+
+def gen_call(e, g):
+  fn = gen(e.fn, g)
+  args = ", ".join(gen(a, g) for a in e.args)
+  return f"{fn}({args})"
+
+def gen_new(e, g):
+  return f"new({gen(e.expr, g)})"
+
+def gen_deref(e, g):
+  return f"H[{gen(e.expr, g)}]"
+
+def gen_assign(e, g):
+  # The helper takes its operands right to left, so they are evaluated
+  # in that order.
+  return f"assign({gen(e.rhs, g)}, {gen(e.lhs, g)})"
+
+def gen_tuple(e, g):
+  es = [gen(x, g) for x in e.elems]
+  return f"[{', '.join(es)}]"
+
+def gen_proj(e, g):
+  return f"{gen(e.obj, g)}[{e.index}]"
+
+def gen_record(e, g):
+  es = [gen(f.value, g) for f in e.fields]
+  return f"[{', '.join(es)}]"
+
+def gen_member(e, g):
+  return f"{gen(e.obj, g)}[{e.offset}]"
+
+def gen_variant(e, g):
+  return f"[{e.tag}, {gen(e.field.value, g)}]"
+
+def gen_case(e, g):
+  # case e0 of <li=xi> => ei becomes:
+  #
+  #   def case(v):
+  #     if v[0] == n1:
+  #       x1 = v[1]
+  #       return e1
+  #     ...
+  #     raise AssertionError
+  #
+  # which is called with the value of e0, where ni is the tag of li.
+  # A variant with no case fails as in evaluate.py (see select).
+  tags = e.expr.type.tags
+  fn = g.fresh("case")
+  v = g.fresh("v")
+  g.line(f"def {fn}({v}):")
+  g.indent += 1
+  for c in e.cases:
+    g.line(f"if {v}[0] == {tags[c.id]}:")
+    g.indent += 1
+    g.line(f"{g.name(c.var)} = {v}[1]")
+    body = gen(c.expr, g)
+    g.line(f"return {body}")
+    g.indent -= 1
+  g.line("raise AssertionError")
+  g.indent -= 1
+  return f"{fn}({gen(e.expr, g)})"
+
+# Maps each kind of expression to the function that translates it. See
+# the corresponding table in evaluate.py.
+generators = {
+  # Boolean expressions
+  BoolExpr: gen_value,
+  AndExpr: gen_and,
+  OrExpr: gen_or,
+  NotExpr: gen_not,
+  IfExpr: gen_if,
+
+  # Arithmetic expressions
+  IntExpr: gen_value,
+  AddExpr: gen_add,
+  SubExpr: gen_sub,
+  MulExpr: gen_mul,
+  DivExpr: gen_div,
+  RemExpr: gen_rem,
+  NegExpr: gen_neg,
+
+  # Relational expressions
+  EqExpr: gen_eq,
+  NeExpr: gen_ne,
+  LtExpr: gen_lt,
+  GtExpr: gen_gt,
+  LeExpr: gen_le,
+  GeExpr: gen_ge,
+
+  # Functional expressions
+  IdExpr: gen_id,
+  LambdaExpr: gen_lambda,
+  CallExpr: gen_call,
+
+  # Reference expressions
+  NewExpr: gen_new,
+  DerefExpr: gen_deref,
+  AssignExpr: gen_assign,
+
+  # Data expressions
+  TupleExpr: gen_tuple,
+  ProjExpr: gen_proj,
+  RecordExpr: gen_record,
+  MemberExpr: gen_member,
+  VariantExpr: gen_variant,
+  CaseExpr: gen_case,
+}
+
+def gen(e, g):
+  # Translate e, returning a Python expression that computes its
+  # value. Definitions needed by that expression are added to g.
+  return generators[type(e)](e, g)
+
+def emit(e : Expr):
+  # Returns the Python source code for a checked expression. The source
+  # defines a function 'main' that accepts a heap (a list) and returns
+  # the value of the expression.
+  g = Gen()
+  g.line("def new(v):")
+  g.line("  H.append(v)")
+  g.line("  return len(H) - 1")
+  g.line("def assign(v, l):")
+  g.line("  H[l] = v")
+  result = gen(e, g)
+  g.line(f"return {result}")
+  return "\n".join(["def main(H):"] + g.lines) + "\n"
+
+class Program:
+  # A translated expression. This holds the generated source (if
+  # available) and its compiled code.
+  def __init__(self, code, source = None):
+    self.code = code
+    self.source = source
+    self.main = None
+
+  def run(self, heap = None):
+    # Evaluate the program, returning its value. The heap is updated
+    # with any allocations made by the program.
+    if self.main is None:
+      ns = {}
+      exec(self.code, ns)
+      self.main = ns["main"]
+    return self.main(heap if heap is not None else [])
+
+  def save(self, path):
+    # Save the compiled code so that it can be loaded (by the same
+    # version of Python) without translating the expression again.
+    with open(path, "wb") as f:
+      marshal.dump(self.code, f)
+
+def translate(e : Expr):
+  # Translate a checked expression into a program.
+  source = emit(e)
+  code = compile(source, "<topl>", "exec")
+  return Program(code, source)
+
+def load(path):
+  # Load a program saved by Program.save.
+  with open(path, "rb") as f:
+    return Program(marshal.load(f))
+
+def decode(v, t : Type):
+  # Convert a value computed by a translated program into the
+  # corresponding value computed by evaluate. This requires the type
+  # of the value. Functions are returned as Python functions.
+  if type(t) is RefType:
+    return Location(v)
+  if type(t) is TupleType:
+    return Tuple([decode(x, u) for x, u in zip(v, t.elems)])
+  if type(t) is RecordType:
+    return Record(t, tuple(decode(x, f.type) for x, f in zip(v, t.fields)))
+  if type(t) is VariantType:
+    return Variant(t, v[0], decode(v[1], t.fields[v[0]].type))
+  return v
@@ -10,7 +10,7 @@ from lang import *
 
 def is_value(e):
   # Returns true if e denotes a value.
-  return type(e) in (BoolExpr, AbsExpr, LambdaExpr)
+  return type(e) in (BoolExpr, IntExpr, LambdaExpr)
 
 def is_reducible(e):
   # Returns true if e can be reduced.
@@ -35,7 +35,7 @@ def step_and(e):
   if is_reducible(e.rhs):
     return AndExpr(e.lhs, step(e.rhs))
 
-  return BoolExpr(e.lhs.val and e.rhs.val)
+  return BoolExpr(e.lhs.value and e.rhs.value)
 
 def step_or(e):
   # Compute the next step of an or-expression.
@@ -57,7 +57,7 @@ def step_or(e):
   if is_reducible(e.rhs):
     return OrExpr(e.lhs, step(e.rhs))
 
-  return BoolExpr(e.lhs.val or e.rhs.val)
+  return BoolExpr(e.lhs.value or e.rhs.value)
 
 def step_not(e):
   # Compute the next step of a not expression.
@@ -71,7 +71,7 @@ def step_not(e):
   if is_reducible(e.expr):
     return NotExpr(step(e.expr))
 
-  return BoolExpr(not e.expr.val)
+  return BoolExpr(not e.expr.value)
 
 def step_if(e):
   # Compute the next step of a not expression.
@@ -87,43 +87,13 @@ def step_if(e):
   # if false then e2 else e3 ~> e3
 
   if is_reducible(e.cond):
-    return NotExpr(step(e.cond), e.true, e.false)
+    return IfExpr(step(e.cond), e.true, e.false)
 
-  if e.cond.val:
+  if e.cond.value:
     return e.true
   else:
     return e.false
 
-def step_app(e):
-  # Apply an abstraction to an operand.
-  #
-  #     e1 ~> e1'
-  # --------------- App-1
-  # e1 e2 ~> e1' e2
-  #
-  #      e2 ~> e2'
-  # --------------------- App-2
-  # \x.e1 e2 ~> \x.e1 e2'
-  #
-  # ------------------- App-3
-  # \x.e1 v ~> [x->v]e1
-  #
-  # This implements call by value.
-  
-  if is_reducible(e.lhs): # App-1
-    return AppExpr(step(e.lhs), e.rhs)
-
-  if type(e.lhs) is not AbsExpr:
-    raise Exception("application of non-lambda")
-
-  if is_reducible(e.rhs): # App-2
-    return AppExpr(e.lhs, step(e.rhs))
-
-  s = {
-    e.lhs.var: e.rhs
-  }
-  return subst(e.lhs.expr, s);
-
 def step_call(e):
   # Call a lambda function with arguments.
   #
@@ -164,32 +134,157 @@ def step_call(e):
   return subst(e.fn.expr, s);
 
 
+# Maps each kind of reducible expression to the function that computes
+# its next step. See the corresponding table in evaluate.py.
+steppers = {
+  AndExpr: step_and,
+  OrExpr: step_or,
+  NotExpr: step_not,
+  IfExpr: step_if,
+  CallExpr: step_call,
+}
+
 def step(e):
   assert isinstance(e, Expr)
   assert is_reducible(e)
+  return steppers[type(e)](e)
 
-  if type(e) is AndExpr:
-    return step_and(e)
-
-  if type(e) is OrExpr:
-    return step_or(e)
+# Reduction with a focus
+#
+# Stepping from the root finds the next redex by descending from the
+# root, and rebuilds every node on the path to it. To avoid this, reduce
+# keeps a focus on the current redex, along with its evaluation context:
+# the path of (node, index) pairs from the root to the redex, where
+# index identifies the child of node that leads to the redex. After the
+# redex is contracted, the search for the next redex continues from the
+# focus. A node on the path is rebuilt only when its child has been
+# reduced to a value, so the cost of a step is proportional to the
+# distance moved, not the size of the program.
+#
+# The following functions find the child of a reducible expression in
+# which the next step takes place, following the rules above. They
+# return the index of that child and the child itself, or None if the
+# expression is itself the redex.
 
-  if type(e) is NotExpr:
-    return step_not(e)
+def next_binary(e):
+  if is_reducible(e.lhs):
+    return 0, e.lhs
+  if is_reducible(e.rhs):
+    return 1, e.rhs
+  return None
 
-  if type(e) is IfExpr:
-    return step_if(e)
+def next_not(e):
+  if is_reducible(e.expr):
+    return 0, e.expr
+  return None
 
-  if type(e) is AppExpr:
-    return step_app(e)
+def next_if(e):
+  if is_reducible(e.cond):
+    return 0, e.cond
+  return None
 
-  if type(e) is CallExpr:
-    return step_call(e)
+def next_call(e):
+  if is_reducible(e.fn):
+    return 0, e.fn
 
-  assert False
+  if len(e.args) < len(e.fn.vars):
+    raise Exception("too few arguments")
+  if len(e.args) > len(e.fn.vars):
+    raise Exception("too many arguments")
 
-def reduce(e):
-  while not is_value(e):
-    e = step(e)
-    print(e)
-  return e
+  for i in range(len(e.args)):
+    if is_reducible(e.args[i]):
+      return i + 1, e.args[i]
+  return None
+
+nexts = {
+  AndExpr: next_binary,
+  OrExpr: next_binary,
+  NotExpr: next_not,
+  IfExpr: next_if,
+  CallExpr: next_call,
+}
+
+# The following functions rebuild an expression, replacing the child at
+# the given index.
+
+def plug_and(e, i, x):
+  return AndExpr(x, e.rhs) if i == 0 else AndExpr(e.lhs, x)
+
+def plug_or(e, i, x):
+  return OrExpr(x, e.rhs) if i == 0 else OrExpr(e.lhs, x)
+
+def plug_not(e, i, x):
+  return NotExpr(x)
+
+def plug_if(e, i, x):
+  return IfExpr(x, e.true, e.false)
+
+def plug_call(e, i, x):
+  if i == 0:
+    return CallExpr(x, e.args)
+  return CallExpr(e.fn, e.args[:i-1] + [x] + e.args[i:])
+
+plugs = {
+  AndExpr: plug_and,
+  OrExpr: plug_or,
+  NotExpr: plug_not,
+  IfExpr: plug_if,
+  CallExpr: plug_call,
+}
+
+class Focus:
+  # An expression being reduced, focused on its next redex.
+  def __init__(self, e : Expr):
+    # The path from the root to the focus.
+    self.path = []
+
+    # The expression at the focus.
+    self.expr = e
+
+    self.descend()
+
+  def descend(self):
+    # Move the focus down to the next redex.
+    e = self.expr
+    while is_reducible(e):
+      n = nexts[type(e)](e)
+      if n is None:
+        break
+      self.path += [(e, n[0])]
+      e = n[1]
+    self.expr = e
+
+  def done(self):
+    # Returns true if the expression has been reduced to a value.
+    return not self.path and is_value(self.expr)
+
+  def step(self):
+    # Contract the redex at the focus, then move to the next redex.
+    e = steppers[type(self.expr)](self.expr)
+
+    # Values are plugged into their context, until reaching a node
+    # that can still be reduced.
+    while is_value(e) and self.path:
+      p, i = self.path.pop()
+      e = plugs[type(p)](p, i, e)
+    self.expr = e
+    self.descend()
+
+  def term(self):
+    # Returns the whole expression, with the focus plugged into its
+    # context.
+    e = self.expr
+    for p, i in reversed(self.path):
+      e = plugs[type(p)](p, i, e)
+    return e
+
+def reduce(e, trace = True):
+  # Reduce e to a value. If trace is true, print the expression after
+  # each step.
+  f = Focus(e)
+  while not f.done():
+    f.step()
+    if trace:
+      print(f.term())
+  return f.expr
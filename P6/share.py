@@ -0,0 +1,234 @@
+from lang import *
+
+# This module implements hash-consing of expressions. Sharing replaces
+# each closed subexpression (one with no free variables) by a single
+# canonical copy of it, turning the tree into a DAG. This means that the
+# memory used by a program is proportional to the number of distinct
+# closed subterms it contains, and that passes that cache results in
+# the tree (like check) compute them once per distinct subterm.
+#
+# Sharing is opt-in: it runs after resolve, and modifies the tree that
+# it is given. The annotations computed by resolve and check are valid
+# for shared expressions, since they only depend on the declarations
+# within a closed expression.
+#
+# Expressions are compared by giving each distinct expression a value
+# number. The key of an expression consists of its kind, its
+# attributes, and the value numbers of its operands, so keys are small
+# and can be hashed in constant time. Variables are keyed by their de
+# Bruijn index: the number of variables declared between the reference
+# and its declaration. This means that expressions that differ only in
+# the names of their variables (such as copies of each other) have the
+# same number.
+#
+# Allocations (new e1) are never shared, even when closed: each one is
+# a distinct allocation site.
+#
+# An expression is closed if none of its variables are declared outside
+# of it. We track this by the reach of an expression: the number of
+# enclosing declarations that it refers to. Closed expressions have a
+# reach of 0.
+
+# The reach of a variable whose declaration is not in the tree.
+unbound = float("inf")
+
+class Sharing:
+  # A table of shared expressions. The same table can be used to share
+  # expressions across several programs.
+  def __init__(self):
+    # Maps keys to value numbers.
+    self.numbers = {}
+
+    # Maps value numbers to canonical, closed expressions.
+    self.nodes = {}
+
+    # Maps declarations in scope to their level, and the number of
+    # declarations in scope.
+    self.levels = {}
+    self.depth = 0
+
+    # The number of expressions visited, and the number replaced by
+    # a shared copy.
+    self.count = 0
+    self.shared = 0
+
+  def bind(self, vars):
+    # Declare the variables of a lambda abstraction or case.
+    for v in vars:
+      self.levels[v] = self.depth
+      self.depth += 1
+
+  def unbind(self, vars):
+    for v in vars:
+      del self.levels[v]
+      self.depth -= 1
+
+  def make(self, e, key, reach):
+    # Returns the (possibly shared) expression for e along with its
+    # value number and reach.
+    n = self.numbers.get(key)
+    if n is None:
+      n = len(self.numbers)
+      self.numbers[key] = n
+    self.count += 1
+    if reach == 0:
+      c = self.nodes.get(n)
+      if c is None:
+        self.nodes[n] = e
+        e.number = n
+      else:
+        e = c
+        self.shared += 1
+    return e, n, reach
+
+def share_value(e, s):
+  return s.make(e, (type(e), e.value), 0)
+
+def share_unary(e, s):
+  e.expr, n1, r1 = share_expr(e.expr, s)
+  return s.make(e, (type(e), n1), r1)
+
+def share_new(e, s):
+  # Each allocation is a separate site, which later passes annotate
+  # (see escape.py), so it is never shared. It is numbered by its own
+  # identity, so the expressions that contain it are not shared either.
+  e.expr, n1, r1 = share_expr(e.expr, s)
+  n = len(s.numbers)
+  s.numbers[(NewExpr, e)] = n
+  s.count += 1
+  return e, n, r1
+
+def share_binary(e, s):
+  e.lhs, n1, r1 = share_expr(e.lhs, s)
+  e.rhs, n2, r2 = share_expr(e.rhs, s)
+  return s.make(e, (type(e), n1, n2), max(r1, r2))
+
+def share_if(e, s):
+  e.cond, n1, r1 = share_expr(e.cond, s)
+  e.true, n2, r2 = share_expr(e.true, s)
+  e.false, n3, r3 = share_expr(e.false, s)
+  return s.make(e, (IfExpr, n1, n2, n3), max(r1, r2, r3))
+
+def share_id(e, s):
+  if e.ref not in s.levels:
+    return s.make(e, (IdExpr, e.ref), unbound)
+  i = s.depth - 1 - s.levels[e.ref]
+  return s.make(e, (IdExpr, i), i + 1)
+
+def share_lambda(e, s):
+  # Parameters are keyed by their types, not their names.
+  s.bind(e.vars)
+  e.expr, n1, r1 = share_expr(e.expr, s)
+  s.unbind(e.vars)
+  ts = tuple(v.type for v in e.vars)
+  return s.make(e, (LambdaExpr, ts, n1), max(r1 - len(e.vars), 0))
+
+def share_call(e, s):
+  e.fn, n0, r = share_expr(e.fn, s)
+  ns = [n0]
+  for i in range(len(e.args)):
+    e.args[i], n1, r1 = share_expr(e.args[i], s)
+    ns += [n1]
+    r = max(r, r1)
+  return s.make(e, (CallExpr, tuple(ns)), r)
+
+def share_tuple(e, s):
+  ns = []
+  r = 0
+  for i in range(len(e.elems)):
+    e.elems[i], n1, r1 = share_expr(e.elems[i], s)
+    ns += [n1]
+    r = max(r, r1)
+  return s.make(e, (TupleExpr, tuple(ns)), r)
+
+def share_proj(e, s):
+  e.obj, n1, r1 = share_expr(e.obj, s)
+  return s.make(e, (ProjExpr, n1, e.index), r1)
+
+def share_record(e, s):
+  ns = []
+  r = 0
+  for f in e.fields:
+    f.value, n1, r1 = share_expr(f.value, s)
+    ns += [(f.id, n1)]
+    r = max(r, r1)
+  return s.make(e, (RecordExpr, tuple(ns)), r)
+
+def share_member(e, s):
+  e.obj, n1, r1 = share_expr(e.obj, s)
+  return s.make(e, (MemberExpr, n1, e.id), r1)
+
+def share_variant(e, s):
+  f = e.field
+  f.value, n1, r1 = share_expr(f.value, s)
+  return s.make(e, (VariantExpr, f.id, e.variant, n1), r1)
+
+def share_case(e, s):
+  e.expr, n0, r = share_expr(e.expr, s)
+  ns = []
+  for c in e.cases:
+    s.bind([c.var])
+    c.expr, n1, r1 = share_expr(c.expr, s)
+    s.unbind([c.var])
+    ns += [(c.id, n1)]
+    r = max(r, r1 - 1)
+  return s.make(e, (CaseExpr, n0, tuple(ns)), r)
+
+# Maps each kind of expression to the function that shares it. See the
+# corresponding table in evaluate.py.
+sharers = {
+  # Boolean expressions
+  BoolExpr: share_value,
+  AndExpr: share_binary,
+  OrExpr: share_binary,
+  NotExpr: share_unary,
+  IfExpr: share_if,
+
+  # Arithmetic expressions
+  IntExpr: share_value,
+  AddExpr: share_binary,
+  SubExpr: share_binary,
+  MulExpr: share_binary,
+  DivExpr: share_binary,
+  RemExpr: share_binary,
+  NegExpr: share_unary,
+
+  # Relational expressions
+  EqExpr: share_binary,
+  NeExpr: share_binary,
+  LtExpr: share_binary,
+  GtExpr: share_binary,
+  LeExpr: share_binary,
+  GeExpr: share_binary,
+
+  # Functional expressions
+  IdExpr: share_id,
+  LambdaExpr: share_lambda,
+  CallExpr: share_call,
+
+  # Reference expressions
+  NewExpr: share_new,
+  DerefExpr: share_unary,
+  AssignExpr: share_binary,
+
+  # Data expressions
+  TupleExpr: share_tuple,
+  ProjExpr: share_proj,
+  RecordExpr: share_record,
+  MemberExpr: share_member,
+  VariantExpr: share_variant,
+  CaseExpr: share_case,
+}
+
+def share_expr(e, s):
+  # Share e, returning the shared expression, its value number and its
+  # reach.
+  return sharers[type(e)](e, s)
+
+def share(e : Expr, s : Sharing = None):
+  # Share the closed subexpressions of a resolved expression. Returns
+  # the shared expression, which is e unless e is itself closed and
+  # has already been seen by s.
+  if s is None:
+    s = Sharing()
+  return share_expr(e, s)[0]
@@ -0,0 +1,111 @@
+from lang import *
+from edit import places, get, put, clear
+from effects import pure
+from subst import subst
+
+# This module implements known-constructor elimination. When a tuple,
+# record or variant is taken apart as soon as it is constructed, the
+# construction can be skipped:
+#
+#   {e1, ..., en}.i                       ~> ei
+#   {x1=e1, ..., xn=en}.xi                ~> ei
+#   case <li=e0> as T of ... <li=xi> => ei ~> (\(xi).ei)(e0)
+#
+# Evaluating the original expression evaluates every component, in
+# order. Removing the others is only correct if they are pure (see
+# effects.py), so the first two rewrites apply only when they are;
+# otherwise the expression is left alone. The component that is kept is
+# evaluated exactly as before, since the others have no effects.
+#
+# In a case, the selected body is evaluated with its variable bound to
+# the value of e0, which is what the call does. No variant is built. The
+# call is avoided when the binding is trivial:
+#
+#   - If e0 is a literal, it is substituted for xi in ei.
+#   - If xi is unused and e0 is pure, the result is ei.
+#
+# Rewriting moves expressions into different scopes and creates new
+# expressions, so the tree is resolved and checked again afterwards.
+# Like resolve, this must be applied to a whole program.
+
+class Simplifying:
+  # The state of the pass. This counts the constructors eliminated.
+  def __init__(self):
+    self.eliminated = 0
+
+def simplify_operands(e, s):
+  # Simplify the operands of e.
+  for p in places[type(e)](e):
+    put(p, simplify_expr(get(p), s))
+  return e
+
+def simplify_proj(e, s):
+  simplify_operands(e, s)
+  if type(e.obj) is not TupleExpr:
+    return e
+  es = e.obj.elems
+  if not all(pure(x) for i, x in enumerate(es) if i != e.index):
+    return e
+  s.eliminated += 1
+  return es[e.index]
+
+def simplify_member(e, s):
+  simplify_operands(e, s)
+  if type(e.obj) is not RecordExpr:
+    return e
+  fs = e.obj.fields
+  f = fs[e.offset]
+  if not all(pure(g.value) for g in fs if g is not f):
+    return e
+  s.eliminated += 1
+  return f.value
+
+def simplify_case(e, s):
+  simplify_operands(e, s)
+  if type(e.expr) is not VariantExpr:
+    return e
+  f = e.expr.field
+  cs = [c for c in e.cases if c.id == f.id]
+  if not cs:
+    # No case matches, which fails at runtime.
+    return e
+  c = cs[0]
+  s.eliminated += 1
+  if type(f.value) in (BoolExpr, IntExpr):
+    return subst(c.expr, {c.var: f.value})
+  if not uses(c.expr, c.var) and pure(f.value):
+    return c.expr
+  return CallExpr(LambdaExpr([c.var], c.expr), [f.value])
+
+def uses(e, v):
+  # Returns true if e refers to the variable v.
+  if type(e) is IdExpr:
+    return e.ref is v
+  return any(uses(get(p), v) for p in places[type(e)](e))
+
+# Maps the kinds of expression that can be simplified to the functions
+# that simplify them. Other expressions only have their operands
+# simplified.
+simplifiers = {
+  # Data expressions
+  ProjExpr: simplify_proj,
+  MemberExpr: simplify_member,
+  CaseExpr: simplify_case,
+}
+
+def simplify_expr(e, s):
+  return simplifiers.get(type(e), simplify_operands)(e, s)
+
+def simplify(e : Expr, s : Simplifying = None):
+  # Eliminate known constructors in a checked program. Returns the
+  # simplified program, which is resolved and checked. The number of
+  # constructors eliminated is counted in s.
+  if s is None:
+    s = Simplifying()
+  n = s.eliminated
+  e = simplify_expr(e, s)
+  if s.eliminated != n:
+    clear(e)
+    resolve(e)
+    check(e)
+  return e
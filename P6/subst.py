@@ -1,71 +1,136 @@
 from lang import *
 
+# This module implements substitution, written [x->s]e, which rewrites
+# the expression e by replacing references to the variables in the
+# mapping s with their corresponding expressions.
+#
+# Substitution builds a new tree; the original expression is not
+# modified. Declarations (in lambdas and cases) are shared between
+# the old and new trees, so resolved references remain valid.
+
+def subst_leaf(e, s):
+  # [x->s]b = b
+  # [x->s]n = n
+  return e
+
+def subst_unary(e, s):
+  # [x->s](@e1) = @[x->s]e1
+  e1 = subst(e.expr, s)
+  return type(e)(e1)
+
+def subst_binary(e, s):
+  # [x->s](e1 @ e2) = [x->s]e1 @ [x->s]e2
+  e1 = subst(e.lhs, s)
+  e2 = subst(e.rhs, s)
+  return type(e)(e1, e2)
+
+def subst_if(e, s):
+  # [x->s](if e1 then e2 else e3) = if [x->s]e1 then [x->s]e2 else [x->s]e3
+  e1 = subst(e.cond, s)
+  e2 = subst(e.true, s)
+  e3 = subst(e.false, s)
+  return IfExpr(e1, e2, e3)
+
+def subst_id(e, s):
+  # [x->s]x = v
+  # [x->s]y = y (y != x)
+  if e.ref in s:
+    return s[e.ref]
+  else:
+    return e
+
+def subst_lambda(e, s):
+  # [x->s]\(x1, x2, ...).e1 = \(x1, x2, ...).[x->s]e1
+  #
+  # Note that references to var  will never be replaced, so the
+  # binding will be preserved when we create the expression.
+  #
+  # Alternatively, we could create a new variable and redo
+  # resolution on the resulting expression.
+  e1 = subst(e.expr, s)
+  return LambdaExpr(e.vars, e1)
+
+def subst_call(e, s):
+  # [x->s]e0(e1, e2, ...) = [x->s]e0([x->s]e1, [x->s]e2, ...)
+  e0 = subst(e.fn, s)
+  args = list(map(lambda x: subst(x, s), e.args))
+  return CallExpr(e0, args)
+
+def subst_tuple(e, s):
+  # [x->s]{e1, ..., en} = {[x->s]e1, ..., [x->s]en}
+  return TupleExpr([subst(x, s) for x in e.elems])
+
+def subst_proj(e, s):
+  # [x->s]e1.n = ([x->s]e1).n
+  return ProjExpr(subst(e.obj, s), e.index)
+
+def subst_record(e, s):
+  # [x->s]{x1=e1, ..., xn=en} = {x1=[x->s]e1, ..., xn=[x->s]en}
+  return RecordExpr([(f.id, subst(f.value, s)) for f in e.fields])
+
+def subst_member(e, s):
+  # [x->s]e1.x = ([x->s]e1).x
+  return MemberExpr(subst(e.obj, s), e.id)
+
+def subst_variant(e, s):
+  # [x->s](<l=e1> as T) = <l=[x->s]e1> as T
+  return VariantExpr((e.field.id, subst(e.field.value, s)), e.variant)
+
+def subst_case(e, s):
+  # [x->s](case e0 of <li=xi> => ei) = case [x->s]e0 of <li=xi> => [x->s]ei
+  #
+  # As with lambdas, the case variables are shared with the original.
+  e0 = subst(e.expr, s)
+  cs = [Case(c.id, c.var, subst(c.expr, s)) for c in e.cases]
+  return CaseExpr(e0, cs)
+
+# Maps each kind of expression to the function that performs
+# substitution through it. See the corresponding table in evaluate.py.
+substituters = {
+  # Boolean expressions
+  BoolExpr: subst_leaf,
+  AndExpr: subst_binary,
+  OrExpr: subst_binary,
+  NotExpr: subst_unary,
+  IfExpr: subst_if,
+
+  # Arithmetic expressions
+  IntExpr: subst_leaf,
+  AddExpr: subst_binary,
+  SubExpr: subst_binary,
+  MulExpr: subst_binary,
+  DivExpr: subst_binary,
+  RemExpr: subst_binary,
+  NegExpr: subst_unary,
+
+  # Relational expressions
+  EqExpr: subst_binary,
+  NeExpr: subst_binary,
+  LtExpr: subst_binary,
+  GtExpr: subst_binary,
+  LeExpr: subst_binary,
+  GeExpr: subst_binary,
+
+  # Lambda expressions
+  IdExpr: subst_id,
+  LambdaExpr: subst_lambda,
+  CallExpr: subst_call,
+
+  # Reference expressions
+  NewExpr: subst_unary,
+  DerefExpr: subst_unary,
+  AssignExpr: subst_binary,
+
+  # Data expressions
+  TupleExpr: subst_tuple,
+  ProjExpr: subst_proj,
+  RecordExpr: subst_record,
+  MemberExpr: subst_member,
+  VariantExpr: subst_variant,
+  CaseExpr: subst_case,
+}
+
 def subst(e, s):
   # Rewrite the expression 'e' by substituting references to variables
   # in 's' with their corresponding value.
-  
-  if type(e) is BoolExpr:
-    # [x->s]b = b
-    return e
-
-  if type(e) is AndExpr:
-    # [x->s](e1 and e2) = [x->s]e1 and [x->s]e2
-    e1 = subst(e.lhs, s)
-    e2 = subst(e.rhs, s)
-    return AndExpr(e1, e2)
-
-  if type(e) is OrExpr:
-    # [x->s](e1 or e2) = [x->s]e1 or [x->s]e2
-    e1 = subst(e.lhs, s)
-    e2 = subst(e.rhs, s)
-    return OrExpr(e1, e2)
-
-  if type(e) is NotExpr:
-    # [x->s](not e1) = not [x->s]e1
-    e1 = subst(e.expr, s)
-    return NotExpr(e1)
-
-  if type(e) is IfExpr:
-    # [x->s](if e1 then e2 else e3) = if [x->s]e1 then [x->s]e2 else [x->s]e3
-    e1 = subst(e.cond, s)
-    e2 = subst(e.true, s)
-    e3 = subst(e.false, s)
-    return IfExpr(e1, e2, e3)
-
-  if type(e) is IdExpr:
-    # [x->s]x = v
-    # [x->s]y = y (y != x)
-    if e.ref in s:
-      return s[e.ref]
-    else:
-      return e
-
-  if type(e) is AbsExpr:
-    # [x->s] \x.e1 = \x.[x->s]e1
-    #
-    # Note that references to var  will never be replaced, so the
-    # binding will be preserved when we create the expression.
-    #
-    # Alternatively, we could create a new variable and redo 
-    # resolution on the resulting expression.
-    e1 = subst(e.expr, s)
-    return AbsExpr(e.var, e1)
-
-  if type(e) is AppExpr:
-    # [x->s](e1 e2) = [x->s]e1 [x->s]e2
-    e1 = subst(e.lhs, s)
-    e2 = subst(e.rhs, s)
-    return AppExpr(e1, e2)
-
-  if type(e) is LambdaExpr:
-    # [x->s]\(x1, x2, ...).e1 = \(x1, x2, ...).[x->s]e1
-    e1 = subst(e.expr, s)
-    return LambdaExpr(e.vars, e1)
-
-  if type(e) is CallExpr:
-    # [x->s]e0(e1, e2, ...)
-    e0 = subst(e.fn, s)
-    args = list(map(lambda x: subst(x, s), e.args))
-    return CallExpr(e0, args)
-
-  assert False
+  return substituters[type(e)](e, s)
@@ -1,5 +1,6 @@
 
 from lang import *
+from env import Env
 import copy
 
 clone = copy.deepcopy
@@ -16,6 +17,13 @@ print(t2)
 t3 = VariantType([("x", int), ("y", int), ("z", bool)])
 print(t3)
 
+# Types are interned, so equal types are the same object.
+assert FnType([int, int], bool) is f1
+assert RecordType([("x", int), ("y", int), ("z", bool)]) is t2
+assert RecordType([("y", int), ("x", int), ("z", bool)]) is not t2
+assert TupleType([int, bool, int, f1]) is t1
+assert clone(t3) is t3
+
 print("---- exprs ----")
 e1 = resolve(TupleExpr([0, 1, True]))
 check(e1)
@@ -72,3 +80,489 @@ check(e10)
 print(f"* expr:  {e10}")
 print(f"* value: {evaluate(e10)}")
 
+
+print("---- closures ----")
+# (\x.\y.x + y)(1)(2)
+e11 = resolve(CallExpr(CallExpr(
+  LambdaExpr([("x", int)], LambdaExpr([("y", int)], AddExpr("x", "y"))), [1]), [2]))
+check(e11)
+print(f"* expr:  {e11}")
+print(f"* value: {evaluate(e11)}")
+
+print("---- compile ----")
+# Compiled expressions must produce the same values as evaluate.
+for e in [e1, e2, e3, e4, e6, e7, e8, e10, e11]:
+  v1 = evaluate(e)
+  v2 = compile_expr(e)(Env(), [])
+  assert str(v1) == str(v2)
+  print(f"* value: {v2}")
+
+print("---- pygen ----")
+# Translated programs must produce the same values as evaluate.
+import pygen
+for e in [e1, e2, e3, e4, e6, e7, e8, e10, e11]:
+  p = pygen.translate(e)
+  v = pygen.decode(p.run(), e.type)
+  assert str(v) == str(evaluate(e))
+  print(f"* value: {v}")
+
+# Tuples, records, variants and functions are compared by identity,
+# booleans, integers and locations by value.
+def same(t, x):
+  v = VarDecl("v", t)
+  return CallExpr(LambdaExpr([v], EqExpr(IdExpr(v), IdExpr(v))), [x])
+es = [
+  EqExpr(TupleExpr([1, 2]), TupleExpr([1, 2])),
+  NeExpr(TupleExpr([1, 2]), TupleExpr([1, 2])),
+  same(TupleType([int, int]), TupleExpr([1, 2])),
+  EqExpr(RecordExpr([("x", 1)]), RecordExpr([("x", 1)])),
+  EqExpr(VariantExpr(("x", 3), t3), VariantExpr(("x", 3), t3)),
+  same(t3, VariantExpr(("x", 3), t3)),
+  same(RefType(int), NewExpr(0)),
+  EqExpr(NewExpr(0), NewExpr(0)),
+  EqExpr(AddExpr(1, 2), 3),
+]
+for e in es:
+  e = resolve(e)
+  check(e)
+  v = pygen.decode(pygen.translate(e).run(), e.type)
+  assert v == evaluate(e)
+print(f"* equality: {[evaluate(resolve(e)) for e in es]}")
+
+# A variant with no case fails as it does in evaluate.
+e = resolve(CaseExpr(VariantExpr(("y", 3), t3), [("x", "a", 1)]))
+check(e)
+for run in (lambda: evaluate(e), lambda: pygen.translate(e).run(),
+            lambda: compile_expr(e)(Env(), [])):
+  try:
+    run()
+    assert False, "no case matches"
+  except AssertionError as x:
+    assert str(x) == ""
+
+print("---- vm ----")
+# The machine must produce the same values as evaluate.
+import vm
+for e in [e1, e2, e3, e4, e6, e7, e8, e10, e11]:
+  v = vm.Machine().run(vm.assemble(e))
+  assert str(v) == str(evaluate(e))
+  print(f"* value: {v}")
+
+print("---- tail calls ----")
+# A loop written as a tail-recursive function. The function calls
+# itself through a reference, since there are no recursive bindings:
+#
+#   (\(r). {r = \(n, acc). if n == 0 then acc else (*r)(n - 1, acc + n),
+#           (*r)(10000, 0)}.1)(new \(n, acc).acc)
+r = VarDecl("r", RefType(FnType([int, int], int)))
+loop = LambdaExpr([("n", int), ("acc", int)],
+  IfExpr(EqExpr("n", 0), "acc",
+    CallExpr(DerefExpr(IdExpr(r)), [SubExpr("n", 1), AddExpr("acc", "n")])))
+e12 = resolve(CallExpr(
+  LambdaExpr([r], ProjExpr(TupleExpr([
+    AssignExpr(IdExpr(r), loop),
+    CallExpr(DerefExpr(IdExpr(r)), [10000, 0])
+  ]), 1)),
+  [NewExpr(LambdaExpr([("n", int), ("acc", int)], "acc"))]))
+check(e12)
+print(f"* value: {evaluate(e12)}")
+
+# Resolving again after a rewrite clears the mark of a call that is no
+# longer in tail position.
+call = CallExpr(LambdaExpr([("y", int)], "y"), [1])
+outer = resolve(LambdaExpr([("x", int)], call))
+assert call.tail
+outer.expr = AddExpr(call, 1)
+resolve(outer)
+assert not call.tail
+
+print("---- cek ----")
+# The machine must produce the same values as evaluate, without using
+# Python's stack.
+import cek
+for e in [e1, e2, e3, e4, e6, e7, e8, e10, e11, e12]:
+  v = cek.execute(e)
+  assert str(v) == str(evaluate(e))
+  print(f"* value: {v}")
+
+# Chains nested far deeper than Python's recursion limit:
+#
+#   1 + (1 + (1 + ... + 0))
+#   true and (true and ... and true)
+n = 100000
+e13 = IntExpr(0)
+e14 = BoolExpr(True)
+for i in range(n):
+  e13 = AddExpr(IntExpr(1), e13)
+  e14 = AndExpr(BoolExpr(True), e14)
+assert cek.execute(e13) == n
+assert cek.execute(e14) == True
+print(f"* value: {cek.execute(e13)}")
+
+# resolve is recursive, so a chain with names that deep cannot be
+# resolved. The machine rejects it, rather than failing on the missing
+# addresses:
+#
+#   \(x).(x + (x + ... + x))
+x = VarDecl("x", int)
+e = IdExpr(x)
+for i in range(n):
+  e = AddExpr(IdExpr(x), e)
+e = CallExpr(LambdaExpr([x], e), [1])
+try:
+  resolve(e)
+  assert False, "resolved"
+except RecursionError:
+  pass
+try:
+  cek.execute(e)
+  assert False, "executed"
+except Exception as x:
+  assert str(x) == "unresolved name 'x'"
+
+print("---- reduce ----")
+# Reducing with a focus must take the same steps as stepping from the
+# root.
+import reduce as small
+def steps(e):
+  # Returns the sequence of steps taken from the root.
+  ss = []
+  while small.is_reducible(e):
+    e = small.step(e)
+    ss += [str(e)]
+  return ss
+
+e15 = AndExpr(NotExpr(OrExpr(False, NotExpr(True))),
+  IfExpr(NotExpr(False), AndExpr(True, NotExpr(False)), False))
+e16 = resolve(CallExpr(
+  LambdaExpr([("x", bool), ("y", bool)], AndExpr(NotExpr("x"), "y")),
+  [NotExpr(True), OrExpr(False, True)]))
+for e in [e15, e16]:
+  f = small.Focus(e)
+  ss = []
+  while not f.done():
+    f.step()
+    ss += [str(f.term())]
+  assert ss == steps(e)
+  print(f"* value: {small.reduce(e, False)}")
+
+print("---- share ----")
+# Copies of a closed expression are shared, even if their variables
+# have different names.
+import share
+double = LambdaExpr([("x", int)], AddExpr("x", "x"))
+e17 = resolve(CallExpr(
+  LambdaExpr([("f", FnType([int], int)), ("g", FnType([int], int))],
+    AddExpr(CallExpr("f", [1]), CallExpr("g", [2]))),
+  [double, LambdaExpr([("y", int)], AddExpr("y", "y"))]))
+s = share.Sharing()
+v = evaluate(e17)
+e17 = share.share(e17, s)
+assert e17.args[0] is e17.args[1]
+assert e17.fn.expr.lhs is not e17.fn.expr.rhs
+check(e17)
+assert evaluate(e17) == v
+print(f"* shared: {s.shared} of {s.count}")
+print(f"* value: {v}")
+
+# Allocations are separate sites, so they are never shared, nor are the
+# expressions that contain them.
+e17 = resolve(TupleExpr([NewExpr(0), NewExpr(0),
+  CallExpr(LambdaExpr([("c", RefType(int))], DerefExpr("c")), [NewExpr(0)]),
+  CallExpr(LambdaExpr([("c", RefType(int))], DerefExpr("c")), [NewExpr(0)])]))
+e17 = share.share(e17, share.Sharing())
+assert e17.elems[0] is not e17.elems[1]
+assert e17.elems[2] is not e17.elems[3]
+
+print("---- edit ----")
+# After an edit, only the edited expression's ancestors and the uses of
+# retyped variables are checked again.
+import edit
+x = VarDecl("x", int)
+sum = AddExpr(IdExpr(x), 1)
+neg = NotExpr(True)
+arg = IntExpr(2)
+e18 = resolve(CallExpr(LambdaExpr([x], TupleExpr([sum, neg])), [arg]))
+edit.link(e18)
+print(f"* type: {check(e18)}")
+
+edit.replace(sum.rhs, MulExpr(IdExpr(x), 3))
+assert sum.type is None and e18.type is None and neg.type is not None
+print(f"* type: {check(e18)}")
+print(f"* value: {evaluate(resolve(e18))}")
+
+edit.retype(x, bool)
+edit.replace(sum, OrExpr(IdExpr(x), False))
+edit.replace(arg, BoolExpr(True))
+assert neg.type is not None
+print(f"* type: {check(e18)}")
+print(f"* value: {evaluate(resolve(e18))}")
+
+print("---- fold ----")
+# Folding must not change the value of an expression.
+import fold
+x = VarDecl("x", int)
+e19 = resolve(CallExpr(LambdaExpr([x], TupleExpr([
+  AddExpr(MulExpr(IdExpr(x), 1), AddExpr(3, 5)),
+  IfExpr(NotExpr(True), DivExpr(IdExpr(x), 0), NegExpr(NegExpr(IdExpr(x)))),
+  AndExpr(True, LtExpr(IdExpr(x), 10)),
+])), [4]))
+check(e19)
+v = evaluate(e19)
+f = fold.Folding()
+e19 = fold.fold(e19, f)
+assert str(evaluate(e19)) == str(v)
+print(f"* folded: {e19}")
+print(f"* eliminated: {f.eliminated}")
+print(f"* value: {v}")
+
+print("---- simplify ----")
+# Eliminating known constructors must not change the value of an
+# expression, or the order of its effects.
+import simplify
+r = VarDecl("r", RefType(int))
+t4 = VariantType([("a", int), ("b", bool)])
+y = VarDecl("y", None)
+e20 = resolve(CallExpr(LambdaExpr([r], TupleExpr([
+  ProjExpr(TupleExpr([1, AssignExpr(IdExpr(r), 5), DerefExpr(IdExpr(r))]), 2),
+  MemberExpr(RecordExpr([("x", AddExpr(DerefExpr(IdExpr(r)), 1)), ("y", True)]), "x"),
+  CaseExpr(VariantExpr(("a", DerefExpr(IdExpr(r))), t4), [
+    ("a", y, AddExpr(IdExpr(y), IdExpr(y))),
+    ("b", "z", 0),
+  ]),
+])), [NewExpr(0)]))
+check(e20)
+v = evaluate(e20)
+s = simplify.Simplifying()
+e20 = simplify.simplify(e20, s)
+assert str(evaluate(e20)) == str(v)
+print(f"* simplified: {e20}")
+print(f"* eliminated: {s.eliminated}")
+print(f"* value: {v}")
+
+print("---- inline ----")
+# Inlining must not change the value of an expression, or the order of
+# its effects.
+import inline
+r = VarDecl("r", RefType(int))
+f = VarDecl("f", FnType([int], int))
+e21 = resolve(CallExpr(LambdaExpr([r], CallExpr(
+  LambdaExpr([f, ("a", int), ("b", int)],
+    AddExpr(CallExpr(IdExpr(f), ["a"]), CallExpr(IdExpr(f), ["b"]))),
+  [LambdaExpr([("x", int)], AddExpr("x", 1)),
+   ProjExpr(TupleExpr([AssignExpr(IdExpr(r), 2), DerefExpr(IdExpr(r))]), 1),
+   3])), [NewExpr(0)]))
+check(e21)
+v = evaluate(e21)
+s = inline.Inlining()
+e21 = inline.inline(e21, s)
+assert str(evaluate(e21)) == str(v)
+print(f"* inlined: {e21}")
+print(f"* calls: {s.inlined}")
+print(f"* value: {v}")
+
+# Partial inlining keeps the arguments that cannot be substituted bound
+# by a new abstraction, which must be resolved and checked:
+#
+#   (\(a, r). *r + a)(1, new 5) ~> (\(r). *r + 1)(new 5)
+a = VarDecl("a", int)
+r = VarDecl("r", RefType(int))
+e21 = resolve(TupleExpr([
+  CallExpr(LambdaExpr([a, r], AddExpr(DerefExpr(IdExpr(r)), IdExpr(a))), [1, NewExpr(5)]),
+  RecordExpr([("x", 1)]),
+]))
+check(e21)
+v = evaluate(e21, Env(), [])
+s = inline.Inlining()
+e21 = inline.inline(e21, s)
+assert s.changed and (s.inlined, s.partial) == (0, 1)
+assert str(evaluate(e21, Env(), [])) == str(v)
+print(f"* inlined: {e21}")
+print(f"* partial: {s.partial}")
+
+print("---- cse ----")
+# Eliminating common subexpressions must not change the value of an
+# expression. Reads of the heap are not eliminated.
+import cse
+a = VarDecl("a", int)
+b = VarDecl("b", int)
+r = VarDecl("r", RefType(int))
+def ab():
+  return AddExpr(MulExpr(IdExpr(a), IdExpr(b)), 1)
+e22 = resolve(CallExpr(LambdaExpr([a, b, r], TupleExpr([
+  MulExpr(ab(), ab()),
+  IfExpr(LtExpr(IdExpr(a), IdExpr(b)), ab(), 0),
+  AddExpr(DerefExpr(IdExpr(r)), 1),
+  AssignExpr(IdExpr(r), 2),
+  AddExpr(DerefExpr(IdExpr(r)), 1),
+])), [3, 4, NewExpr(0)]))
+check(e22)
+v = evaluate(e22)
+s = cse.Eliminating()
+e22 = cse.cse(e22, s)
+assert str(evaluate(e22)) == str(v)
+print(f"* eliminated: {e22}")
+print(f"* bindings: {s.bindings}, occurrences: {s.eliminated}")
+print(f"* value: {v}")
+
+# The bodies of curried abstractions are scopes too, whether they are
+# the program or within it.
+def curried():
+  return LambdaExpr([a], LambdaExpr([b], MulExpr(ab(), ab())))
+for e in [curried(), TupleExpr([curried(), 1]),
+          CallExpr(CallExpr(curried(), [3]), [4])]:
+  e = resolve(e)
+  check(e)
+  v = evaluate(e)
+  s = cse.Eliminating()
+  e = cse.cse(e, s)
+  assert (s.bindings, s.eliminated) == (1, 2)
+  if type(e) is CallExpr:
+    assert evaluate(e) == v == 169
+
+print("---- memo ----")
+# Memoizing calls must not change the value of an expression. The
+# recursive calls of fib are found in the cache, as long as the heap
+# does not change; a call that assigns is never saved.
+import memo
+r = VarDecl("r", RefType(FnType([int], int)))
+n = VarDecl("n", int)
+fib = LambdaExpr([n], IfExpr(LtExpr(IdExpr(n), 2), IdExpr(n),
+  AddExpr(CallExpr(DerefExpr(IdExpr(r)), [SubExpr(IdExpr(n), 1)]),
+          CallExpr(DerefExpr(IdExpr(r)), [SubExpr(IdExpr(n), 2)]))))
+count = VarDecl("c", RefType(int))
+tick = LambdaExpr([("x", int)], AssignExpr(IdExpr(count), AddExpr(DerefExpr(IdExpr(count)), 1)))
+e23 = resolve(CallExpr(LambdaExpr([r, count], TupleExpr([
+  AssignExpr(IdExpr(r), fib),
+  CallExpr(DerefExpr(IdExpr(r)), [20]),
+  CallExpr(tick, [1]),
+  CallExpr(tick, [1]),
+  DerefExpr(IdExpr(count)),
+  CallExpr(DerefExpr(IdExpr(r)), [20]),
+])), [NewExpr(LambdaExpr([("k", int)], 0)), NewExpr(0)]))
+check(e23)
+v = evaluate(e23, Env(), [])
+m = memo.Memo(8)
+memo.memoize(e23, m)
+assert str(evaluate(e23, Env(), [])) == str(v)
+assert not tick.memo and fib.memo
+assert m.hits > 0 and m.evictions > 0
+print(f"* value: {v}")
+print(f"* cache: {m}")
+
+# Every evaluator counts the changes it makes to the heap, so caches
+# are cleared whichever one changed it.
+import evaluate as evaluation
+counts = []
+for run in (lambda: evaluate(e23, Env(), []),
+            lambda: compile_expr(e23)(Env(), []),
+            lambda: cek.execute(e23),
+            lambda: vm.Machine().run(vm.assemble(e23))):
+  n = evaluation.writes
+  run()
+  counts.append(evaluation.writes - n)
+assert counts[0] > 0 and counts == [counts[0]] * 4
+print(f"* writes: {counts[0]}")
+
+print("---- checked ----")
+# The setting is read when a function is decorated. Sampling checks
+# only every Nth call.
+import decorate
+saved = decorate.checking
+def ident(x : int):
+  return x
+decorate.checking = 0
+assert decorate.checked(ident) is ident
+decorate.checking = 3
+sampled = decorate.checked(ident)
+decorate.checking = saved
+failed = 0
+for i in range(6):
+  try:
+    sampled("x")
+  except Exception:
+    failed += 1
+assert failed == 2
+print(f"* sampled: {failed} of 6 calls checked")
+
+print("---- collect ----")
+# A loop that allocates a cell on each iteration keeps only the cells
+# that are reachable, and reuses the rest. Collection must not change
+# the value computed:
+#
+#   (\(r, keep). {r = \(n). if n == 0 then *keep else (\(c).(*r)(n - 1))(new n),
+#                 (*r)(N)}.1)(new \(n).0, new 42)
+import collect
+r = VarDecl("r", RefType(FnType([int], int)))
+keep = VarDecl("keep", RefType(int))
+n = VarDecl("n", int)
+c = VarDecl("c", RefType(int))
+loop = LambdaExpr([n], IfExpr(EqExpr(IdExpr(n), 0), DerefExpr(IdExpr(keep)),
+  CallExpr(LambdaExpr([c], CallExpr(DerefExpr(IdExpr(r)), [SubExpr(IdExpr(n), 1)])),
+    [NewExpr(IdExpr(n))])))
+e24 = resolve(CallExpr(LambdaExpr([r, keep], ProjExpr(TupleExpr([
+  AssignExpr(IdExpr(r), loop),
+  CallExpr(DerefExpr(IdExpr(r)), [1000]),
+]), 1)), [NewExpr(LambdaExpr([("k", int)], 0)), NewExpr(42)]))
+check(e24)
+heap = []
+g = collect.Collector(100)
+assert cek.execute(e24, None, heap, g) == 42
+assert cek.execute(e24) == 42
+assert g.collections > 0 and g.peak <= 102 and len(heap) <= 102
+print(f"* value: {cek.execute(e24, None, [], collect.Collector(100))}")
+print(f"* collector: {g.collections} collections, peak {g.peak}, {g.freed} freed")
+
+print("---- escape ----")
+# Cells that do not escape are kept out of the heap, without changing
+# the value computed by any of the evaluators. A cell stored in a tuple
+# or captured by a closure escapes.
+import escape
+c = VarDecl("c", RefType(int))
+d = VarDecl("d", RefType(int))
+k = VarDecl("k", RefType(int))
+e25 = resolve(CallExpr(LambdaExpr([c, d, k], TupleExpr([
+  AssignExpr(IdExpr(c), AddExpr(DerefExpr(IdExpr(c)), 1)),
+  AssignExpr(IdExpr(c), MulExpr(DerefExpr(IdExpr(c)), DerefExpr(IdExpr(k)))),
+  ProjExpr(TupleExpr([IdExpr(d), 0]), 1),
+  CallExpr(LambdaExpr([("x", int)], DerefExpr(IdExpr(k))), [1]),
+  DerefExpr(IdExpr(c)),
+])), [NewExpr(4), NewExpr(1), NewExpr(10)]))
+check(e25)
+v = evaluate(e25, Env(), [])
+s = escape.Escaping()
+escape.escape(e25, s)
+assert (s.sites, s.local) == (3, 1)
+heap = []
+assert str(evaluate(e25, Env(), heap)) == str(v) and len(heap) == 2
+assert str(compile_expr(e25)(Env(), [])) == str(v)
+assert str(cek.execute(e25)) == str(v)
+assert str(vm.Machine().run(vm.assemble(e25))) == str(v)
+print(f"* value: {v}")
+print(f"* local: {s.local} of {s.sites} allocations")
+
+# Sharing first does not merge allocations, so the local one is still
+# found. A node that occurs twice is two sites, and is never local.
+for swap in (False, True):
+  es = [CallExpr(LambdaExpr([c], DerefExpr(IdExpr(c))), [NewExpr(0)]),
+        NewExpr(0)]
+  e26 = resolve(TupleExpr(es[::-1] if swap else es))
+  check(e26)
+  e26 = share.share(e26, share.Sharing())
+  s = escape.Escaping()
+  escape.escape(e26, s)
+  assert (s.sites, s.local) == (2, 1)
+  heap = []
+  evaluate(e26, Env(), heap)
+  assert len(heap) == 1
+n = NewExpr(0)
+e26 = resolve(TupleExpr([
+  CallExpr(LambdaExpr([c], DerefExpr(IdExpr(c))), [n]), n]))
+check(e26)
+s = escape.Escaping()
+escape.escape(e26, s)
+assert (s.sites, s.local) == (2, 0) and not n.local
+heap = []
+evaluate(e26, Env(), heap)
+assert len(heap) == 2
+print(f"* shared: {s.local} of {s.sites} allocations")
@@ -0,0 +1,504 @@
+from lang import *
+from decorate import *
+import evaluate as evaluation
+from evaluate import Location, Cell, Tuple, Record, Variant
+
+# This module implements a stack machine for the language and a compiler
+# from (resolved and checked) expressions to its instructions. It is a
+# continuation of the machine sketched in P2/sl.py, which covered only
+# the propositional calculus.
+#
+# A program consists of a sequence of instructions. Each instruction is
+# an opcode and a single operand, stored as two consecutive integers in
+# a flat list. Operands that are not integers (literals, labels, and the
+# code of lambda abstractions) are stored in a table of constants, and
+# the instruction refers to them by index.
+#
+# The instructions are:
+#
+#   push k    -- push constant k
+#   load i    -- push local variable i
+#   free i    -- push captured variable i
+#   and, or, not, add, sub, mul, div, rem, neg,
+#   eq, ne, lt, gt, le, ge
+#             -- pop the operand(s), push the result
+#   jump t    -- continue at instruction t
+#   jumpf t   -- pop a value; continue at t if it is false
+#   closure k -- pop the captured values and push a closure of code k
+#   call n    -- call the closure below the top n values (the arguments)
+#   ret       -- return the top of the stack to the caller
+#   new b     -- pop a value, allocate it, and push its location; if b
+#                is 1, push a local cell holding it instead
+#   deref     -- pop a location and push its value
+#   assign    -- pop a location and a value, and store the value
+#   tuple n   -- pop n values and push a tuple
+#   proj i    -- pop a tuple and push element i
+#   record k  -- pop values for the fields of the record type in
+#                constant k, push a record
+#   member n  -- pop a record and push the value at offset n
+#   variant k -- pop a value and push a variant whose type and tag are
+#                constant k
+#   case k    -- pop a variant; constant k maps its tag to a local
+#                variable (to hold its value) and an instruction
+#
+# The machine has a single, preallocated value stack. Each call creates
+# a frame on the stack: the arguments become the first local variables
+# of the callee, followed by any other locals (case variables), followed
+# by the operands of its instructions. Return addresses are saved in a
+# second set of preallocated arrays. Calls do not use Python's stack, so
+# the depth of recursion is limited only by the size of these arrays.
+
+PUSH = 0
+LOAD = 1
+FREE = 2
+AND = 3
+OR = 4
+NOT = 5
+ADD = 6
+SUB = 7
+MUL = 8
+DIV = 9
+REM = 10
+NEG = 11
+EQ = 12
+NE = 13
+LT = 14
+GT = 15
+LE = 16
+GE = 17
+JUMP = 18
+JUMPF = 19
+CLOSURE = 20
+CALL = 21
+RET = 22
+NEW = 23
+DEREF = 24
+ASSIGN = 25
+TUPLE = 26
+PROJ = 27
+RECORD = 28
+MEMBER = 29
+VARIANT = 30
+CASE = 31
+
+names = [
+  "push", "load", "free", "and", "or", "not", "add", "sub",
+  "mul", "div", "rem", "neg", "eq", "ne", "lt", "gt", "le", "ge", "jump",
+  "jumpf", "closure", "call", "ret", "new", "deref", "assign", "tuple",
+  "proj", "record", "member", "variant", "case",
+]
+
+class Code:
+  # The compiled code of a lambda abstraction (or a whole program).
+  def __init__(self, abs = None):
+    # The abstraction or None for a program.
+    self.abs = abs
+
+    # The instructions and constants.
+    self.ops = []
+    self.consts = []
+
+    # The number of local variables, including parameters.
+    self.nlocals = 0
+
+    # Maps declarations to the instructions that load them.
+    self.vars = {}
+
+  def emit(self, op, arg = 0):
+    # Append an instruction, returning its address.
+    self.ops += [op, arg]
+    return len(self.ops) - 2
+
+  def patch(self, at, arg):
+    # Set the operand of the instruction at the given address.
+    self.ops[at + 1] = arg
+
+  def const(self, v):
+    # Add a constant, returning its index.
+    self.consts += [v]
+    return len(self.consts) - 1
+
+  def local(self, var):
+    # Allocate a local variable for var, returning its index.
+    self.vars[var] = (LOAD, self.nlocals)
+    self.nlocals += 1
+    return self.nlocals - 1
+
+  def __str__(self):
+    lines = []
+    for pc in range(0, len(self.ops), 2):
+      lines += [f"{pc:4} {names[self.ops[pc]]} {self.ops[pc + 1]}"]
+    return "\n".join(lines)
+
+class Function:
+  # A closure: compiled code and the values of its captured variables.
+  __slots__ = ("code", "free")
+
+  def __init__(self, code, free):
+    self.code = code
+    self.free = free
+
+  def __str__(self):
+    return f"<{str(self.code.abs)}>"
+
+@checked
+def gen_value(e : Expr, c : Code):
+  c.emit(PUSH, c.const(e.value))
+
+@checked
+def gen_unary(e : Expr, c : Code, op : int):
+  gen(e.expr, c)
+  c.emit(op)
+
+@checked
+def gen_binary(e : Expr, c : Code, op : int):
+  # Operands are evaluated left to right.
+  gen(e.lhs, c)
+  gen(e.rhs, c)
+  c.emit(op)
+
+@checked
+def gen_if(e : Expr, c : Code):
+  #   <cond>
+  #   jumpf L1
+  #   <true>
+  #   jump L2
+  # L1:
+  #   <false>
+  # L2:
+  gen(e.cond, c)
+  j1 = c.emit(JUMPF)
+  gen(e.true, c)
+  j2 = c.emit(JUMP)
+  c.patch(j1, len(c.ops))
+  gen(e.false, c)
+  c.patch(j2, len(c.ops))
+
+@checked
+def gen_id(e : Expr, c : Code):
+  op, arg = c.vars[e.ref]
+  c.emit(op, arg)
+
+@checked
+def gen_lambda(e : Expr, c : Code):
+  # Compile the body of the abstraction into its own code. Parameters
+  # are the first locals; captured variables are loaded from the closure.
+  body = Code(e)
+  for v in e.vars:
+    body.local(v)
+  for i, v in enumerate(e.captures):
+    body.vars[v] = (FREE, i)
+  gen(e.expr, body)
+  body.emit(RET)
+
+  # Push the captured values, then build the closure.
+  for v in e.captures:
+    op, arg = c.vars[v]
+    c.emit(op, arg)
+  c.emit(CLOSURE, c.const(body))
+
+@checked
+def gen_call(e : Expr, c : Code):
+  gen(e.fn, c)
+  for a in e.args:
+    gen(a, c)
+  c.emit(CALL, len(e.args))
+
+@checked
+def gen_new(e : Expr, c : Code):
+  # The operand is 1 for a local allocation, which creates a cell.
+  gen(e.expr, c)
+  c.emit(NEW, 1 if e.local else 0)
+
+@checked
+def gen_assign(e : Expr, c : Code):
+  # Operands are evaluated right to left.
+  gen(e.rhs, c)
+  gen(e.lhs, c)
+  c.emit(ASSIGN)
+
+@checked
+def gen_tuple(e : Expr, c : Code):
+  for x in e.elems:
+    gen(x, c)
+  c.emit(TUPLE, len(e.elems))
+
+@checked
+def gen_proj(e : Expr, c : Code):
+  gen(e.obj, c)
+  c.emit(PROJ, e.index)
+
+@checked
+def gen_record(e : Expr, c : Code):
+  for f in e.fields:
+    gen(f.value, c)
+  c.emit(RECORD, c.const(e.type))
+
+@checked
+def gen_member(e : Expr, c : Code):
+  gen(e.obj, c)
+  c.emit(MEMBER, e.offset)
+
+@checked
+def gen_variant(e : Expr, c : Code):
+  gen(e.field.value, c)
+  c.emit(VARIANT, c.const((e.variant, e.tag)))
+
+@checked
+def gen_case(e : Expr, c : Code):
+  #   <expr>
+  #   case k   -- k maps the tag of li to (xi, Li)
+  # L1:
+  #   <e1>
+  #   jump L
+  #   ...
+  # L:
+  gen(e.expr, c)
+  table = [None] * len(e.table)
+  c.emit(CASE, c.const(table))
+  jumps = []
+  for x in e.cases:
+    target = (c.local(x.var), len(c.ops))
+    for i, y in enumerate(e.table):
+      if y is x:
+        table[i] = target
+    gen(x.expr, c)
+    jumps += [c.emit(JUMP)]
+  for j in jumps:
+    c.patch(j, len(c.ops))
+
+# Maps each kind of expression to the function that compiles it and
+# the opcode it uses (if any). See the corresponding table in
+# evaluate.py.
+generators = {
+  # Boolean expressions
+  BoolExpr: (gen_value,),
+  AndExpr: (gen_binary, AND),
+  OrExpr: (gen_binary, OR),
+  NotExpr: (gen_unary, NOT),
+  IfExpr: (gen_if,),
+
+  # Arithmetic expressions
+  IntExpr: (gen_value,),
+  AddExpr: (gen_binary, ADD),
+  SubExpr: (gen_binary, SUB),
+  MulExpr: (gen_binary, MUL),
+  DivExpr: (gen_binary, DIV),
+  RemExpr: (gen_binary, REM),
+  NegExpr: (gen_unary, NEG),
+
+  # Relational expressions
+  EqExpr: (gen_binary, EQ),
+  NeExpr: (gen_binary, NE),
+  LtExpr: (gen_binary, LT),
+  GtExpr: (gen_binary, GT),
+  LeExpr: (gen_binary, LE),
+  GeExpr: (gen_binary, GE),
+
+  # Functional expressions
+  IdExpr: (gen_id,),
+  LambdaExpr: (gen_lambda,),
+  CallExpr: (gen_call,),
+
+  # Reference expressions
+  NewExpr: (gen_new,),
+  DerefExpr: (gen_unary, DEREF),
+  AssignExpr: (gen_assign,),
+
+  # Data expressions
+  TupleExpr: (gen_tuple,),
+  ProjExpr: (gen_proj,),
+  RecordExpr: (gen_record,),
+  MemberExpr: (gen_member,),
+  VariantExpr: (gen_variant,),
+  CaseExpr: (gen_case,),
+}
+
+def gen(e : Expr, c : Code):
+  # Append the instructions that compute the value of e to c.
+  fn, *op = generators[type(e)]
+  fn(e, c, *op)
+
+@checked
+def assemble(e : Expr):
+  # Compile a resolved and checked expression into code for the
+  # machine.
+  c = Code()
+  gen(e, c)
+  c.emit(RET)
+  return c
+
+class Machine:
+  # The machine and its preallocated stacks.
+  def __init__(self, size = 1 << 16, depth = 1 << 14):
+    # The value stack, holding locals and operands.
+    self.stack = [None] * size
+
+    # The saved state of each caller: code, next instruction, frame
+    # pointer, and closure.
+    self.codes = [None] * depth
+    self.pcs = [0] * depth
+    self.fps = [0] * depth
+    self.fns = [None] * depth
+
+  def run(self, code, heap = None):
+    # Execute code, returning its value. The heap is a list of values,
+    # updated by any allocations and assignments.
+    if heap is None:
+      heap = []
+    S = self.stack
+    codes, pcs, fps, fns = self.codes, self.pcs, self.fps, self.fns
+    size = len(S)
+    limit = len(codes)
+
+    ops, consts, free = code.ops, code.consts, []
+    pc, fp, sp, depth = 0, 0, code.nlocals, 0
+
+    # The most frequently executed instructions are tested first.
+    while True:
+      op = ops[pc]
+      arg = ops[pc + 1]
+      pc += 2
+
+      if op == LOAD:
+        S[sp] = S[fp + arg]
+        sp += 1
+      elif op == PUSH:
+        S[sp] = consts[arg]
+        sp += 1
+      elif op == FREE:
+        S[sp] = free[arg]
+        sp += 1
+      elif op == ADD:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] + S[sp]
+      elif op == SUB:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] - S[sp]
+      elif op == MUL:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] * S[sp]
+      elif op == EQ:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] == S[sp]
+      elif op == LT:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] < S[sp]
+      elif op == JUMPF:
+        sp -= 1
+        if not S[sp]:
+          pc = arg
+      elif op == JUMP:
+        pc = arg
+      elif op == CALL:
+        f = S[sp - arg - 1]
+        if type(f) is not Function:
+          raise Exception("cannot apply a non-closure to an argument")
+        if depth == limit:
+          raise Exception("call stack overflow")
+        codes[depth] = code
+        pcs[depth] = pc
+        fps[depth] = fp
+        fns[depth] = free
+        depth += 1
+        code = f.code
+        ops, consts, free = code.ops, code.consts, f.free
+        fp = sp - arg
+        sp = fp + code.nlocals
+        if sp >= size:
+          raise Exception("value stack overflow")
+        pc = 0
+      elif op == RET:
+        v = S[sp - 1]
+        if depth == 0:
+          return v
+        depth -= 1
+        S[fp - 1] = v
+        sp = fp
+        code = codes[depth]
+        ops, consts = code.ops, code.consts
+        pc, fp, free = pcs[depth], fps[depth], fns[depth]
+      elif op == CLOSURE:
+        c = consts[arg]
+        n = len(c.abs.captures)
+        sp -= n
+        S[sp] = Function(c, S[sp:sp + n])
+        sp += 1
+      elif op == DIV:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] / S[sp]
+      elif op == REM:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] % S[sp]
+      elif op == NEG:
+        S[sp - 1] = -S[sp - 1]
+      elif op == NE:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] != S[sp]
+      elif op == GT:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] > S[sp]
+      elif op == LE:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] <= S[sp]
+      elif op == GE:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] >= S[sp]
+      elif op == AND:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] and S[sp]
+      elif op == OR:
+        sp -= 1
+        S[sp - 1] = S[sp - 1] or S[sp]
+      elif op == NOT:
+        S[sp - 1] = not S[sp - 1]
+      elif op == NEW:
+        if arg:
+          S[sp - 1] = Cell(S[sp - 1])
+        else:
+          heap.append(S[sp - 1])
+          S[sp - 1] = Location(len(heap) - 1)
+          evaluation.writes += 1
+      elif op == DEREF:
+        l1 = S[sp - 1]
+        if type(l1) is not Location:
+          if type(l1) is not Cell:
+            raise Exception("invalid reference")
+          S[sp - 1] = l1.value
+        else:
+          S[sp - 1] = heap[l1.index]
+      elif op == ASSIGN:
+        sp -= 1
+        l1 = S[sp]
+        if type(l1) is not Location:
+          if type(l1) is not Cell:
+            raise Exception("invalid reference")
+          l1.value = S[sp - 1]
+        else:
+          heap[l1.index] = S[sp - 1]
+          evaluation.writes += 1
+        S[sp - 1] = None
+      elif op == TUPLE:
+        sp -= arg
+        S[sp] = Tuple(S[sp:sp + arg])
+        sp += 1
+      elif op == PROJ:
+        S[sp - 1] = S[sp - 1].values[arg]
+      elif op == RECORD:
+        t = consts[arg]
+        n = len(t.fields)
+        sp -= n
+        S[sp] = Record(t, tuple(S[sp:sp + n]))
+        sp += 1
+      elif op == MEMBER:
+        S[sp - 1] = S[sp - 1].values[arg]
+      elif op == VARIANT:
+        t, tag = consts[arg]
+        S[sp - 1] = Variant(t, tag, S[sp - 1])
+      elif op == CASE:
+        sp -= 1
+        v1 = S[sp]
+        slot, pc = consts[arg][v1.tag]
+        S[fp + slot] = v1.value
+      else:
+        assert False